@@ -1,22 +1,55 @@
 # route_helper.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, jsonify, make_response, request, stream_with_context
 from flask_cors import CORS
-from pathlib import Path
-from datetime import datetime
-import os
+import contextvars
+import logging
 import json
 import time
-import math
-import requests
-import re
-
-# ---------- Config & env loader (same pattern you used) --------------------
-from dotenv import load_dotenv
-load_dotenv(dotenv_path=Path(__file__).parent / ".env")
-
-GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise RuntimeError("GOOGLE_API_KEY not found in environment")
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import suggest_core
+from suggest_core import (
+    DEFAULT_COVERAGE_TARGET,
+    GOOGLE_API_KEY,
+    MAX_NEARBY_PAGES,
+    PAGE_TOKEN_RETRY_DELAYS,
+    PAGINATION_ENOUGH_FACTOR,
+    PLACES_MAX_WORKERS,
+    STREAM_MIMETYPES,
+    SuggestRequestError,
+    _status_ok,
+    _store_nearby,
+    add_places,
+    candidate_result,
+    format_event,
+    format_search_results,
+    insertion_points,
+    leg_cache,
+    location_literal,
+    maps_cache,
+    parse_suggest_request,
+    place_tiles,
+    plan_search,
+    rank_candidates,
+    route_path,
+    shortlist_event,
+    stream_format,
+    suggest_cache,
+    summarize_route,
+    summary_event,
+)
+from detour import iter_insertion_scores
+from maps_client import MapsClient
+import metrics
+import profiling
+from suggest_cache import MISS, STALE, etag_for, etag_matches, replay_events, response_headers, summary_body, with_stops
+
+# LOG_LEVEL=DEBUG brings back the per-request and per-candidate detail
+metrics.configure_logging()
+logger = logging.getLogger(__name__)
+# Built now so a missing PROFILING_TOKEN is reported at startup
+profiling.get_profiler()
 
 # Optional: you may already have gemini configured. If you want Gemini
 # to rank/describe POIs, uncomment and configure it similarly to your old file:
@@ -28,90 +61,34 @@ if not GOOGLE_API_KEY:
 app = Flask(__name__)
 CORS(app)
 
-# ---------- Utilities -----------------------------------------------------
-
-def haversine_meters(a, b):
-    """Return distance in meters between two (lat, lng) pairs."""
-    lat1, lon1 = a
-    lat2, lon2 = b
-    R = 6371000.0
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    hav = math.sin(dphi/2.0)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2.0)**2
-    return 2 * R * math.asin(math.sqrt(hav))
-
-def decode_polyline(polyline_str):
-    """Decodes a polyline that Google Directions returns into list of (lat, lng)."""
-    # Implementation adapted from standard polyline decode algorithm
-    index, lat, lng = 0, 0, 0
-    coordinates = []
-    changes = {'lat': 0, 'lng': 0}
-
-    while index < len(polyline_str):
-        for key in ('lat', 'lng'):
-            shift = 0
-            result = 0
-            while True:
-                byte = ord(polyline_str[index]) - 63
-                index += 1
-                result |= (byte & 0x1f) << shift
-                shift += 5
-                if byte < 0x20:
-                    break
-            d = ~(result >> 1) if (result & 1) else (result >> 1)
-            if key == 'lat':
-                lat += d
-            else:
-                lng += d
-        coordinates.append((lat / 1e5, lng / 1e5))
-    return coordinates
-
-def sample_along_polyline(points, every_m=1500):
-    """
-    Return a list of sample points (lat,lng) spaced approximately every 'every_m' meters
-    along the polyline defined by points (list of lat,lng).
-    """
-    if not points:
-        return []
-    samples = [points[0]]
-    accumulated = 0.0
-    prev = points[0]
-    # Walk segments and emit samples when we accumulate distance >= every_m
-    for p in points[1:]:
-        seg_len = haversine_meters(prev, p)
-        if seg_len == 0:
-            prev = p
-            continue
-        # move along segment in proportion to where sample falls
-        while accumulated + seg_len >= every_m:
-            remain = every_m - accumulated
-            frac = remain / seg_len
-            lat = prev[0] + (p[0] - prev[0]) * frac
-            lng = prev[1] + (p[1] - prev[1]) * frac
-            samples.append((lat, lng))
-            # new 'prev' becomes that sampled point; reduce seg_len & continue
-            prev = (lat, lng)
-            seg_len = haversine_meters(prev, p)
-            accumulated = 0.0
-        accumulated += seg_len
-        prev = p
-    return samples
+@app.before_request
+def _start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    started = g.get("started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_SECONDS.observe(
+            time.perf_counter() - started, method=request.method, route=route, status=response.status_code
+        )
+    if g.get("profile_id"):
+        response.headers[profiling.ID_HEADER] = g.profile_id
+    return response
 
-# ---------- Google Maps API helpers ---------------------------------------
+# Pooled, retrying HTTP client behind every Google Maps call (see maps_client.py),
+# rate limited per endpoint across all worker processes (see quota.py).
+maps = MapsClient.from_env(GOOGLE_API_KEY, governor=suggest_core.governor)
 
-BASE_GEOCODE = "https://maps.googleapis.com/maps/api/geocode/json"
-BASE_DIRECTIONS = "https://maps.googleapis.com/maps/api/directions/json"
-BASE_PLACES_NEARBY = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-BASE_PLACE_DETAILS = "https://maps.googleapis.com/maps/api/place/details/json"
+# ---------- Google Maps API helpers ---------------------------------------
 
 def geocode_address(address):
     """Return (lat, lng) for a given address string using Geocoding API."""
-    params = {"address": address, "key": GOOGLE_API_KEY}
-    r = requests.get(BASE_GEOCODE, params=params)
-    r.raise_for_status()
-    data = r.json()
+    params = {"address": address}
+    data = maps_cache.get_or_fetch(
+        "geocode", params, lambda: maps.get("geocode", params), cacheable=_status_ok
+    )
     if data.get("status") != "OK" or not data.get("results"):
         return None
     loc = data["results"][0]["geometry"]["location"]
@@ -123,54 +100,182 @@ def directions_json(origin, destination, waypoints=None, departure_time=None):
     waypoints: list of "lat,lng" or address strings (will be joined).
     Returns the raw directions JSON.
     """
-    params = {"origin": origin, "destination": destination, "key": GOOGLE_API_KEY}
+    params = {"origin": origin, "destination": destination}
     if waypoints:
         # join waypoints with pipe, encode 'via:' if needed
         params["waypoints"] = "|".join(waypoints)
     if departure_time:
         params["departure_time"] = str(departure_time)
-    r = requests.get(BASE_DIRECTIONS, params=params)
-    r.raise_for_status()
-    return r.json()
 
-def places_near(lat, lng, radius=1000, place_type=None, keyword=None):
+    return maps_cache.get_or_fetch(
+        "directions", params, lambda: maps.get("directions", params), cacheable=_status_ok
+    )
+
+def distance_matrix_json(origins, destinations):
     """
-    Call Places Nearby Search around (lat,lng). Returns list of places (raw).
-    place_type: Google Places type string (e.g., 'cafe', 'restaurant', 'park').
-    keyword: free-text keyword to match.
+    origins/destinations: lists of "lat,lng" or address strings.
+    Returns the raw Distance Matrix JSON.
+    """
+    params = {
+        "origins": "|".join(origins),
+        "destinations": "|".join(destinations),
+    }
+    return maps_cache.get_or_fetch(
+        "distance_matrix", params, lambda: maps.get("distance_matrix", params), cacheable=_status_ok
+    )
+
+class NearbyPages:
+    """
+    One Places Nearby search whose first page is available immediately while
+    any further pages are fetched in the background.
+
+    first: results of the first page
+    rest(): block until the background pages are in and return them
+    cancel(): stop paginating (nothing is fetched after the current try)
+    Whatever pages arrived are cached when pagination stops; a search that
+    was cancelled or failed is recorded as incomplete.
+
+    Each search paginates on its own thread. They spend most of their time
+    waiting for the page token to become valid, and a shared pool of such
+    sleepers would hold up every other request's pages.
+    """
+
+    def __init__(self, query, first, next_token=None):
+        self.query = query  # (params, lat, lng, radius, place_type, keyword)
+        self.first = first
+        self._cancelled = threading.Event()
+        self._future = None
+        if next_token:
+            self._future = Future()
+            threading.Thread(target=self._run, args=(next_token,), daemon=True, name="nearby-pages").start()
+
+    @classmethod
+    def done(cls, results):
+        """Pages that are already complete (cache / tile hits)."""
+        return cls(None, results)
+
+    def _run(self, token):
+        try:
+            self._future.set_result(self._fetch_rest(token))
+        except BaseException as e:
+            self._future.set_exception(e)
+
+    def _fetch_rest(self, token):
+        params = self.query[0]
+        extra = []
+        pages = 1
+        try:
+            while token and pages < MAX_NEARBY_PAGES:
+                data = None
+                for delay in PAGE_TOKEN_RETRY_DELAYS:
+                    waited = time.perf_counter()
+                    cancelled = self._cancelled.wait(delay)
+                    # Runs after the request has returned, so this lands in the "background" pipeline
+                    metrics.observe_stage("page_token_wait", time.perf_counter() - waited)
+                    if cancelled:
+                        return extra, token
+                    data = maps.get("nearby", {**params, "pagetoken": token})
+                    if data.get("status") != "INVALID_REQUEST":
+                        break
+                if not data or data.get("status") not in ("OK", "ZERO_RESULTS"):
+                    return extra, token
+                extra.extend(data.get("results", []))
+                token = data.get("next_page_token")
+                pages += 1
+            return extra, token
+        finally:
+            _store_nearby(self.query, self.first + extra, complete=not token)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def rest(self, timeout=None):
+        if self._future is None:
+            return []
+        return self._future.result(timeout=timeout)[0]
+
+    def all(self, timeout=None):
+        return self.first + self.rest(timeout=timeout)
+
+def places_near_pages(lat, lng, radius=1000, place_type=None, keyword=None):
+    """
+    Start a Places Nearby Search around (lat,lng) and return a NearbyPages
+    as soon as the first page is in. Cache and tile hits come back complete.
     """
     params = {
         "location": f"{lat},{lng}",
         "radius": int(radius),
-        "key": GOOGLE_API_KEY,
     }
     if place_type:
         params["type"] = place_type
     if keyword:
         params["keyword"] = keyword
-    r = requests.get(BASE_PLACES_NEARBY, params=params)
-    r.raise_for_status()
-    data = r.json()
-    # handle pagination: if next_page_token exists, you may need to wait and call again.
+    cached = maps_cache.get("nearby", params)
+    if cached is not None:
+        return NearbyPages.done(cached)
+    # Circles already covered by fully fetched tiles are answered locally
+    if place_tiles is not None:
+        tiled = place_tiles.lookup(lat, lng, radius, place_type, keyword)
+        if tiled is not None:
+            return NearbyPages.done(tiled)
+    data = maps.get("nearby", params)
+    query = (params, lat, lng, radius, place_type, keyword)
     results = data.get("results", [])
     next_page = data.get("next_page_token")
-    # naive support for one additional page (sleep required per Google docs)
-    if next_page:
-        time.sleep(2)  # short sleep; sometimes 2s is enough, sometimes you need 1-2s
-        r2 = requests.get(BASE_PLACES_NEARBY, params={**params, "pagetoken": next_page})
-        r2.raise_for_status()
-        results.extend(r2.json().get("results", []))
-    return results
+    if data.get("status") not in ("OK", "ZERO_RESULTS"):
+        return NearbyPages.done(results)
+    if not next_page:
+        _store_nearby(query, results, complete=True)
+    return NearbyPages(query, results, next_page)
+
+def places_near(lat, lng, radius=1000, place_type=None, keyword=None):
+    """
+    Call Places Nearby Search around (lat,lng). Returns list of places (raw).
+    place_type: Google Places type string (e.g., 'cafe', 'restaurant', 'park').
+    keyword: free-text keyword to match.
+    Blocks until every page is in; use places_near_pages to get the first
+    page right away.
+    """
+    return places_near_pages(lat, lng, radius, place_type, keyword).all()
 
 def get_place_details(place_id, fields=None):
-    params = {"place_id": place_id, "key": GOOGLE_API_KEY}
+    params = {"place_id": place_id}
     if fields:
-        params["fields"] = ",".join(fields)
-    r = requests.get(BASE_PLACE_DETAILS, params=params)
-    r.raise_for_status()
-    return r.json().get("result")
-
-BASE_PLACES_TEXTSEARCH = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+        params["fields"] = ",".join(sorted(fields))
+    return maps_cache.get_or_fetch("details", params, lambda: maps.get("details", params).get("result"))
+
+def text_search(query):
+    """Places Text Search for a free-text query. Returns the raw JSON."""
+    params = {"query": query}
+    return maps_cache.get_or_fetch(
+        "textsearch", params, lambda: maps.get("textsearch", params), cacheable=lambda d: d.get("status") in ("OK", "ZERO_RESULTS")
+    )
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus text format: stage, upstream and HTTP latency histograms (this process only)."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/profiles", methods=["GET"])
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def get_profiles(profile_id=None):
+    """Saved request profiles (PROFILING_ENABLED=1); see profiling.py."""
+    status, body, content_type = profiling.download(profile_id, request.headers, request.args)
+    return Response(body, status=status, content_type=content_type)
+
+@app.route("/maps_stats", methods=["GET"])
+def maps_stats():
+    """Per-endpoint call counts, retries, errors and latency of upstream Google calls."""
+    return jsonify(maps.stats())
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """Hit/miss counters and sizes for the Google Maps and /suggest_stops response caches."""
+    stats = maps_cache.stats()
+    if place_tiles is not None:
+        stats["place_tiles"] = place_tiles.stats()
+    stats["suggest_stops"] = suggest_cache.stats()
+    return jsonify(stats)
 
 @app.route("/search_place", methods=["POST"])
 def search_place():
@@ -178,7 +283,7 @@ def search_place():
     Search for a place using Google Places Text Search API, formats the
     response to ensure it's compatible with the frontend.
     """
-    print("Received search_place request")
+    logger.debug("search_place request")
     data = request.json or {}
     query = data.get("query")
 
@@ -186,26 +291,8 @@ def search_place():
         return jsonify({"error": "Query parameter required"}), 400
     
     try:
-        params = {
-            "query": query,
-            "key": GOOGLE_API_KEY
-        }
-        
-        response = requests.get(BASE_PLACES_TEXTSEARCH, params=params)
-        response.raise_for_status()
-        
-        # Process the response before sending it back
-        google_data = response.json()
-        
-        # **This is the key fix**: Ensure every result has a 'name' field.
-        # If 'name' doesn't exist, use 'formatted_address' as a fallback.
-        if google_data.get("results"):
-            for result in google_data["results"]:
-                if "name" not in result:
-                    result["name"] = result.get("formatted_address", "Unknown Place")
-        
-        return jsonify(google_data)
-        
+        return jsonify(format_search_results(text_search(query)))
+
     except Exception as e:
         return jsonify({"error": f"Places API error: {str(e)}"}), 500
 
@@ -219,13 +306,10 @@ def normalize_location_input(loc):
       - plain address string
     Return a tuple (lat,lng) if possible else None and the original string for API usage.
     """
-    if isinstance(loc, dict) and "lat" in loc and "lng" in loc:
-        return (float(loc["lat"]), float(loc["lng"])), f"{loc['lat']},{loc['lng']}"
+    literal = location_literal(loc)
+    if literal:
+        return literal
     if isinstance(loc, str):
-        m = re.match(r"^\s*([-+]?\d+(\.\d+)?),\s*([-+]?\d+(\.\d+)?)\s*$", loc)
-        if m:
-            lat, lng = float(m.group(1)), float(m.group(3))
-            return (lat, lng), f"{lat},{lng}"
         # else assume address string, try geocoding
         coords = geocode_address(loc)
         if coords:
@@ -234,113 +318,327 @@ def normalize_location_input(loc):
             return None, loc
     return None, str(loc)
 
-def find_candidates_along_route(stops, desired_type=None, keyword=None, sample_every_m=1500, search_radius=1200, max_candidates=25):
+def route_directions(addr_strs):
     """
-    stops: ordered list of destinations (strings addresses or lat,lng or dicts)
-    desired_type: places type (e.g., 'cafe', 'restaurant', 'park')
-    keyword: additional free-text filter (e.g., 'vegan', 'museum')
-    Returns list of candidate POIs with metadata.
+    Directions for the stops in order (first -> last via the rest as waypoints).
+    Returns (directions JSON, decoded overview polyline as an (N, 2) array).
     """
-    # Build directions for full route to obtain polyline(s).
-    # We'll request directions between the first and last stop, using intermediate stops as waypoints.
-    if len(stops) < 2:
-        raise ValueError("At least two stops required to define a route")
-
-    # Normalize inputs and create address strings for Directions API
-    norm = [normalize_location_input(s) for s in stops]
-    coords = [n[0] for n in norm]
-    addr_strs = [n[1] for n in norm]
-    if any(c is None for c in coords):
-        raise ValueError("Unable to geocode one or more stops")
-
     origin = addr_strs[0]
     destination = addr_strs[-1]
     waypoints = addr_strs[1:-1] or None
 
     directions = directions_json(origin, destination, waypoints=waypoints)
-    if directions.get("status") != "OK" or not directions.get("routes"):
-        raise RuntimeError(f"Directions API failed: {directions.get('status')}")
-
-    # Collect polylines from each leg/step to build full path
-    route = directions["routes"][0]
-    overview_polyline = route.get("overview_polyline", {}).get("points")
-    if not overview_polyline:
-        raise RuntimeError("No polyline in directions response")
-    full_path = decode_polyline(overview_polyline)
-
-    # Sample points along the polyline
-    samples = sample_along_polyline(full_path, every_m=sample_every_m)
-
-    # For each sample, call Places Nearby Search and collect unique places (by place_id)
-    place_map = {}  # place_id -> place dict (combine fields)
-    for pt in samples:
-        lat, lng = pt
-        try:
-            results = places_near(lat, lng, radius=search_radius, place_type=desired_type, keyword=keyword)
-        except Exception as e:
-            # avoid hard failure for one sample point
-            print(f"Places API error at sample {pt}: {e}")
-            continue
-        for p in results:
-            pid = p.get("place_id")
-            if not pid:
+    return directions, route_path(directions)
+
+class RouteContext(suggest_core.RouteContext):
+    """suggest_core.RouteContext that geocodes and routes itself with the blocking Maps client."""
+
+    @classmethod
+    def resolve(cls, stops):
+        """
+        Normalize stops, geocoding each distinct address once. Raises
+        ValueError naming the first stop that can't be geocoded.
+        """
+        coords, addr_strs = [], []
+        seen = {}
+        for i, s in enumerate(stops):
+            key = json.dumps(s, sort_keys=True)
+            if key not in seen:
+                seen[key] = normalize_location_input(s)
+            c, addr_str = seen[key]
+            if c is None:
+                raise ValueError(f"Unable to geocode stop: {s}")
+            coords.append(c)
+            addr_strs.append(addr_str)
+            logger.debug("Normalized stop %d: %s -> %s", i, c, addr_str)
+        return cls(stops, coords, addr_strs)
+
+    def fetch_route(self):
+        """Route through the stops (once) and derive the per-leg state."""
+        if self.directions is not None:
+            return self
+        with metrics.span("directions"):
+            return self.use_route(*route_directions(self.addr_strs))
+
+def search_candidates(route, desired_type=None, keyword=None, sample_every_m=1500, search_radius=1200, max_candidates=25, time_constraint_seconds=None, corridor_m=None, coverage_target=DEFAULT_COVERAGE_TARGET, enough_candidates=None):
+    """
+    Search Places Nearby along a routed RouteContext and rank the results.
+    Parameters are described in find_candidates_along_route.
+    Returns (candidates, search_plan).
+    """
+    samples, search_plan = plan_search(route, sample_every_m, search_radius, corridor_m, coverage_target)
+
+    # Query Places Nearby for every sample concurrently (bounded pool), then
+    # merge in sample order so place_map is the same as a serial walk would give.
+    # Only first pages are waited on here; later pages keep loading meanwhile.
+    def search(pt):
+        return places_near_pages(pt[0], pt[1], radius=pt[2], place_type=desired_type, keyword=keyword)
+
+    with metrics.span("nearby_search"):
+        with ThreadPoolExecutor(max_workers=max(1, min(PLACES_MAX_WORKERS, len(samples)))) as pool:
+            # Each search runs in a copy of this context so the request's trace sees its calls
+            futures = [pool.submit(contextvars.copy_context().run, search, pt) for pt in samples]
+
+        place_map = {}  # place_id -> place dict (combine fields)
+        searches = []
+        for pt, future in zip(samples, futures):
+            try:
+                pages = future.result()
+            except Exception as e:
+                # avoid hard failure for one sample point
+                logger.warning("Places API error at sample %s: %s", pt, e)
                 continue
-            # keep the closest geometry info, rating, user_ratings_total etc.
-            if pid not in place_map:
-                place_map[pid] = {
-                    "place_id": pid,
-                    "name": p.get("name"),
-                    "vicinity": p.get("vicinity"),
-                    "location": p.get("geometry", {}).get("location"),
-                    "types": p.get("types", []),
-                    "rating": p.get("rating"),
-                    "user_ratings_total": p.get("user_ratings_total"),
-                    "source_sample_point": {"lat": lat, "lng": lng},
-                }
-        # Avoid hitting rate limits aggressively
-        time.sleep(0.1)
-
-    # Trim to max_candidates
-    candidates = list(place_map.values())[:max_candidates]
-    return candidates, directions
-
-def compute_total_time_with_insertion(stops_addr_list, insert_point_idx, candidate_loc_str):
+            add_places(place_map, pt, pages.first)
+            searches.append((pt, pages))
+
+    # Follow-up pages only matter while we're short of candidates to rank
+    if enough_candidates is None:
+        enough_candidates = PAGINATION_ENOUGH_FACTOR * max_candidates
+    with metrics.span("pagination_wait"):
+        for pt, pages in searches:
+            if enough_candidates and len(place_map) >= enough_candidates:
+                pages.cancel()
+                continue
+            try:
+                add_places(place_map, pt, pages.rest())
+            except Exception as e:
+                logger.warning("Places API pagination error at sample %s: %s", pt, e)
+
+    with metrics.span("prefilter"):
+        candidates = rank_candidates(route, place_map, max_candidates, time_constraint_seconds)
+    return candidates, search_plan
+
+def find_candidates_along_route(stops, desired_type=None, keyword=None, sample_every_m=1500, search_radius=1200, max_candidates=25, time_constraint_seconds=None, corridor_m=None, coverage_target=DEFAULT_COVERAGE_TARGET, enough_candidates=None):
+    """
+    stops: ordered list of destinations (strings addresses or lat,lng or
+      dicts), or an already resolved RouteContext
+    desired_type: places type (e.g., 'cafe', 'restaurant', 'park')
+    keyword: additional free-text filter (e.g., 'vegan', 'museum')
+    time_constraint_seconds: optional max added detour; candidates whose
+      geometric estimate is far beyond it are dropped before any scoring
+    corridor_m / coverage_target: search circles are planned to cover this
+      half-width around the route (see search_coverage.py; by default the
+      strip fixed spacing always reached); coverage_target=0 falls back to
+      one circle of search_radius every sample_every_m
+    enough_candidates: stop paginating Nearby results once this many unique
+      places are known (default PAGINATION_ENOUGH_FACTOR * max_candidates,
+      0 = always fetch every page)
+    Returns (candidates, directions, search_plan). Candidates are best
+    estimated detour first and each carries a "route_projection" with its
+    insertion leg; search_plan reports queries made vs naive sampling.
+    """
+    # Build directions for full route to obtain polyline(s).
+    # We'll request directions between the first and last stop, using intermediate stops as waypoints.
+    if isinstance(stops, RouteContext):
+        route = stops
+    else:
+        if len(stops) < 2:
+            raise ValueError("At least two stops required to define a route")
+        route = RouteContext.resolve(stops)
+    route.fetch_route()
+    candidates, search_plan = search_candidates(
+        route,
+        desired_type=desired_type,
+        keyword=keyword,
+        sample_every_m=sample_every_m,
+        search_radius=search_radius,
+        max_candidates=max_candidates,
+        time_constraint_seconds=time_constraint_seconds,
+        corridor_m=corridor_m,
+        coverage_target=coverage_target,
+        enough_candidates=enough_candidates,
+    )
+    return candidates, route.directions, search_plan
+
+def directions_leg(origin, destination):
+    """
+    Duration/distance of a single origin->destination leg, served from
+    leg_cache when known and otherwise from a one-leg Directions request.
+    Returns {"duration": s, "distance": m} or None plus the raw response on failure.
     """
-    Compute directions for the itinerary with candidate inserted between stops at index insert_point_idx and insert_point_idx+1.
+    leg = leg_cache.get(origin, destination)
+    if leg:
+        return leg, None
+    resp = directions_json(origin, destination)
+    if resp.get("status") != "OK" or not resp.get("routes"):
+        return None, resp
+    raw = resp["routes"][0]["legs"][0]
+    leg = leg_cache.put(
+        origin, destination,
+        raw.get("duration", {}).get("value", 0),
+        raw.get("distance", {}).get("value", 0),
+    )
+    return leg, resp
+
+def compute_total_time_with_insertion(stops_addr_list, insert_point_idx, candidate_loc_str, base_directions=None):
+    """
+    Compute total travel time for the itinerary with candidate inserted between stops at index insert_point_idx and insert_point_idx+1.
     stops_addr_list: list of address strings passed to Google Directions API
     insert_point_idx: index of the stop AFTER which the candidate will be inserted (0-based)
       e.g. if insert_point_idx = 0, candidate inserted between stops[0] and stops[1]
     candidate_loc_str: "lat,lng" or address string
-    Returns total_duration_seconds and the directions response.
+    base_directions: optional Directions response for stops_addr_list; its legs
+      seed leg_cache so only stop->candidate and candidate->stop are requested
+    Returns total_duration_seconds and the list of legs
+    ({"start", "end", "duration", "distance"}), or (None, failing response).
     """
     if insert_point_idx < 0 or insert_point_idx >= len(stops_addr_list) - 1:
         raise IndexError("insert_point_idx out of valid range")
 
+    if base_directions is not None:
+        leg_cache.seed_from_directions(stops_addr_list, base_directions)
+
     # Build new stops list with candidate
     new_stops = stops_addr_list[:insert_point_idx + 1] + [candidate_loc_str] + stops_addr_list[insert_point_idx + 1:]
-    # Use Directions between new_stops[0] and new_stops[-1], and pass intermediate waypoints
-    origin = new_stops[0]
-    destination = new_stops[-1]
-    waypoints = new_stops[1:-1] or None
-    resp = directions_json(origin, destination, waypoints=waypoints)
-    if resp.get("status") != "OK":
-        # bubble the error upwards
-        return None, resp
-    # Compute total duration across legs
-    route = resp["routes"][0]
+    # Price leg by leg; untouched legs come straight from leg_cache
+    legs = []
     total_seconds = 0
-    for leg in route.get("legs", []):
-        leg_dur = leg.get("duration", {}).get("value", 0)
-        total_seconds += int(leg_dur)
-    return total_seconds, resp
+    for a, b in zip(new_stops, new_stops[1:]):
+        leg, resp = directions_leg(a, b)
+        if leg is None:
+            # bubble the error upwards
+            return None, resp
+        legs.append({"start": a, "end": b, **leg})
+        total_seconds += leg["duration"]
+    return total_seconds, legs
+
+# ---------- Suggest-stops pipeline ----------------------------------------
+
+def resolve_stops(stops):
+    """Normalize stops and geocode if needed. Returns an unrouted RouteContext."""
+    try:
+        with metrics.span("geocode"):
+            return RouteContext.resolve(stops)
+    except ValueError as e:
+        logger.info("%s", e)
+        raise SuggestRequestError(str(e))
+
+def iter_scored_candidates(candidates, route, time_constraint_seconds=None):
+    """
+    Price candidates (from search_candidates) against a routed RouteContext
+    and yield result dicts in the order they finish. Candidates over
+    time_constraint_seconds are skipped.
+    """
+    orig_total_seconds = route.total_seconds
+    placed = insertion_points(candidates)
+    scores = iter_insertion_scores(
+        route.addr_strs,
+        route.leg_durations,
+        [(loc_str, leg_idx) for _, leg_idx, _, loc_str in placed],
+        distance_matrix_json,
+        leg_cache=leg_cache,
+    )
+
+    for i, score in scores:
+        c, best_idx, offset_m, loc_str = placed[i]
+        if score is not None:
+            added = int(score["added_seconds"])
+            total_seconds_with = orig_total_seconds + added
+        else:
+            # Matrix had no element for this one; price the two new legs exactly
+            try:
+                total_seconds_with, _ = compute_total_time_with_insertion(route.addr_strs, best_idx, loc_str)
+            except Exception as e:
+                logger.warning("Directions error pricing %s: %s", c.get("name"), e)
+                continue
+            if total_seconds_with is None:
+                logger.debug("No route for %s - skipping", c.get("name"))
+                continue
+            added = int(total_seconds_with - orig_total_seconds)
+        result = candidate_result(c, best_idx, offset_m, total_seconds_with, added, time_constraint_seconds)
+        if result is not None:
+            yield result
+
+def suggest_stops_events(opts, route):
+    """
+    Run the suggest-stops pipeline for a resolved RouteContext, yielding events as
+    each stage finishes:
+      {"event": "route", "route_summary": {...}}       after Directions
+      {"event": "shortlist", "candidates": [...]}     after Nearby, with
+          geometric estimates (estimated_added_time_seconds) only
+      {"event": "candidate", "candidate": {...}}      one per priced candidate
+      {"event": "summary", ...}                       the full /suggest_stops
+          response, candidates sorted by added time
+    """
+    route.fetch_route()
+    route_summary = summarize_route(route, opts)
+    yield {"event": "route", "route_summary": route_summary}
+
+    candidates, search_plan = search_candidates(
+        route,
+        desired_type=opts["desired_type"],
+        keyword=opts["keyword"],
+        sample_every_m=opts["sample_every_m"],
+        search_radius=opts["search_radius"],
+        max_candidates=opts["max_candidates"],
+        time_constraint_seconds=opts["time_constraint_seconds"],
+        corridor_m=opts["corridor_m"],
+        coverage_target=opts["coverage_target"],
+    )
+    route_summary = {**route_summary, "search_plan": search_plan}
+    yield shortlist_event(candidates, search_plan)
+
+    results = []
+    scored = iter_scored_candidates(candidates, route, opts["time_constraint_seconds"])
+    while True:
+        # Time only the scoring, not whoever consumes the events in between
+        with metrics.span("detour_scoring"):
+            result = next(scored, None)
+        if result is None:
+            break
+        results.append(result)
+        yield {"event": "candidate", "candidate": result}
+
+    yield summary_event(route_summary, candidates, results)
+
+def plan_body(opts, route):
+    """Run the whole pipeline for an unrouted RouteContext; returns the plain JSON body."""
+    return summary_body(list(suggest_stops_events(opts, route))[-1])
+
+def _stream_format():
+    return stream_format(request.args.get("stream"), request.headers.get("Accept"))
+
+def _stream_response(events, fmt, trace=None):
+    def generate():
+        trace_ = trace or metrics.Trace("suggest_stops")
+        try:
+            with metrics.active(trace_):
+                for event in events:
+                    with metrics.span("serialization"):
+                        chunk = format_event(event, fmt)
+                    yield chunk
+        except Exception as e:
+            logger.exception("Error in suggest_stops stream: %s", e)
+            yield format_event({"event": "error", "error": f"Internal server error: {str(e)}"}, fmt)
+        finally:
+            trace_.finish()
+
+    response = Response(stream_with_context(generate()), mimetype=STREAM_MIMETYPES[fmt])
+    # Keep proxies (nginx) from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Cache"] = MISS.upper()
+    return response
+
+def _plan_response(entry, state, stops, fmt=None):
+    """A cached (or just computed) answer: 304 if If-None-Match still matches, else JSON or replayed events."""
+    body = with_stops(entry["body"], stops)
+    with metrics.span("serialization"):
+        etag = etag_for(body)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            response = make_response("", 304)
+        elif fmt:
+            response = Response("".join(format_event(e, fmt) for e in replay_events(body)), mimetype=STREAM_MIMETYPES[fmt])
+        else:
+            response = jsonify(body)
+    response.headers.update(response_headers(entry, state, etag))
+    return response
 
 # ---------- Flask route ---------------------------------------------------
 
 @app.route("/suggest_stops", methods=["POST", "OPTIONS"])
 def suggest_stops():
-    print(f"suggest_stops endpoint called with method: {request.method}")
-    print(f"Request headers: {dict(request.headers)}")
-    print(f"Request data: {request.get_data()}")
+    logger.debug("suggest_stops %s: %s", request.method, request.get_data())
     
     # Handle preflight OPTIONS request
     if request.method == "OPTIONS":
@@ -358,163 +656,72 @@ def suggest_stops():
       "keyword": "vegan"       # optional free text
       "sample_every_m": 1500,
       "search_radius": 1200,
+      "corridor_m": 937,       # optional: half-width of the corridor to search
+      "coverage_target": 0.95, # optional: 0 = fixed sample_every_m spacing
       "max_candidates": 20,
       "time_constraint_seconds": 1800   # optional: max allowed added detour in seconds
     }
+
+    The search covers a corridor of corridor_m either side of the route. By
+    default that is the strip fixed-spacing circles always reached,
+    sqrt(search_radius^2 - (sample_every_m / 2)^2) (937 m with the defaults),
+    so the plan doesn't miss places fixed spacing was sure to find. It never
+    uses more queries than fixed spacing would.
+
+    Each candidate says where it goes (insert_between: the stops it sits
+    between) and how far it is from the route: distance_off_route_m to the
+    route polyline, and insert_leg_distance_to_sample_m, as always, to the
+    midpoint of that leg's two stops.
+
+    Add ?stream=ndjson (or Accept: application/x-ndjson) for newline-delimited
+    JSON events, or ?stream=sse (Accept: text/event-stream) for Server-Sent
+    Events; see suggest_stops_events for the event sequence. The final
+    "summary" event carries the same body as the plain JSON response.
+
+    Answers are cached per resolved request (suggest_cache.py): repeats come
+    back with X-Cache: HIT (or STALE while a refresh runs), streamed ones as
+    route, candidate... and summary events. Send the ETag back in
+    If-None-Match to get a 304 when the plan hasn't changed.
     """
+    trace = metrics.Trace("suggest_stops")
+    g.profile_id = profiling.maybe_start(trace, request.path, request.headers, request.args)
+    streaming = False
     try:
-        data = request.json or {}
-        print(f"Parsed JSON data: {data}")
-        
-        stops = data.get("stops")
-        if not stops or not isinstance(stops, list) or len(stops) < 2:
-            print(f"Invalid stops data: {stops}")
-            return jsonify({"error": "Provide at least 2 stops in 'stops' list"}), 400
-
-        print(f"Processing {len(stops)} stops: {stops}")
-
-        desired_type = data.get("desired_type")
-        keyword = data.get("keyword")
-        sample_every_m = int(data.get("sample_every_m", 1500))
-        search_radius = int(data.get("search_radius", 1200))
-        max_candidates = int(data.get("max_candidates", 20))
-        time_constraint_seconds = data.get("time_constraint_seconds")  # optional
-
-        print(f"Search parameters - type: {desired_type}, keyword: {keyword}")
-
-        # Normalize stops and geocode if needed
-        normalized = []
-        addr_strs = []
-        for i, s in enumerate(stops):
-            print(f"Processing stop {i}: {s}")
-            coords, addr_str = normalize_location_input(s)
-            if coords is None:
-                error_msg = f"Unable to geocode stop: {s}"
-                print(error_msg)
-                return jsonify({"error": error_msg}), 400
-            normalized.append(coords)
-            addr_strs.append(addr_str)
-            print(f"Normalized stop {i}: {coords} -> {addr_str}")
-
-        print("Starting candidate search...")
-        candidates, original_directions = find_candidates_along_route(
-            stops,
-            desired_type=desired_type,
-            keyword=keyword,
-            sample_every_m=sample_every_m,
-            search_radius=search_radius,
-            max_candidates=max_candidates,
-        )
-        print(f"Found {len(candidates)} initial candidates")
-
-        # Compute baseline total travel time for original route
-        if original_directions.get("status") != "OK":
-            error_msg = f"Directions API failed for original route: {original_directions.get('status')}"
-            print(error_msg)
-            return jsonify({"error": error_msg}), 500
-            
-        orig_total_seconds = 0
-        orig_distance_m = 0
-        for leg in original_directions["routes"][0].get("legs", []):
-            orig_total_seconds += int(leg.get("duration", {}).get("value", 0))
-            orig_distance_m += int(leg.get("distance", {}).get("value", 0))
-
-        print(f"Original route: {orig_total_seconds}s, {orig_distance_m}m")
-
-        # Process candidates...
-        results = []
-        legs = original_directions["routes"][0].get("legs", [])
-        leg_midpoints = []
-        for leg in legs:
-            start = leg.get("start_location")
-            end = leg.get("end_location")
-            if start and end:
-                mid = ((start["lat"] + end["lat"]) / 2.0, (start["lng"] + end["lng"]) / 2.0)
-            else:
-                mid = None
-            leg_midpoints.append(mid)
-
-        print(f"Processing {len(candidates)} candidates...")
-        for i, c in enumerate(candidates):
-            print(f"Processing candidate {i+1}/{len(candidates)}: {c.get('name')}")
-            c_loc = c.get("location")
-            if not c_loc:
-                print(f"  Skipping - no location data")
-                continue
-            c_lat, c_lng = c_loc["lat"], c_loc["lng"]
-            
-            # Find nearest leg midpoint
-            best_idx = 0
-            best_dist = float("inf")
-            for j, mid in enumerate(leg_midpoints):
-                if not mid:
-                    continue
-                d = haversine_meters((c_lat, c_lng), mid)
-                if d < best_dist:
-                    best_dist = d
-                    best_idx = j
-            
-            print(f"  Best insertion point: leg {best_idx}, distance: {best_dist}m")
-            
-            try:
-                total_seconds_with, dir_resp = compute_total_time_with_insertion(
-                    addr_strs, best_idx, f"{c_lat},{c_lng}"
-                )
-            except Exception as e:
-                print(f"  Directions error: {e}")
-                continue
-                
-            if total_seconds_with is None:
-                print(f"  Directions failed - skipping")
-                continue
-                
-            added = int(total_seconds_with - orig_total_seconds)
-            print(f"  Added time: {added}s")
-            
-            # Apply time constraint filter if requested
-            if time_constraint_seconds is not None and added > int(time_constraint_seconds):
-                print(f"  Filtered out - exceeds time constraint ({added} > {time_constraint_seconds})")
-                continue
-
-            result = {
-                "place_id": c.get("place_id"),
-                "name": c.get("name"),
-                "vicinity": c.get("vicinity"),
-                "location": c.get("location"),
-                "types": c.get("types"),
-                "rating": c.get("rating"),
-                "user_ratings_total": c.get("user_ratings_total"),
-                "insert_between": [best_idx, best_idx + 1],
-                "insert_leg_distance_to_sample_m": int(best_dist),
-                "total_travel_time_seconds": int(total_seconds_with),
-                "added_time_seconds": int(added),
-            }
-            results.append(result)
-            print(f"  Added to results")
-            
-            # polite pause to avoid hitting rate limits
-            time.sleep(0.08)
-
-        # Sort by added travel time ascending
-        results.sort(key=lambda x: x["added_time_seconds"])
-        print(f"Returning {len(results)} final results")
-
-        response = {
-            "route_summary": {
-                "original_total_travel_time_seconds": int(orig_total_seconds),
-                "original_total_distance_meters": int(orig_distance_m),
-                "stops": stops,
-            },
-            "candidates": results,
-            "generated_at": datetime.utcnow().isoformat() + "Z",
-        }
-        return jsonify(response)
-        
+        with metrics.active(trace):
+            data = request.json or {}
+
+            opts = parse_suggest_request(data)
+            logger.info(
+                "suggest_stops: %d stops, type=%s, keyword=%s",
+                len(opts["stops"]), opts["desired_type"], opts["keyword"],
+            )
+
+            route = resolve_stops(opts["stops"])
+            key = suggest_cache.key(opts, route.coords)
+            with metrics.span("response_cache"):
+                entry, state = suggest_cache.get(key)
+
+            fmt = _stream_format()
+            if entry is None and fmt:
+                # The rest of the pipeline runs as the body streams; the trace ends with it
+                streaming = True
+                return _stream_response(suggest_cache.recording(key, suggest_stops_events(opts, route)), fmt, trace)
+
+            if state == STALE:
+                suggest_cache.refresh(key, lambda: plan_body(opts, route))
+            elif entry is None:
+                # Plain JSON: run the pipeline to the end (once for identical concurrent requests)
+                entry, state = suggest_cache.compute(key, lambda: plan_body(opts, route)), MISS
+            return _plan_response(entry, state, opts["stops"], fmt)
+
+    except SuggestRequestError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error in suggest_stops: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in suggest_stops: %s", e)
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        if not streaming:
+            trace.finish()
 
 
 if __name__ == "__main__":
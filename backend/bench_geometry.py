@@ -0,0 +1,187 @@
+# bench_geometry.py
+"""
+Micro-benchmarks for the geometry that runs on every /suggest_stops request:
+polyline decoding, along-route distance and sampling, haversine, the
+coverage planner, candidate projection and the detour pre-filter.
+
+Routes are synthetic random walks with a vertex every ~20 m (like step-level
+Directions polylines) from 100 to 100k points; candidates are scattered
+within 1.5 km of the route, 10 to 10k of them. Each case reports the best
+time per call over several repeats and a throughput in items per second.
+
+    python bench_geometry.py                          # print the table
+    python bench_geometry.py --save geometry_baseline.json
+    python bench_geometry.py --compare geometry_baseline.json --threshold 0.3
+
+--compare exits with status 1 if any case got slower than the baseline by
+more than the threshold (default 0.3 = 30%) and stayed that slow when
+measured again, so a geometry change can be checked before and after on the
+same machine. Path x candidate cases above
+--max-elements are skipped unless --full is given.
+"""
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+
+import numpy as np
+
+from search_coverage import plan_search_centers
+from detour import estimate_detours
+from geo import (
+    cumulative_distance,
+    decode_polyline,
+    encode_polyline,
+    haversine_matrix,
+    haversine_meters,
+    haversine_pairs,
+    project_onto_path,
+    sample_along_polyline,
+)
+
+PATH_SIZES = (100, 1_000, 10_000, 100_000)
+CANDIDATE_SIZES = (10, 100, 1_000, 10_000)
+STEP_M = 20.0
+ORIGIN = (43.6532, -79.3832)
+
+
+def make_path(n, seed=0):
+    """(n, 2) random walk from downtown Toronto, ~STEP_M between vertices, drifting east."""
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0.0, 0.15, n)) * 0.3
+    north = np.cumsum(STEP_M * np.sin(heading))
+    east = np.cumsum(STEP_M * np.cos(heading))
+    lat = ORIGIN[0] + north / 111320.0
+    lng = ORIGIN[1] + east / (111320.0 * math.cos(math.radians(ORIGIN[0])))
+    return np.column_stack([lat, lng])
+
+
+def make_candidates(path, m, seed=1):
+    """(m, 2) points within ~1.5 km of random route vertices."""
+    rng = np.random.default_rng(seed)
+    base = path[rng.integers(0, len(path), m)]
+    offset = rng.uniform(-1500.0, 1500.0, (m, 2))
+    return base + offset / [111320.0, 111320.0 * math.cos(math.radians(ORIGIN[0]))]
+
+
+def measure(fn, min_time=0.35, repeat=7):
+    """Best seconds per call of fn(), with enough calls per repeat to fill min_time / repeat."""
+    started = time.perf_counter()
+    fn()
+    once = time.perf_counter() - started
+    number = max(1, int(min_time / repeat / once)) if once > 0 else 1000
+    best = float("inf")
+    for _ in range(repeat if once * number < 5 else 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def cases(max_elements, full):
+    """Yield (name, size label, items per call, fn)."""
+    for n in PATH_SIZES:
+        path = make_path(n)
+        encoded = encode_polyline(path)
+        yield "decode_polyline", f"n={n}", n, lambda encoded=encoded: decode_polyline(encoded)
+        yield "cumulative_distance", f"n={n}", n, lambda path=path: cumulative_distance(path)
+        yield "sample_along_polyline", f"n={n}", n, lambda path=path: sample_along_polyline(path, 1500)
+        yield "haversine_pairs", f"n={n}", n - 1, lambda path=path: haversine_pairs(path[:-1], path[1:])
+        if n <= 10_000:
+            pairs = list(zip(map(tuple, path[:-1]), map(tuple, path[1:])))
+            yield "haversine_meters", f"n={n}", n - 1, lambda pairs=pairs: [haversine_meters(a, b) for a, b in pairs]
+        yield "plan_search_centers", f"n={n}", n, lambda path=path: plan_search_centers(path, 1200)
+
+        stops = path[np.linspace(0, n - 1, 4).astype(int)]
+        for m in CANDIDATE_SIZES:
+            if not full and n * m > max_elements:
+                continue
+            cands = make_candidates(path, m)
+            label = f"n={n} m={m}"
+            yield "project_onto_path", label, n * m, lambda path=path, cands=cands: project_onto_path(path, cands)
+            yield "estimate_detours", label, n * m, (
+                lambda path=path, stops=stops, cands=cands: estimate_detours(path, stops, cands, 11.0)
+            )
+            if n <= 1_000:
+                yield "haversine_matrix", label, n * m, lambda path=path, cands=cands: haversine_matrix(cands, path)
+
+
+def run(max_elements, full, only=None, keys=None):
+    # glibc raises its mmap threshold after the first large free; do that up
+    # front so big temporaries cost the same whichever cases ran before.
+    np.ones(4_000_000).sum()
+    results = {}
+    for name, label, items, fn in cases(max_elements, full):
+        key = f"{name} {label}"
+        if (only and name not in only) or (keys is not None and key not in keys):
+            continue
+        seconds = measure(fn)
+        results[key] = {"seconds": seconds, "items_per_s": items / seconds if seconds else None}
+        print(f"{key:<42}{seconds * 1000:>12.3f} ms{results[key]['items_per_s']:>16.3g} /s", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the ratio against the baseline per case; return the cases over the threshold."""
+    regressions = []
+    print(f"{'case':<42}{'baseline ms':>14}{'now ms':>12}{'ratio':>8}")
+    for key, now in results.items():
+        before = baseline.get(key)
+        if before is None:
+            print(f"{key:<42}{'-':>14}{now['seconds'] * 1000:>12.3f}{'new':>8}")
+            continue
+        ratio = now["seconds"] / before["seconds"]
+        flag = "  REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{key:<42}{before['seconds'] * 1000:>14.3f}{now['seconds'] * 1000:>12.3f}{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Geometry hot-path micro-benchmarks")
+    parser.add_argument("--save", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.3, help="allowed slowdown before failing (0.3 = 30%%)")
+    parser.add_argument("--only", help="comma-separated function names to run")
+    parser.add_argument("--max-elements", type=float, default=2e7,
+                        help="skip path x candidate cases larger than this (points x candidates)")
+    parser.add_argument("--full", action="store_true", help="run every path x candidate case")
+    args = parser.parse_args()
+
+    only = set(args.only.split(",")) if args.only else None
+    results = run(args.max_elements, args.full, only)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "meta": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine()},
+                "results": results,
+            }, f, indent=2)
+        print(f"Saved {len(results)} cases to {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        # Small cases are at the mercy of the machine; only a slowdown that persists counts
+        for _ in range(2):
+            if not regressions:
+                break
+            print(f"Re-measuring {len(regressions)} case(s)")
+            again = run(args.max_elements, args.full, only, keys=set(regressions))
+            for key, now in again.items():
+                if now["seconds"] < results[key]["seconds"]:
+                    results[key] = now
+            regressions = compare({key: results[key] for key in regressions}, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
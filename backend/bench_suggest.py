@@ -0,0 +1,225 @@
+# bench_suggest.py
+"""
+End-to-end latency benchmark for /search_place and /suggest_stops.
+
+By default everything runs in this process: a fake_maps.py server stands in
+for Google (synthetic answers plus any recorded fixtures, with injected
+latency) and the Flask app from app.py is served on a local port pointed at
+it, with the Maps and /suggest_stops caches and the quota governor off so
+every request does its full upstream work. Each scenario (route length x
+concurrency) reports p50/p95/p99 latency, throughput and the upstream calls
+per request by endpoint.
+
+    python bench_suggest.py
+    python bench_suggest.py --stops 2,5,8 --km 5,30 --concurrency 1,8,32 --requests 40 --latency-ms 80
+    python bench_suggest.py --json bench.json
+
+Against a server that is already running (e.g. route_service.py), started
+with MAPS_BASE_URL at a separately started fake_maps.py:
+
+    python bench_suggest.py --target http://localhost:5000 --maps-url http://localhost:8099
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+import fake_maps
+
+ORIGIN = (43.6532, -79.3832)
+
+SEARCH_QUERIES = ["coffee", "cn tower", "sushi downtown", "bookstore", "union station", "ramen"]
+
+
+def make_route(n_stops, km):
+    """n_stops evenly spaced along km of a gently zig-zagging line heading east-north-east."""
+    stops = []
+    for k in range(n_stops):
+        along = km * 1000.0 * k / max(1, n_stops - 1)
+        zig = 400.0 * (1 if k % 2 else -1) if 0 < k < n_stops - 1 else 0.0
+        north = along * math.sin(math.radians(20)) + zig
+        east = along * math.cos(math.radians(20))
+        stops.append({
+            "lat": round(ORIGIN[0] + north / 111320.0, 6),
+            "lng": round(ORIGIN[1] + east / (111320.0 * math.cos(math.radians(ORIGIN[0]))), 6),
+        })
+    return stops
+
+
+def suggest_body(n_stops, km):
+    return {
+        "stops": make_route(n_stops, km),
+        "desired_type": "cafe",
+        "keyword": "coffee",
+        "sample_every_m": 1500,
+        "search_radius": 1200,
+        "max_candidates": 10,
+        "time_constraint_seconds": 1800,
+    }
+
+
+def start_local_app():
+    """Serve app.py's Flask app on a free local port; returns its base URL."""
+    from werkzeug.serving import make_server
+
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name="bench-app").start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class UpstreamCounter:
+    """Reads and resets the fake's call counters over HTTP (None if there is no fake)."""
+
+    def __init__(self, maps_url):
+        self.maps_url = maps_url
+
+    def reset(self):
+        if self.maps_url:
+            requests.post(f"{self.maps_url}/__reset", timeout=5)
+
+    def calls(self):
+        if not self.maps_url:
+            return None
+        return requests.get(f"{self.maps_url}/__stats", timeout=5).json()["calls"]
+
+
+def run_scenario(url, bodies, concurrency, counter, settle):
+    """POST every body with 'concurrency' workers; returns latencies (ms), failures and upstream calls."""
+    local = threading.local()
+
+    def one(body):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = session.post(url, json=body, timeout=120).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return (time.perf_counter() - started) * 1000.0, ok
+
+    counter.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, bodies))
+    wall = time.perf_counter() - started
+    # Background Nearby pages may still be landing; let them finish before counting
+    time.sleep(settle)
+    latencies = np.array([ms for ms, _ in results])
+    return {
+        "requests": len(results),
+        "failures": sum(1 for _, ok in results if not ok),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "rps": round(len(results) / wall, 2) if wall else None,
+        "upstream": counter.calls(),
+    }
+
+
+def report(rows, out=sys.stdout):
+    header = f"{'endpoint':<14}{'stops':>6}{'km':>6}{'conc':>6}{'n':>5}{'fail':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>8}  upstream/req"
+    print(header, file=out)
+    for r in rows:
+        upstream = "-"
+        if r["upstream"] is not None:
+            per = {k: v / r["requests"] for k, v in sorted(r["upstream"].items())}
+            upstream = f"{sum(per.values()):.1f} (" + " ".join(f"{k}={v:.1f}" for k, v in per.items()) + ")"
+        print(
+            f"{r['endpoint']:<14}{r['stops'] or '-':>6}{r['km'] or '-':>6}{r['concurrency']:>6}{r['requests']:>5}"
+            f"{r['failures']:>5}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['rps']:>8}  {upstream}",
+            file=out,
+        )
+
+
+def _ints(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def _floats(value):
+    return [float(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency benchmark for /search_place and /suggest_stops")
+    parser.add_argument("--target", help="base URL of a running backend (default: app.py in-process)")
+    parser.add_argument("--maps-url", help="base URL of a running fake_maps.py (default: in-process)")
+    parser.add_argument("--stops", type=_ints, default=[2, 4, 8], help="stops per route, e.g. 2,4,8")
+    parser.add_argument("--km", type=_floats, default=[5, 20], help="route lengths in km, e.g. 5,20")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 8])
+    parser.add_argument("--requests", type=int, default=16, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests before each scenario")
+    parser.add_argument("--only", choices=["search", "suggest"])
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="injected upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--latency", action="append", metavar="ENDPOINT=MS", help="per-endpoint latency")
+    parser.add_argument("--fixtures", default=str(fake_maps.DEFAULT_FIXTURES))
+    parser.add_argument("--cache", action="store_true", help="keep the Maps and response caches on (in-process app only)")
+    parser.add_argument("--settle", type=float, default=1.5, help="seconds to wait before counting upstream calls")
+    parser.add_argument("--json", help="also write the rows to this file")
+    args = parser.parse_args()
+
+    maps_url = args.maps_url
+    if maps_url is None and args.target is None:
+        fake = fake_maps.FakeMaps(
+            fixtures=fake_maps.FixtureStore(args.fixtures),
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            endpoint_latency_ms=fake_maps.parse_endpoint_latency(args.latency),
+        )
+        maps_url = f"http://127.0.0.1:{fake_maps.serve(fake).server_port}"
+    counter = UpstreamCounter(maps_url)
+
+    target = args.target
+    if target is None:
+        # Must be set before app.py builds its clients and caches
+        os.environ["MAPS_BASE_URL"] = maps_url
+        os.environ.setdefault("GOOGLE_API_KEY", "fake")
+        os.environ.setdefault("MAPS_QUOTA_DISABLED", "1")
+        if not args.cache:
+            os.environ["MAPS_CACHE_DISABLED"] = "1"
+            os.environ["SUGGEST_CACHE_DISABLED"] = "1"
+        # The app logs every request's timings; keep the report readable
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        target = start_local_app()
+
+    scenarios = []
+    if args.only != "suggest":
+        for conc in args.concurrency:
+            bodies = [{"query": SEARCH_QUERIES[i % len(SEARCH_QUERIES)]} for i in range(args.requests)]
+            scenarios.append(("/search_place", None, None, conc, bodies))
+    if args.only != "search":
+        for n_stops in args.stops:
+            for km in args.km:
+                for conc in args.concurrency:
+                    scenarios.append(("/suggest_stops", n_stops, km, conc, [suggest_body(n_stops, km)] * args.requests))
+
+    rows = []
+    for endpoint, n_stops, km, conc, bodies in scenarios:
+        url = target.rstrip("/") + endpoint
+        for body in bodies[:args.warmup]:
+            requests.post(url, json=body, timeout=120)
+        row = {"endpoint": endpoint, "stops": n_stops, "km": km, "concurrency": conc}
+        row.update(run_scenario(url, bodies, conc, counter, args.settle if endpoint == "/suggest_stops" else 0))
+        rows.append(row)
+        print(f"{endpoint} stops={n_stops} km={km} conc={conc}: p50 {row['p50_ms']} ms", file=sys.stderr)
+
+    report(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# booking_memory.py
+"""
+What we learned last time we booked a place.
+
+Every reservation run used to start from scratch: web-search the restaurant,
+hunt for OpenTable/Resy/Tock, then book. Most of an agent's turns go into
+that search, and for places we book over and over it always ends at the same
+page. This remembers, per Google place_id, the booking page the agent ended
+up on, which platform it is, and how the last attempt went, so the next run
+can start on that page.
+
+A remembered page is dropped after MAX_FAILURES failed runs in a row, so a
+site that changed gets rediscovered.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+MAX_FAILURES = 2
+
+# Outcomes that prove the booking page works (or that there is none to find)
+WORKING_STATUSES = ("confirmed", "no_availability", "requires_phone_call")
+
+PLATFORMS = {
+    "opentable.": "OpenTable",
+    "resy.com": "Resy",
+    "exploretock.com": "Tock",
+    "tock.com": "Tock",
+    "yelp.": "Yelp",
+    "sevenrooms.com": "SevenRooms",
+}
+
+URL_RE = re.compile(r"https?://[^\s<>\"')\]]+")
+BOOKING_PAGE_RE = re.compile(r"booking page:\s*(https?://[^\s<>\"')\]]+)", re.IGNORECASE)
+
+
+def platform_for(url):
+    host = urlparse(url).netloc.lower()
+    for fragment, platform in PLATFORMS.items():
+        if fragment in host:
+            return platform
+    return "website"
+
+
+def find_booking_url(messages):
+    """
+    The booking page the agent reported: an explicit 'Booking page: <url>'
+    line if it gave one, else the last reservation-platform link it mentioned.
+    """
+    for message in reversed(messages):
+        match = BOOKING_PAGE_RE.search(message)
+        if match:
+            return match.group(1).rstrip(".,;")
+    for message in reversed(messages):
+        for url in reversed(URL_RE.findall(message)):
+            url = url.rstrip(".,;")
+            if platform_for(url) != "website":
+                return url
+    return None
+
+
+class BookingMemory:
+    """Booking paths in a SQLite table keyed by place_id."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=5, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS booking_paths ("
+            " place_id TEXT PRIMARY KEY, name TEXT, booking_url TEXT, platform TEXT,"
+            " phone TEXT, last_status TEXT, successes INTEGER NOT NULL DEFAULT 0,"
+            " failures INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """BOOKING_MEMORY_PATH selects the SQLite file (":memory:" keeps it in-process)."""
+        return cls(os.environ.get(
+            "BOOKING_MEMORY_PATH", str(Path(__file__).parent / ".booking_memory.sqlite3")
+        ))
+
+    def get(self, place_id):
+        """The remembered path for place_id, or None if there is nothing worth reusing."""
+        if not place_id:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM booking_paths WHERE place_id = ?", (place_id,)).fetchone()
+        if row is None or row["failures"] >= MAX_FAILURES:
+            return None
+        if not row["booking_url"] and not row["phone"]:
+            return None
+        return dict(row)
+
+    def record(self, place_id, name, status, booking_url=None, phone=None):
+        """Fold one run's outcome into the place's entry."""
+        if not place_id:
+            return
+        worked = status in WORKING_STATUSES
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM booking_paths WHERE place_id = ?", (place_id,)).fetchone()
+            if row is not None:
+                # Keep what we knew unless this run found something newer. A
+                # failed run doesn't replace a remembered page: failures count
+                # against that page, and it's dropped once they reach MAX_FAILURES.
+                known_url = row["booking_url"]
+                if known_url and not worked:
+                    booking_url = known_url
+                booking_url = booking_url or known_url
+                phone = phone or row["phone"]
+                successes = row["successes"] + (1 if worked else 0)
+                if worked:
+                    failures = 0
+                elif booking_url != known_url:
+                    # First page we know of; earlier failures weren't on it
+                    failures = 1
+                else:
+                    failures = row["failures"] + 1
+            else:
+                successes, failures = (1, 0) if worked else (0, 1)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO booking_paths"
+                " (place_id, name, booking_url, platform, phone, last_status, successes, failures, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    place_id, name, booking_url, platform_for(booking_url) if booking_url else None,
+                    phone, status, successes, failures, time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def forget(self, place_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM booking_paths WHERE place_id = ?", (place_id,))
+            self._conn.commit()
+
+
+_memory = None
+
+
+def get_booking_memory():
+    """The process-wide memory, built from the environment on first use (None if BOOKING_MEMORY_DISABLED=1)."""
+    global _memory
+    if os.environ.get("BOOKING_MEMORY_DISABLED") == "1":
+        return None
+    if _memory is None:
+        _memory = BookingMemory.from_env()
+    return _memory
@@ -0,0 +1,272 @@
+# computer_pool.py
+"""
+Warm pool of CUA Computer VMs for the agent runs.
+
+Booting a Docker Computer takes longer than many of the agent runs it is
+used for, and the reservation agent and email helper used to boot (and tear
+down) a fresh one every time. The pool keeps 'size' computers booted and
+health-checked and leases them out:
+
+    async with get_pool().lease() as computer:
+        agent = ComputerAgent(model=..., tools=[computer], ...)
+
+A computer is reset after each lease and recycled (stopped and replaced by
+a freshly booted one) after max_runs leases, after a failed run (the lease
+body raised, or the caller called report_failure()), or when a health check
+fails. stats() reports utilization and lease wait times.
+
+The default Docker factory can run only one computer per host: cua-computer's
+DockerProvider (0.4.x) publishes every container's API on host port 8000, so
+a second container fails to start. The pool therefore defaults to one
+computer. Bigger pools need a factory whose computers don't share ports
+(separate hosts, or another provider).
+"""
+import asyncio
+import logging
+import os
+import time
+import webbrowser
+from contextlib import asynccontextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Best-effort cleanup between leases: close browsers and drop downloads so
+# the next run starts from a clean desktop.
+RESET_COMMAND = "pkill -f -i 'firefox|chrom' ; rm -rf ~/Downloads/* ; true"
+
+BOOT_RETRY_DELAYS = (5, 15, 60)
+
+
+def docker_computer(slot):
+    """
+    Default factory: a Linux Docker Computer for the slot, on its own VNC
+    port. The API port is fixed at 8000 by the provider, so only one of these
+    can run per host.
+    """
+    from computer import Computer, VMProviderType
+
+    return Computer(
+        provider_type=VMProviderType.DOCKER,
+        os_type="linux",
+        name=f"cua-pool-{slot}",
+        noVNC_port=8006 + slot,
+    )
+
+
+class _Slot:
+    def __init__(self, index, computer):
+        self.index = index
+        self.computer = computer
+        self.runs = 0
+
+
+class ComputerPool:
+    def __init__(self, size=1, max_runs=5, factory=docker_computer, open_vnc=False,
+                 health_interval=60.0, health_timeout=10.0, lease_timeout=600.0):
+        self.size = size
+        self.max_runs = max_runs
+        self.factory = factory
+        self.open_vnc = open_vnc
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.lease_timeout = lease_timeout
+        self._idle = None
+        self._tasks = set()
+        # Every computer booted and not yet stopped: idle, leased, resetting or recycling
+        self._computers = set()
+        self._started_at = None
+        self._booting = 0
+        self._leased = 0
+        self._leases = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._busy_seconds = 0.0
+        self._recycled = 0
+        self._boot_failures = 0
+        # Leased computers whose run failed without raising (see report_failure)
+        self._failed = set()
+
+    @classmethod
+    def from_env(cls):
+        """
+        CUA_POOL_SIZE computers (default 1, see the module docstring),
+        recycled after CUA_POOL_MAX_RUNS leases (default 5). CUA_OPEN_VNC=1
+        opens each booted VM's VNC page in a local browser tab, like the old
+        per-run setup did.
+        """
+        size = int(os.environ.get("CUA_POOL_SIZE", 1))
+        if size > 1:
+            logger.warning(
+                "CUA_POOL_SIZE=%d: Docker computers all use API port 8000, so only one can boot per host", size
+            )
+        return cls(
+            size=size,
+            max_runs=int(os.environ.get("CUA_POOL_MAX_RUNS", 5)),
+            open_vnc=os.environ.get("CUA_OPEN_VNC") == "1",
+        )
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def start(self):
+        """Boot every slot in the background; returns immediately. Safe to call repeatedly."""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        self._started_at = time.time()
+        for index in range(self.size):
+            self._spawn(self._boot(index))
+        self._spawn(self._health_loop())
+
+    async def _boot(self, index):
+        self._booting += 1
+        try:
+            for delay in (0,) + BOOT_RETRY_DELAYS:
+                await asyncio.sleep(delay)
+                computer = None
+                try:
+                    computer = self.factory(index)
+                    self._computers.add(computer)
+                    await computer.run()
+                    if await self._healthy(computer):
+                        break
+                    raise RuntimeError("health check failed after boot")
+                except Exception as e:
+                    self._boot_failures += 1
+                    logger.warning("Computer pool: slot %d failed to boot: %s", index, e)
+                    if computer is not None:
+                        await self._stop(computer)
+            else:
+                logger.error("Computer pool: giving up on slot %d", index)
+                return
+        finally:
+            self._booting -= 1
+        if self.open_vnc:
+            webbrowser.open(f"http://localhost:{8006 + index}/", new=0, autoraise=True)
+        self._idle.put_nowait(_Slot(index, computer))
+
+    async def _healthy(self, computer):
+        try:
+            await asyncio.wait_for(computer.interface.get_screen_size(), timeout=self.health_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def _stop(self, computer):
+        self._computers.discard(computer)
+        try:
+            await computer.stop()
+        except Exception as e:
+            logger.warning("Computer pool: error stopping computer: %s", e)
+
+    async def _recycle(self, slot):
+        self._recycled += 1
+        await self._stop(slot.computer)
+        self._spawn(self._boot(slot.index))
+
+    async def _release(self, slot, ok):
+        slot.runs += 1
+        if ok and slot.runs < self.max_runs:
+            try:
+                await asyncio.wait_for(slot.computer.interface.run_command(RESET_COMMAND), timeout=self.health_timeout)
+                if await self._healthy(slot.computer):
+                    self._idle.put_nowait(slot)
+                    return
+            except Exception as e:
+                logger.warning("Computer pool: reset of slot %d failed: %s", slot.index, e)
+        await self._recycle(slot)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            # Check only computers that are idle right now; leased ones are
+            # checked when they come back.
+            for _ in range(self._idle.qsize()):
+                try:
+                    slot = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if await self._healthy(slot.computer):
+                    self._idle.put_nowait(slot)
+                else:
+                    logger.warning("Computer pool: slot %d failed its health check", slot.index)
+                    await self._recycle(slot)
+
+    @asynccontextmanager
+    async def lease(self):
+        """Borrow a booted computer for one agent run."""
+        await self.start()
+        started = time.perf_counter()
+        try:
+            slot = await asyncio.wait_for(self._idle.get(), timeout=self.lease_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"No CUA computer became available within {self.lease_timeout:.0f}s")
+        waited = time.perf_counter() - started
+        metrics.observe_stage("lease_wait", waited, pipeline="reservation")
+        self._leases += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self._leased += 1
+        leased_at = time.perf_counter()
+        ok = False
+        try:
+            yield slot.computer
+            ok = True
+        finally:
+            if slot.computer in self._failed:
+                self._failed.discard(slot.computer)
+                ok = False
+            self._leased -= 1
+            self._busy_seconds += time.perf_counter() - leased_at
+            # Reset/recycle off the caller's path (unless stop() already stopped it)
+            if self._idle is not None:
+                self._spawn(self._release(slot, ok))
+
+    def report_failure(self, computer):
+        """
+        Mark a leased computer's run as failed, for callers that report errors
+        in their result instead of raising: it is recycled, not reset, when the
+        lease ends.
+        """
+        self._failed.add(computer)
+
+    async def stop(self):
+        """Stop every computer the pool booted, whether idle, leased, booting or being recycled."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._idle = None
+        computers, self._computers = list(self._computers), set()
+        await asyncio.gather(*(self._stop(computer) for computer in computers))
+
+    def stats(self):
+        uptime = time.time() - self._started_at if self._started_at else 0.0
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "leased": self._leased,
+            "booting": self._booting,
+            "leases": self._leases,
+            "avg_lease_wait_ms": round(1000 * self._wait_total / self._leases, 1) if self._leases else 0.0,
+            "max_lease_wait_ms": round(1000 * self._wait_max, 1),
+            # Share of pool capacity spent leased since the pool started
+            "utilization": round(self._busy_seconds / (self.size * uptime), 3) if uptime and self.size else 0.0,
+            "recycled": self._recycled,
+            "boot_failures": self._boot_failures,
+        }
+
+
+_pool = None
+
+
+def get_pool():
+    """The process-wide pool, built from the environment on first use (None if CUA_POOL_SIZE=0)."""
+    global _pool
+    if _pool is None:
+        _pool = ComputerPool.from_env()
+    return _pool if _pool.size > 0 else None
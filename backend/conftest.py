@@ -0,0 +1,4 @@
+# conftest.py
+# test_flask.py is a manual script: it imports app and calls the live Google
+# APIs at import time, so pytest must not collect it.
+collect_ignore = ["test_flask.py"]
@@ -0,0 +1,324 @@
+# detour.py
+"""
+Detour scoring for candidate stops.
+
+Inserting candidate C into leg A->B of an itinerary changes the total travel
+time by  t(A->C) + t(C->B) - t(A->B).  Every other leg is untouched, so rather
+than asking Directions for the whole itinerary once per candidate we fetch
+just the A->C and C->B times for all candidates with a handful of Distance
+Matrix requests and do the arithmetic locally.
+
+Leg times learned along the way (from the original Directions response and
+from matrix elements) are kept in a LegCache, so exact re-pricing of an
+insertion only ever has to ask Google for the two new legs.
+
+Before any of that, estimate_detours ranks candidates purely geometrically
+(distance from the route polyline) so only plausible ones get priced.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from geo import haversine_pairs, project_onto_path
+from maps_cache import DEFAULT_TTLS, LRUStore, normalize_value
+
+logger = logging.getLogger(__name__)
+
+# Distance Matrix limits: at most 25 origins or 25 destinations and 100
+# elements (origins x destinations) per request.
+MATRIX_MAX_SIDE = 25
+MATRIX_MAX_ELEMENTS = 100
+
+
+def chunked(seq, size):
+    """Split seq into consecutive lists of at most size items."""
+    return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+
+def plan_matrix_requests(stop_strs, insertions):
+    """
+    Build the Distance Matrix requests needed to price every insertion.
+
+    stop_strs: Directions-style strings ("lat,lng" or address) for each stop
+    insertions: list of (candidate_loc_str, leg_idx); the candidate goes
+      between stop_strs[leg_idx] and stop_strs[leg_idx + 1]
+    Returns a list of request dicts:
+      {"origins": [...], "destinations": [...], "direction": "to"|"from",
+       "leg": leg_idx, "indices": [insertion indices in the same order]}
+    """
+    by_leg = {}
+    for i, (_, leg_idx) in enumerate(insertions):
+        by_leg.setdefault(leg_idx, []).append(i)
+
+    # One row or one column per request, so MATRIX_MAX_SIDE keeps us well
+    # under MATRIX_MAX_ELEMENTS.
+    planned = []
+    for leg_idx in sorted(by_leg):
+        start, end = stop_strs[leg_idx], stop_strs[leg_idx + 1]
+        for idx_chunk in chunked(by_leg[leg_idx], MATRIX_MAX_SIDE):
+            locs = [insertions[i][0] for i in idx_chunk]
+            # A -> every candidate in the chunk (one row)
+            planned.append({
+                "origins": [start], "destinations": locs,
+                "direction": "to", "leg": leg_idx, "indices": idx_chunk,
+            })
+            # every candidate in the chunk -> B (one column)
+            planned.append({
+                "origins": locs, "destinations": [end],
+                "direction": "from", "leg": leg_idx, "indices": idx_chunk,
+            })
+    return planned
+
+
+# ---------- Geometric pre-filter -------------------------------------------
+
+# Fallback average speed (m/s) when the route has no usable duration.
+DEFAULT_SPEED_MPS = 10.0
+
+
+def estimate_detours(path, stop_coords, candidate_coords, speed_mps=None):
+    """
+    Cheap local detour estimate for each candidate.
+
+    path: decoded route polyline, (N, 2) array of (lat, lng)
+    stop_coords: (lat, lng) of every stop, in route order
+    candidate_coords: (lat, lng) of every candidate
+    speed_mps: average speed used to turn meters into seconds
+
+    The insertion leg is picked by where the candidate projects along the
+    route (between the projections of stop i and stop i+1), not by the
+    nearest leg midpoint, which misassigns candidates on long legs.
+    Returns a list of {"leg", "offset_m", "along_m", "est_added_seconds",
+    "leg_midpoint_m"}: offset_m is the distance off the route polyline,
+    leg_midpoint_m the straight-line distance to the midpoint of the chosen
+    leg's end stops (what insert_leg_distance_to_sample_m has always reported).
+    """
+    speed = speed_mps or DEFAULT_SPEED_MPS
+    if len(candidate_coords) == 0:
+        return []
+    # Along-route position of every interior stop = leg boundaries
+    _, boundaries = project_onto_path(path, stop_coords[1:-1])
+    offsets, alongs = project_onto_path(path, candidate_coords)
+    n_legs = max(1, len(stop_coords) - 1)
+    legs = np.minimum(np.searchsorted(np.sort(boundaries), alongs, side="left"), n_legs - 1)
+    # out to the candidate and back again
+    est = 2.0 * offsets / speed
+    stops = np.asarray(stop_coords, dtype=np.float64).reshape(-1, 2)
+    midpoints = (stops[:-1] + stops[1:]) / 2.0 if len(stops) > 1 else stops
+    to_midpoint = haversine_pairs(np.asarray(candidate_coords, dtype=np.float64), midpoints[legs])
+    return [
+        {"leg": int(leg), "offset_m": float(off), "along_m": float(al), "est_added_seconds": float(e),
+         "leg_midpoint_m": float(m)}
+        for leg, off, al, e, m in zip(legs, offsets, alongs, est, to_midpoint)
+    ]
+
+
+# ---------- Leg cache -------------------------------------------------------
+
+class LegCache:
+    """
+    Durations/distances of single A->B legs keyed by normalized endpoints
+    (same rounding as maps_cache, so "43.650000,-79.38" and "43.65,-79.38"
+    are one leg).
+    """
+
+    def __init__(self, max_entries=10000, ttl=DEFAULT_TTLS["directions"]):
+        self.ttl = ttl
+        self._store = LRUStore(max_entries)
+
+    @staticmethod
+    def key(a, b):
+        return f"{normalize_value(a)}->{normalize_value(b)}"
+
+    def get(self, a, b):
+        """Return {"duration": s, "distance": m} or None."""
+        item = self._store.get(self.key(a, b))
+        return item[1] if item else None
+
+    def put(self, a, b, duration, distance=None):
+        leg = {"duration": int(duration), "distance": int(distance or 0)}
+        self._store.set(self.key(a, b), leg, time.time() + self.ttl)
+        return leg
+
+    def seed_from_directions(self, stop_strs, directions):
+        """Record every leg of a Directions response for the given stop list."""
+        if not directions or directions.get("status") != "OK":
+            return
+        legs = directions["routes"][0].get("legs", [])
+        for a, b, leg in zip(stop_strs, stop_strs[1:], legs):
+            self.put(
+                a, b,
+                leg.get("duration", {}).get("value", 0),
+                leg.get("distance", {}).get("value", 0),
+            )
+
+    def __len__(self):
+        return len(self._store)
+
+
+def _element_leg(element):
+    if not element or element.get("status") != "OK":
+        return None
+    return (
+        int(element.get("duration", {}).get("value", 0)),
+        int(element.get("distance", {}).get("value", 0)),
+    )
+
+
+def parse_matrix_response(req, resp):
+    """Return {insertion_index: (seconds, meters) or None} for one planned request."""
+    out = {i: None for i in req["indices"]}
+    if not resp or resp.get("status") != "OK":
+        return out
+    rows = resp.get("rows", [])
+    if req["direction"] == "to":
+        elements = rows[0].get("elements", []) if rows else []
+        for i, element in zip(req["indices"], elements):
+            out[i] = _element_leg(element)
+    else:
+        for i, row in zip(req["indices"], rows):
+            elements = row.get("elements", [])
+            out[i] = _element_leg(elements[0] if elements else None)
+    return out
+
+
+class InsertionScorer:
+    """
+    Bookkeeping shared by the threaded and asyncio insertion scorers:
+    answers what leg_cache can, plans the matrix requests for the rest, and
+    turns matrix responses into scores once both halves of an insertion
+    are in. This prices every insertion with a few batched Distance Matrix
+    calls instead of one Directions call per candidate.
+    """
+
+    def __init__(self, stop_strs, leg_durations, insertions, leg_cache=None):
+        self.stop_strs = stop_strs
+        self.leg_durations = leg_durations
+        self.insertions = insertions
+        self.leg_cache = leg_cache
+        self.planned = []
+        self._to_legs, self._from_legs = {}, {}
+
+    def score(self, i, to_leg, from_leg):
+        if to_leg is None or from_leg is None:
+            return None
+        leg_idx = self.insertions[i][1]
+        return {
+            "to_seconds": to_leg[0],
+            "from_seconds": from_leg[0],
+            "added_seconds": to_leg[0] + from_leg[0] - int(self.leg_durations[leg_idx]),
+        }
+
+    def cached(self):
+        """Yield (i, score) for insertions leg_cache fully answers, and fill self.planned."""
+        stop_strs, leg_cache = self.stop_strs, self.leg_cache
+        pending = []  # insertion indices the cache can't fully answer
+        for i, (loc_str, leg_idx) in enumerate(self.insertions):
+            cached_to = leg_cache.get(stop_strs[leg_idx], loc_str) if leg_cache is not None else None
+            cached_from = leg_cache.get(loc_str, stop_strs[leg_idx + 1]) if leg_cache is not None else None
+            if cached_to and cached_from:
+                yield i, self.score(
+                    i,
+                    (cached_to["duration"], cached_to["distance"]),
+                    (cached_from["duration"], cached_from["distance"]),
+                )
+            else:
+                pending.append(i)
+        if not pending:
+            return
+        self.planned = plan_matrix_requests(stop_strs, [self.insertions[i] for i in pending])
+        for req in self.planned:
+            req["indices"] = [pending[j] for j in req["indices"]]
+
+    def absorb(self, req, resp):
+        """Record one planned request's response; yield (i, score) for insertions it completes."""
+        to_side = req["direction"] == "to"
+        mine, other = (self._to_legs, self._from_legs) if to_side else (self._from_legs, self._to_legs)
+        for i, leg in parse_matrix_response(req, resp).items():
+            mine[i] = leg
+            if leg and self.leg_cache is not None:
+                loc_str, leg_idx = self.insertions[i]
+                if to_side:
+                    self.leg_cache.put(self.stop_strs[leg_idx], loc_str, *leg)
+                else:
+                    self.leg_cache.put(loc_str, self.stop_strs[leg_idx + 1], *leg)
+            # Both halves in: this insertion is done
+            if i in other:
+                yield i, self.score(i, self._to_legs[i], self._from_legs[i])
+
+
+def iter_insertion_scores(stop_strs, leg_durations, insertions, matrix_fn, max_workers=4, leg_cache=None):
+    """
+    Price every insertion with batched Distance Matrix calls, yielding
+    (insertion_index, score) as soon as both legs of an insertion are known.
+
+    leg_durations: baseline seconds of each original leg (from Directions)
+    matrix_fn(origins, destinations) -> raw Distance Matrix JSON
+    leg_cache: optional LegCache; legs already in it are not re-requested
+      and every new A->C / C->B leg is recorded in it
+    score is {"to_seconds", "from_seconds", "added_seconds"}, or None where
+    the matrix had no route for that candidate. Cached insertions come first,
+    the rest in whatever order their matrix requests complete.
+    """
+    if not insertions:
+        return
+    scorer = InsertionScorer(stop_strs, leg_durations, insertions, leg_cache)
+    yield from scorer.cached()
+    if not scorer.planned:
+        return
+
+    def run(req):
+        try:
+            return matrix_fn(req["origins"], req["destinations"])
+        except Exception as e:
+            logger.warning("Distance Matrix error for leg %s: %s", req["leg"], e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(scorer.planned)))) as pool:
+        # Copy the caller's context so its metrics trace sees these calls
+        futures = {pool.submit(contextvars.copy_context().run, run, req): req for req in scorer.planned}
+        for future in as_completed(futures):
+            yield from scorer.absorb(futures[future], future.result())
+
+
+async def aiter_insertion_scores(stop_strs, leg_durations, insertions, amatrix_fn, leg_cache=None):
+    """
+    asyncio form of iter_insertion_scores: amatrix_fn is a coroutine function
+    and every matrix request runs concurrently on the event loop.
+    """
+    if not insertions:
+        return
+    scorer = InsertionScorer(stop_strs, leg_durations, insertions, leg_cache)
+    for item in scorer.cached():
+        yield item
+    if not scorer.planned:
+        return
+
+    async def run(req):
+        try:
+            return req, await amatrix_fn(req["origins"], req["destinations"])
+        except Exception as e:
+            logger.warning("Distance Matrix error for leg %s: %s", req["leg"], e)
+            return req, None
+
+    for next_done in asyncio.as_completed([run(req) for req in scorer.planned]):
+        req, resp = await next_done
+        for item in scorer.absorb(req, resp):
+            yield item
+
+
+def score_insertions(stop_strs, leg_durations, insertions, matrix_fn, max_workers=4, leg_cache=None):
+    """
+    Blocking form of iter_insertion_scores: returns a list aligned with
+    insertions of score dicts, or None where the matrix had no route.
+    """
+    scores = [None] * len(insertions)
+    for i, score in iter_insertion_scores(
+        stop_strs, leg_durations, insertions, matrix_fn, max_workers=max_workers, leg_cache=leg_cache
+    ):
+        scores[i] = score
+    return scores
@@ -7,7 +7,13 @@ import logging
 import dotenv
 dotenv.load_dotenv('/Users/ayroescobar/cua/notebooks/.env')
 
-async def loginmyemail(email_address):
+async def loginmyemail(email_address, pool=None):
+  # with a ComputerPool, borrow an already booted VM instead of booting one
+  if pool is not None:
+    async with pool.lease() as computer:
+      await signup_waitlist(computer, email_address)
+    return
+
   # creates a linux VM
   computer = Computer(
     provider_type=VMProviderType.DOCKER,
@@ -18,7 +24,12 @@ async def loginmyemail(email_address):
   # open VM's VNC in web browser
   webbrowser.open("http://localhost:8006/", new=0, autoraise=True)
 
+  try:
+    await signup_waitlist(computer, email_address)
+  finally:
+    await computer.stop()
 
+async def signup_waitlist(computer, email_address):
   agent = ComputerAgent(
       model="anthropic/claude-sonnet-4-20250514",
       tools=[computer],
@@ -33,8 +44,6 @@ async def loginmyemail(email_address):
       if result["output"] and result["output"][-1]["type"] == "message":
           print("Agent:", result["output"][-1]["content"][0]["text"])
 
-  await computer.stop()
-
 #Thus only gets runned if you direclty call the file
 if __name__ == "__main__":
   import sys
@@ -0,0 +1,375 @@
+# fake_maps.py
+"""
+Local stand-in for the Google Maps web services, for benchmarks and
+offline runs without a key or quota.
+
+It answers on the same paths as maps.googleapis.com, so pointing the backend
+at it is one variable:
+
+    python fake_maps.py --port 8099 --latency-ms 80
+    MAPS_BASE_URL=http://localhost:8099 GOOGLE_API_KEY=fake python app.py
+
+Each request is answered, in order of preference, from:
+  recorded fixtures  <fixtures>/<endpoint>.jsonl, matched on the normalized
+                     params (maps_cache.normalize_key)
+  Google itself      with --record: the real response is returned and saved
+                     as a fixture (needs GOOGLE_API_KEY)
+  a synthetic world  deterministic geocodes, straight-line routes and a
+                     lattice of places, so any route works (unless
+                     --no-synthetic)
+
+--latency-ms / --jitter-ms (and --latency nearby=150 per endpoint) delay
+every answer to mimic the real round trip. GET /__stats returns calls per
+endpoint and per source; POST /__reset clears them.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from geo import encode_polyline, haversine_meters
+from maps_cache import normalize_key
+from maps_client import ENDPOINTS
+
+PATHS = {urlsplit(url).path: endpoint for endpoint, url in ENDPOINTS.items()}
+
+DEFAULT_FIXTURES = Path(__file__).parent / "fixtures" / "maps"
+
+# Synthetic world: roads are straight lines driven at SPEED_MPS, DETOUR_FACTOR
+# longer than the crow flies; routes get a vertex every ROUTE_STEP_M.
+SPEED_MPS = 11.0
+DETOUR_FACTOR = 1.25
+ROUTE_STEP_M = 50.0
+
+# One place per lattice cell and query, roughly 130 m apart around Toronto.
+CELL_LAT = 0.0012
+CELL_LNG = 0.0016
+PAGE_SIZE = 20
+MAX_RESULTS = 60
+
+PLACE_NAMES = ["Corner", "Maple", "Harbour", "Union", "Parkside", "Station", "Market", "Lakeview"]
+
+
+def _unit(*parts):
+    """Deterministic float in [0, 1) from the parts."""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def _latlng(value):
+    """(lat, lng) of a "lat,lng" string, or the synthetic geocode of an address."""
+    value = value.split("via:", 1)[-1]
+    try:
+        lat, lng = (float(v) for v in value.split(","))
+        return lat, lng
+    except ValueError:
+        return _geocode_point(value)
+
+
+def _geocode_point(address):
+    # Somewhere in a ~20 x 25 km box around downtown Toronto
+    return 43.65 + (_unit("lat", address) - 0.5) * 0.2, -79.38 + (_unit("lng", address) - 0.5) * 0.3
+
+
+def _leg(a, b):
+    meters = DETOUR_FACTOR * haversine_meters(a, b)
+    return {
+        "distance": {"value": int(meters), "text": f"{meters / 1000:.1f} km"},
+        "duration": {"value": int(meters / SPEED_MPS), "text": f"{meters / SPEED_MPS / 60:.0f} mins"},
+    }
+
+
+class SyntheticMaps:
+    """Plausible, deterministic answers for any request."""
+
+    def geocode(self, params):
+        address = params.get("address") or params.get("latlng", "")
+        lat, lng = _latlng(address)
+        return {"status": "OK", "results": [{
+            "formatted_address": address,
+            "geometry": {"location": {"lat": lat, "lng": lng}},
+            "place_id": "synthetic-geo-" + hashlib.sha1(address.encode("utf-8")).hexdigest()[:16],
+        }]}
+
+    def directions(self, params):
+        stops = [params["origin"], *filter(None, params.get("waypoints", "").split("|")), params["destination"]]
+        points = [_latlng(s) for s in stops]
+        path, legs = [points[0]], []
+        for a, b in zip(points, points[1:]):
+            steps = max(1, int(haversine_meters(a, b) / ROUTE_STEP_M))
+            path.extend(
+                (a[0] + (b[0] - a[0]) * k / steps, a[1] + (b[1] - a[1]) * k / steps)
+                for k in range(1, steps + 1)
+            )
+            legs.append({
+                **_leg(a, b),
+                "start_location": {"lat": a[0], "lng": a[1]},
+                "end_location": {"lat": b[0], "lng": b[1]},
+            })
+        return {"status": "OK", "routes": [{
+            "legs": legs,
+            "overview_polyline": {"points": encode_polyline(path)},
+        }]}
+
+    def distance_matrix(self, params):
+        origins = [_latlng(o) for o in params["origins"].split("|")]
+        destinations = [_latlng(d) for d in params["destinations"].split("|")]
+        return {"status": "OK", "rows": [
+            {"elements": [{"status": "OK", **_leg(o, d)} for d in destinations]}
+            for o in origins
+        ]}
+
+    def nearby(self, params):
+        if "pagetoken" in params:
+            page, params = json.loads(base64.urlsafe_b64decode(params["pagetoken"].encode("ascii")))
+        else:
+            page = 0
+        lat, lng = _latlng(params["location"])
+        radius = float(params.get("radius", 1000))
+        query = (params.get("type"), params.get("keyword"))
+        places = []
+        di = int(radius / 111320 / CELL_LAT) + 1
+        dj = int(radius / (111320 * math.cos(math.radians(lat))) / CELL_LNG) + 1
+        i0, j0 = int(lat // CELL_LAT), int(lng // CELL_LNG)
+        for i in range(i0 - di, i0 + di + 1):
+            for j in range(j0 - dj, j0 + dj + 1):
+                if _unit("exists", i, j, *query) < 0.5:
+                    continue
+                p = ((i + _unit("y", i, j)) * CELL_LAT, (j + _unit("x", i, j)) * CELL_LNG)
+                d = haversine_meters((lat, lng), p)
+                if d <= radius:
+                    places.append((d, i, j, p))
+        places.sort()
+        places = places[:MAX_RESULTS]
+        results = [self._place(i, j, p, query) for _, i, j, p in places[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]]
+        data = {"status": "OK" if results else "ZERO_RESULTS", "results": results}
+        if (page + 1) * PAGE_SIZE < len(places):
+            data["next_page_token"] = base64.urlsafe_b64encode(json.dumps([page + 1, params]).encode()).decode()
+        return data
+
+    def _place(self, i, j, p, query):
+        place_type, keyword = query
+        name = PLACE_NAMES[int(_unit("name", i, j) * len(PLACE_NAMES))]
+        return {
+            "place_id": f"synthetic-{i}-{j}-" + hashlib.sha1(repr(query).encode()).hexdigest()[:8],
+            "name": f"{name} {keyword or place_type or 'Spot'} {abs(i) % 1000}",
+            "vicinity": f"{abs(j) % 900 + 1} Synthetic St",
+            "geometry": {"location": {"lat": round(p[0], 7), "lng": round(p[1], 7)}},
+            "types": [t for t in (place_type, "point_of_interest", "establishment") if t],
+            "rating": round(3.0 + 2.0 * _unit("rating", i, j), 1),
+            "user_ratings_total": int(2000 * _unit("ratings", i, j)),
+        }
+
+    def details(self, params):
+        place_id = params.get("place_id", "")
+        return {"status": "OK", "result": {
+            "place_id": place_id,
+            "name": f"Place {place_id[-6:]}",
+            "formatted_phone_number": f"(416) 555-{int(_unit('phone', place_id) * 10000):04d}",
+            "website": f"https://example.com/{place_id}",
+        }}
+
+    def textsearch(self, params):
+        query = params.get("query", "")
+        lat, lng = _geocode_point(query)
+        return {"status": "OK", "results": [
+            {
+                "name": f"{query.title()} {k + 1}",
+                "formatted_address": f"{k + 1} Synthetic Ave, Toronto",
+                "geometry": {"location": {"lat": lat + 0.002 * k, "lng": lng - 0.002 * k}},
+                "place_id": f"synthetic-text-{hashlib.sha1(query.encode()).hexdigest()[:10]}-{k}",
+                "rating": round(3.0 + 2.0 * _unit("rating", query, k), 1),
+            }
+            for k in range(5)
+        ]}
+
+
+class FixtureStore:
+    """Recorded responses, one JSON line ({"params", "response"}) per call, per endpoint file."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._responses = {}
+        for path in self.root.glob("*.jsonl"):
+            endpoint = path.stem
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        self._responses[normalize_key(endpoint, item["params"])] = item["response"]
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, endpoint, params):
+        return self._responses.get(normalize_key(endpoint, params))
+
+    def add(self, endpoint, params, response):
+        with self._lock:
+            self._responses[normalize_key(endpoint, params)] = response
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / f"{endpoint}.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps({"params": params, "response": response}) + "\n")
+
+
+class FakeMaps:
+    """Routes one request to fixtures / upstream / synthetic and keeps the counts."""
+
+    def __init__(self, fixtures=None, synthetic=True, record=False, api_key=None,
+                 latency_ms=0.0, jitter_ms=0.0, endpoint_latency_ms=None):
+        self.fixtures = fixtures
+        self.synthetic = SyntheticMaps() if synthetic else None
+        self.record = record
+        self.api_key = api_key
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.endpoint_latency_ms = endpoint_latency_ms or {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.sources = {}
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "sources": dict(self.sources), "total": sum(self.calls.values())}
+
+    def _count(self, endpoint, source):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.sources[source] = self.sources.get(source, 0) + 1
+
+    def _delay(self, endpoint):
+        ms = self.endpoint_latency_ms.get(endpoint, self.latency_ms)
+        if self.jitter_ms:
+            ms += random.uniform(-self.jitter_ms, self.jitter_ms)
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+    def respond(self, endpoint, params):
+        """Return the JSON answer for one request (params without the key)."""
+        self._delay(endpoint)
+        if self.fixtures is not None:
+            data = self.fixtures.get(endpoint, params)
+            if data is not None:
+                self._count(endpoint, "fixture")
+                return data
+        if self.record:
+            r = requests.get(ENDPOINTS[endpoint], params={**params, "key": self.api_key}, timeout=(3.05, 10))
+            data = r.json()
+            if self.fixtures is not None and data.get("status") in ("OK", "ZERO_RESULTS"):
+                self.fixtures.add(endpoint, params, data)
+            self._count(endpoint, "upstream")
+            return data
+        if self.synthetic is not None:
+            self._count(endpoint, "synthetic")
+            return getattr(self.synthetic, endpoint)(params)
+        self._count(endpoint, "miss")
+        return {"status": "INVALID_REQUEST", "error_message": "No recorded fixture for this request"}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, code, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/__stats":
+                return self._send(200, fake.stats())
+            endpoint = PATHS.get(url.path)
+            if endpoint is None:
+                return self._send(404, {"error": f"Unknown path {url.path}"})
+            params = {k: v for k, v in parse_qsl(url.query, keep_blank_values=True) if k != "key"}
+            try:
+                return self._send(200, fake.respond(endpoint, params))
+            except Exception as e:
+                return self._send(500, {"status": "UNKNOWN_ERROR", "error_message": str(e)})
+
+        def do_POST(self):
+            if urlsplit(self.path).path == "/__reset":
+                fake.reset()
+                return self._send(200, {"ok": True})
+            return self._send(404, {"error": "Unknown path"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    """Start the fake on a daemon thread; returns the server (server.server_port has the port)."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-maps").start()
+    return server
+
+
+def parse_endpoint_latency(values):
+    """["nearby=150", ...] -> {"nearby": 150.0}"""
+    out = {}
+    for value in values or []:
+        endpoint, _, ms = value.partition("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {endpoint!r}")
+        out[endpoint] = float(ms)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Google Maps web services")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fixtures", default=str(DEFAULT_FIXTURES), help="directory of <endpoint>.jsonl fixtures")
+    parser.add_argument("--record", action="store_true", help="fetch misses from Google and save them as fixtures")
+    parser.add_argument("--no-synthetic", action="store_true", help="answer misses with INVALID_REQUEST")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--latency", action="append", metavar="ENDPOINT=MS", help="per-endpoint latency")
+    args = parser.parse_args()
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if args.record and not api_key:
+        parser.error("--record needs GOOGLE_API_KEY")
+    fixtures = FixtureStore(args.fixtures)
+    fake = FakeMaps(
+        fixtures=fixtures,
+        synthetic=not args.no_synthetic,
+        record=args.record,
+        api_key=api_key,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        endpoint_latency_ms=parse_endpoint_latency(args.latency),
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Fake Maps on http://{args.host}:{args.port} ({len(fixtures)} fixtures"
+          f"{', recording' if args.record else ''}{'' if args.no_synthetic else ', synthetic fallback'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
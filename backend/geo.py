@@ -0,0 +1,155 @@
+# geo.py
+"""
+Geometry helpers for route planning, backed by NumPy arrays.
+
+Paths are (N, 2) float64 arrays of (lat, lng) rows. Step-level polylines run
+to thousands of points, so everything here works on whole arrays at once:
+decode the polyline in one pass, compute cumulative along-route distance once,
+and place samples / project candidates with vectorized arithmetic instead of
+per-point Python loops.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+# Cap on (candidates x segments) elements materialized per projection chunk.
+PROJECT_CHUNK_ELEMENTS = 4_000_000
+
+
+def haversine_meters(a, b):
+    """Return distance in meters between two (lat, lng) pairs."""
+    lat1, lon1 = a
+    lat2, lon2 = b
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    hav = math.sin(dphi/2.0)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2.0)**2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(hav))
+
+
+def haversine_pairs(a, b):
+    """Element-wise distance in meters between two broadcastable (..., 2) arrays."""
+    a = np.radians(np.asarray(a, dtype=np.float64))
+    b = np.radians(np.asarray(b, dtype=np.float64))
+    dphi = b[..., 0] - a[..., 0]
+    dlambda = b[..., 1] - a[..., 1]
+    hav = np.sin(dphi / 2.0) ** 2 + np.cos(a[..., 0]) * np.cos(b[..., 0]) * np.sin(dlambda / 2.0) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0)))
+
+
+def haversine_matrix(a, b):
+    """Many-to-many distances: (N, 2) x (M, 2) -> (N, M) meters."""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 2)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 2)
+    return haversine_pairs(a[:, None, :], b[None, :, :])
+
+
+def decode_polyline(polyline_str):
+    """
+    Decode a Google encoded polyline into an (N, 2) array of (lat, lng).
+
+    Each value is a run of 5-bit chunks (low bits first) ending at the first
+    byte below 0x20; runs are found with one cumsum and summed with reduceat.
+    """
+    if not polyline_str:
+        return np.empty((0, 2), dtype=np.float64)
+    raw = np.frombuffer(polyline_str.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    ends = raw < 0x20
+    run_id = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shift = 5 * (np.arange(raw.size) - starts[run_id])
+    values = np.add.reduceat((raw & 0x1F) << shift, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    # A truncated trailing lat without its lng is dropped, like the scalar decoder would fail on it
+    deltas = deltas[: deltas.size - deltas.size % 2].reshape(-1, 2)
+    return np.cumsum(deltas, axis=0) / 1e5
+
+
+def encode_polyline(points):
+    """
+    Encode (lat, lng) rows as a Google polyline (inverse of decode_polyline,
+    to 1e-5 degrees). Used to build synthetic Directions responses.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return ""
+    scaled = np.round(points * 1e5).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    out = []
+    for value in np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist():
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return "".join(out)
+
+
+def cumulative_distance(points):
+    """Along-route distance in meters at every vertex of points (starts at 0)."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return np.zeros(len(points))
+    return np.concatenate(([0.0], np.cumsum(haversine_pairs(points[:-1], points[1:]))))
+
+
+def sample_along_polyline(points, every_m=1500):
+    """
+    Return an (K, 2) array of sample points spaced every 'every_m' meters
+    along the polyline defined by points, starting at points[0].
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return points
+    cum = cumulative_distance(points)
+    total = cum[-1]
+    if len(points) < 2 or total == 0:
+        return points[:1].copy()
+    targets = np.arange(0, math.floor(total / every_m) + 1) * float(every_m)
+    idx = np.clip(np.searchsorted(cum, targets, side="right") - 1, 0, len(points) - 2)
+    seg = cum[idx + 1] - cum[idx]
+    frac = np.divide(targets - cum[idx], seg, out=np.zeros_like(targets), where=seg > 0)
+    return points[idx] + (points[idx + 1] - points[idx]) * frac[:, None]
+
+
+def project_onto_path(path, points):
+    """
+    Project every point onto the polyline path.
+
+    Uses a local equirectangular frame per segment, which is accurate to well
+    under a meter at segment scale. Returns (offset_m, along_m) arrays: the
+    distance to the closest segment and the along-route distance of the foot
+    of the perpendicular.
+    """
+    path = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return np.empty(0), np.empty(0)
+    if len(path) == 1:
+        return haversine_pairs(points, path[0]), np.zeros(len(points))
+
+    a = path[:-1]
+    k = np.cos(np.radians(a[:, 0]))
+    bx = np.radians(path[1:, 1] - a[:, 1]) * k * EARTH_RADIUS_M
+    by = np.radians(path[1:, 0] - a[:, 0]) * EARTH_RADIUS_M
+    seg_sq = bx * bx + by * by
+    seg_len = np.sqrt(seg_sq)
+    cum = np.concatenate(([0.0], np.cumsum(seg_len)))
+
+    offsets = np.empty(len(points))
+    alongs = np.empty(len(points))
+    step = max(1, PROJECT_CHUNK_ELEMENTS // len(a))
+    for lo in range(0, len(points), step):
+        chunk = points[lo:lo + step]
+        px = np.radians(chunk[:, None, 1] - a[None, :, 1]) * k * EARTH_RADIUS_M
+        py = np.radians(chunk[:, None, 0] - a[None, :, 0]) * EARTH_RADIUS_M
+        t = np.divide(px * bx + py * by, seg_sq, out=np.zeros_like(px), where=seg_sq > 0)
+        np.clip(t, 0.0, 1.0, out=t)
+        dist = np.hypot(px - t * bx, py - t * by)
+        best = np.argmin(dist, axis=1)
+        rows = np.arange(len(chunk))
+        offsets[lo:lo + step] = dist[rows, best]
+        alongs[lo:lo + step] = cum[best] + t[rows, best] * seg_len[best]
+    return offsets, alongs
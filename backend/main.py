@@ -1,9 +1,96 @@
-from typing import Union, Optional, List
-from fastapi import FastAPI, HTTPException
+from typing import Any, Union, Optional, List
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 import asyncio
+import os
+import time
 
-app = FastAPI()
+import metrics
+import profiling
+from booking_memory import get_booking_memory
+from computer_pool import get_pool
+from reservation_jobs import SUCCEEDED, JobQueue, JobStore
+
+metrics.configure_logging()
+
+async def run_single_job(payload, progress):
+    from reservation_agent import RunBudget, make_single_reservation as make_reservation
+    return await make_reservation(payload["place_data"], payload["reservation_details"],
+                                  pool=get_pool(), memory=get_booking_memory(),
+                                  budget=RunBudget.from_env(**(payload.get("budget") or {})))
+
+async def run_batch_job(payload, progress):
+    from reservation_agent import ReservationAgent, RunBudget
+
+    async def on_result(index, result):
+        await progress({"index": index, **result})
+
+    agent = ReservationAgent(pool=get_pool(), memory=get_booking_memory(),
+                             budget=RunBudget.from_env(**(payload.get("budget") or {})))
+    try:
+        return await agent.batch_make_reservations(
+            payload["places_data"],
+            payload["reservation_details"],
+            parallelism=payload.get("parallelism", 1),
+            first_confirmed_wins=payload.get("first_confirmed_wins", False),
+            on_result=on_result,
+        )
+    finally:
+        await agent.cleanup()
+
+# Reservations run in the background; each worker drives one CUA VM at a time,
+# so by default there is one worker per pooled computer (a worker with no
+# computer to lease would only wait in lease() until it timed out).
+_default_workers = get_pool().size if get_pool() is not None else 1
+jobs = JobQueue(
+    JobStore.from_env(),
+    {"single": run_single_job, "batch": run_batch_job},
+    workers=int(os.environ.get("RESERVATION_WORKERS", _default_workers)),
+    profiler=profiling.get_profiler(),
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Boot the warm CUA pool in the background so the first booking doesn't wait on it
+    pool = get_pool()
+    if pool is not None:
+        await pool.start()
+    await jobs.start()
+    yield
+    await jobs.stop()
+    if pool is not None:
+        await pool.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    return response
+
+def _pool_gauge(key):
+    def read():
+        pool = get_pool()
+        return {(): pool.stats()[key]} if pool is not None else {}
+    return read
+
+for _key in ("idle", "leased", "booting"):
+    metrics.REGISTRY.gauge(f"cua_pool_{_key}", f"CUA computers currently {_key}", fn=_pool_gauge(_key))
+metrics.REGISTRY.gauge(
+    "reservation_jobs_queued", "Reservation jobs waiting for a worker",
+    fn=lambda: {(): jobs.queued()} if jobs.queued() is not None else {},
+)
 
 # run this file by doing
 # uv run fastapi dev main.py
@@ -38,23 +125,78 @@ class PlaceData(BaseModel):
     types: Optional[List[str]] = Field(None, description="Restaurant types")
     location: Optional[dict] = Field(None, description="Lat/lng coordinates")
 
+class RunLimits(BaseModel):
+    # Per-run agent budget; unset fields fall back to the RESERVATION_MAX_* defaults
+    max_turns: Optional[int] = Field(None, ge=1, description="Max agent steps")
+    max_seconds: Optional[float] = Field(None, gt=0, description="Max wall-clock seconds")
+    max_tokens: Optional[int] = Field(None, ge=1, description="Max model tokens")
+
 class SingleReservationRequest(BaseModel):
     place_data: PlaceData
     reservation_details: ReservationRequest
+    budget: Optional[RunLimits] = None
 
 class BatchReservationRequest(BaseModel):
     places_data: List[PlaceData] = Field(..., description="List of restaurants")
     reservation_details: ReservationRequest
+    budget: Optional[RunLimits] = Field(None, description="Budget for each place's run")
+    parallelism: int = Field(1, ge=1, le=10, description="Places attempted at once, each on its own pooled computer (capped at the pool size)")
+    first_confirmed_wins: bool = Field(False, description="Cancel the remaining attempts once one place is confirmed")
+
+class BudgetUsage(BaseModel):
+    turns: int
+    tokens: int
+    seconds: float
+    max_turns: int
+    max_seconds: float
+    max_tokens: int
+    # Why the run ended early: a final status ('confirmed', ...) or the limit hit ('max_turns', ...)
+    stopped_by: Optional[str] = None
 
 class ReservationResponse(BaseModel):
     restaurant_name: str
     location: str
-    status: str  # 'confirmed', 'requires_phone_call', 'no_availability', 'error', 'attempted'
+    status: str  # 'confirmed', 'requires_phone_call', 'no_availability', 'error', 'attempted', 'cancelled', 'cancelled_possibly_booked'
     confirmation_number: Optional[str] = None
     phone_for_manual_booking: Optional[str] = None
+    booking_url: Optional[str] = None  # booking page the agent used (remembered per place_id)
     messages: List[str] = []
     timestamp: str
     error: Optional[str] = None
+    budget: Optional[BudgetUsage] = None
+
+class ReservationJob(BaseModel):
+    job_id: str
+    kind: str  # 'single' or 'batch'
+    status: str  # 'queued', 'running', 'succeeded', 'failed', 'interrupted'
+    attempts: int = 0
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    result: Optional[Any] = None  # ReservationResponse, or a list of them for batch jobs
+    progress: List[Any] = []  # batch jobs: each place's ReservationResponse (plus its index) as it finishes
+    error: Optional[str] = None
+    status_url: str
+    events_url: str
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+def job_view(job):
+    return ReservationJob(
+        job_id=job["id"],
+        kind=job["kind"],
+        status=job["status"],
+        attempts=job["attempts"],
+        created_at=_iso(job["created_at"]),
+        started_at=_iso(job["started_at"]),
+        finished_at=_iso(job["finished_at"]),
+        result=job["result"],
+        progress=job["progress"],
+        error=job["error"],
+        status_url=f"/reservation/jobs/{job['id']}",
+        events_url=f"/reservation/jobs/{job['id']}/events",
+    )
 
 @app.get("/")
 def read_root():
@@ -67,12 +209,26 @@ def read_item(item_id: int, q: Union[str, None] = None):
 @app.post("/email/{email_name}")
 async def run_email_ai(email_name: str):
     from email_ai import loginmyemail
-    await loginmyemail(email_name)
+    await loginmyemail(email_name, pool=get_pool())
+
+def profile_requested(request: Request):
+    """Whether a reservation request asked to be profiled (and profiling is on)"""
+    profiler = profiling.get_profiler()
+    return profiler is not None and profiler.authorized(profiling.requested_flag(request.headers, request.query_params))
 
-@app.post("/reservation/single", response_model=ReservationResponse)
-async def make_single_reservation(request: SingleReservationRequest):
+@app.post("/reservation/single", response_model=Union[ReservationJob, ReservationResponse])
+async def make_single_reservation(request: SingleReservationRequest, http_request: Request, response: Response,
+                                  wait: bool = False):
     """
     Make a reservation at a single restaurant
+
+    Queues the reservation and answers 202 with a ReservationJob right away;
+    poll its status_url or subscribe to its events_url for the result.
+    Pass ?wait=true to hold the request open until the reservation is done
+    and get the ReservationResponse directly.
+
+    With PROFILING_ENABLED=1, an X-Profile header (or ?profile=) profiles the
+    agent run; X-Profile-Id names the profile to fetch from /profiles/{id}.
     
     Example usage:
     ```
@@ -94,25 +250,42 @@ async def make_single_reservation(request: SingleReservationRequest):
     }
     ```
     """
-    try:
-        from reservation_agent import make_single_reservation as make_reservation
-        
-        # Convert Pydantic models to dicts
-        place_data_dict = request.place_data.model_dump()
-        reservation_dict = request.reservation_details.model_dump()
-        
-        # Make the reservation
-        result = await make_reservation(place_data_dict, reservation_dict)
-        
-        return ReservationResponse(**result)
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Reservation failed: {str(e)}")
-
-@app.post("/reservation/batch", response_model=List[ReservationResponse])
-async def make_batch_reservations(request: BatchReservationRequest):
+    # Convert Pydantic models to dicts
+    job = await jobs.submit("single", {
+        "place_data": request.place_data.model_dump(),
+        "reservation_details": request.reservation_details.model_dump(),
+        "budget": request.budget.model_dump() if request.budget else None,
+        "profile": profile_requested(http_request),
+    })
+    if job["payload"]["profile"]:
+        response.headers[profiling.ID_HEADER] = job["id"]
+    if not wait:
+        response.status_code = 202
+        return job_view(job)
+
+    job = await jobs.wait(job["id"])
+    if job is None:
+        raise HTTPException(status_code=500, detail="Reservation job disappeared")
+    if job["status"] != SUCCEEDED:
+        raise HTTPException(status_code=500, detail=f"Reservation {job['status']}: {job['error']}")
+    return ReservationResponse(**job["result"])
+
+@app.post("/reservation/batch", response_model=Union[ReservationJob, List[ReservationResponse]])
+async def make_batch_reservations(request: BatchReservationRequest, http_request: Request, response: Response,
+                                  wait: bool = False):
     """
     Make reservations at multiple restaurants for trip planning
+
+    Queued like /reservation/single (202 + ReservationJob, or ?wait=true for
+    the list of ReservationResponse), and profiled the same way.
+
+    With parallelism > 1 several places are attempted at once, each on its
+    own computer from the CUA pool (400 when the pool is off; capped at the
+    pool size); every place's result is added to the job's progress (and
+    sent as a 'progress' event) as soon as it finishes. first_confirmed_wins
+    stops the other attempts once one place confirms; those come back as
+    'cancelled', or 'cancelled_possibly_booked' if their run had already
+    started and may have submitted a booking.
     
     Example usage:
     ```
@@ -135,29 +308,68 @@ async def make_batch_reservations(request: BatchReservationRequest):
             "name": "Sarah Johnson",
             "phone": "(555) 987-6543",
             "occasion": "Group dinner"
-        }
+        },
+        "parallelism": 2,
+        "first_confirmed_wins": true
     }
     ```
     """
-    try:
-        from reservation_agent import ReservationAgent
-        
-        agent = ReservationAgent()
-        
-        # Convert Pydantic models to dicts
-        places_data_list = [place.model_dump() for place in request.places_data]
-        reservation_dict = request.reservation_details.model_dump()
-        
-        # Make batch reservations
-        results = await agent.batch_make_reservations(places_data_list, reservation_dict)
-        
-        # Clean up
-        await agent.cleanup()
-        
-        return [ReservationResponse(**result) for result in results]
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Batch reservation failed: {str(e)}")
+    if request.parallelism > 1 and get_pool() is None:
+        raise HTTPException(status_code=400, detail="parallelism > 1 needs the CUA computer pool (CUA_POOL_SIZE > 0)")
+    # Convert Pydantic models to dicts
+    job = await jobs.submit("batch", {
+        "places_data": [place.model_dump() for place in request.places_data],
+        "reservation_details": request.reservation_details.model_dump(),
+        "parallelism": request.parallelism,
+        "first_confirmed_wins": request.first_confirmed_wins,
+        "budget": request.budget.model_dump() if request.budget else None,
+        "profile": profile_requested(http_request),
+    })
+    if job["payload"]["profile"]:
+        response.headers[profiling.ID_HEADER] = job["id"]
+    if not wait:
+        response.status_code = 202
+        return job_view(job)
+
+    job = await jobs.wait(job["id"])
+    if job is None:
+        raise HTTPException(status_code=500, detail="Batch reservation job disappeared")
+    if job["status"] != SUCCEEDED:
+        raise HTTPException(status_code=500, detail=f"Batch reservation {job['status']}: {job['error']}")
+    return [ReservationResponse(**result) for result in job["result"]]
+
+@app.get("/reservation/jobs/{job_id}", response_model=ReservationJob)
+def get_reservation_job(job_id: str):
+    """
+    Current state of a queued reservation; result is set once status is
+    'succeeded'. 'interrupted' means the server running it went away mid-run:
+    the booking may or may not have been made, so it is not retried.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job_view(job)
+
+@app.get("/reservation/jobs/{job_id}/events")
+async def reservation_job_events(job_id: str):
+    """
+    Server-Sent Events for a reservation job: one event per status change
+    (queued, running, succeeded/failed/interrupted) and a 'progress' event per finished
+    place of a batch, each carrying the ReservationJob, closing once the job
+    has finished.
+    """
+    if await asyncio.to_thread(jobs.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def generate():
+        async for event, job in jobs.subscribe(job_id):
+            yield f"event: {event}\ndata: {job_view(job).model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+    )
 
 @app.get("/reservation/example-google-maps")
 def get_example_google_maps_format():
@@ -196,16 +408,38 @@ def get_reservation_status_codes():
             "requires_phone_call": "Restaurant requires phone booking, phone number provided",
             "no_availability": "No availability found for requested time/date",
             "attempted": "Reservation was attempted but status unclear",
+            "cancelled": "Batch attempt stopped because another place was confirmed first",
+            "cancelled_possibly_booked": "Batch attempt stopped after its run had started; it may have submitted a booking, check with the restaurant",
             "error": "Technical error occurred during reservation process"
         },
         "response_fields": {
             "confirmation_number": "Provided when status is 'confirmed'",
             "phone_for_manual_booking": "Provided when status is 'requires_phone_call'",
+            "booking_url": "Booking page the agent used, reused for the next booking at the same place_id",
+            "budget": "Turns, tokens and seconds the agent run used against its limits, and what stopped it early",
             "messages": "Detailed log of what the agent did",
             "error": "Error details when status is 'error'"
         }
     }
 
+@app.get("/reservation/pool")
+def get_computer_pool_stats():
+    """Warm CUA computer pool: idle/leased/booting counts, utilization and lease wait times"""
+    pool = get_pool()
+    return pool.stats() if pool is not None else {"size": 0}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text format: HTTP latency, job run times, agent/lease stage timings and pool gauges"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/profiles")
+@app.get("/profiles/{profile_id}")
+def get_profiles(request: Request, profile_id: Optional[str] = None):
+    """Saved request/job profiles (PROFILING_ENABLED=1); ?format=folded for flame graph stacks"""
+    status, body, content_type = profiling.download(profile_id, request.headers, request.query_params)
+    return Response(body, status_code=status, media_type=content_type)
+
 # Health check endpoint for monitoring
 @app.get("/health")
 def health_check():
@@ -0,0 +1,373 @@
+# maps_cache.py
+"""
+Response cache for the Google Maps web services used by app.py.
+
+Lookups go through two tiers: a small in-process LRU (no I/O at all) in front
+of an on-disk SQLite store that survives restarts and is shared by every
+worker process on the box. Entries expire per endpoint (geocodes barely change,
+nearby results go stale much faster) and both tiers are size-bounded.
+
+Keys are normalized so that trivially different requests share an entry:
+the API key is stripped, params are sorted, "lat,lng" values are rounded and
+free-text params (address, keyword, query) are case/whitespace folded. IDs
+and tokens (place_id, pagetoken, ...) are kept exactly as sent.
+
+Misses for the same key that arrive while a fetch is already running wait for
+that fetch instead of issuing their own (see singleflight.py).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+# Seconds an entry stays fresh, per endpoint.
+DEFAULT_TTLS = {
+    "geocode": 30 * 24 * 3600,
+    "directions": 6 * 3600,
+    "distance_matrix": 6 * 3600,
+    "nearby": 24 * 3600,
+    "details": 7 * 24 * 3600,
+    "textsearch": 24 * 3600,
+}
+DEFAULT_TTL = 3600
+
+# 5 decimals is ~1 m, well below anything Google resolves differently.
+COORD_PRECISION = 5
+
+_LATLNG_RE = re.compile(r"^\s*([-+]?\d+(?:\.\d+)?)\s*,\s*([-+]?\d+(?:\.\d+)?)\s*$")
+
+# Params Google matches case-insensitively; only these are folded.
+FREE_TEXT_PARAMS = frozenset({"address", "keyword", "query"})
+
+
+def normalize_value(value, precision=COORD_PRECISION, fold=False):
+    """Round "lat,lng" strings, recurse into pipe-joined lists; fold=True also folds free text."""
+    if isinstance(value, float):
+        return round(value, precision)
+    if not isinstance(value, str):
+        return value
+    if "|" in value:
+        return "|".join(normalize_value(v, precision, fold) for v in value.split("|"))
+    m = _LATLNG_RE.match(value)
+    if m:
+        lat = round(float(m.group(1)), precision)
+        lng = round(float(m.group(2)), precision)
+        return f"{lat},{lng}"
+    return " ".join(value.lower().split()) if fold else value
+
+
+def normalize_key(endpoint, params, precision=COORD_PRECISION):
+    """Return a stable cache key for (endpoint, params), ignoring the API key."""
+    clean = {
+        k: normalize_value(v, precision, fold=k in FREE_TEXT_PARAMS)
+        for k, v in params.items()
+        if k != "key" and v is not None
+    }
+    blob = json.dumps(clean, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha1(blob.encode("utf-8")).hexdigest()
+    return f"{endpoint}:{digest}"
+
+
+# ---------- Storage tiers --------------------------------------------------
+
+class NullStore:
+    """Store that never holds anything (used when caching is disabled)."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, expires_at):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class LRUStore:
+    """Thread-safe in-process LRU holding (expires_at, value) pairs."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteStore:
+    """
+    On-disk store shared across processes. Rows beyond max_rows are evicted
+    least-recently-used first; expired rows are purged on the same sweep.
+    """
+
+    # Sweep for expired/overflow rows once every N writes rather than on each.
+    SWEEP_EVERY = 64
+
+    def __init__(self, path, max_rows=50000):
+        self.path = str(path)
+        self.max_rows = max_rows
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS maps_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS maps_cache_accessed ON maps_cache(accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM maps_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                self._conn.execute("DELETE FROM maps_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE maps_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+        return expires_at, json.loads(value)
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO maps_cache (key, value, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, time.time()),
+            )
+            self._writes += 1
+            if self._writes % self.SWEEP_EVERY == 0:
+                self._sweep()
+            self._conn.commit()
+
+    def _sweep(self):
+        self._conn.execute("DELETE FROM maps_cache WHERE expires_at < ?", (time.time(),))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM maps_cache").fetchone()
+        overflow = count - self.max_rows
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM maps_cache WHERE key IN ("
+                " SELECT key FROM maps_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM maps_cache")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM maps_cache").fetchone()
+        return count
+
+
+# ---------- Two-tier cache -------------------------------------------------
+
+class MapsCache:
+    """
+    LRU-in-front-of-disk cache with per-endpoint TTLs and hit/miss counters.
+
+    Usage:
+        value = cache.get_or_fetch("geocode", params, fetch)
+    where fetch() performs the real request. Pass cacheable=... to keep
+    error responses (OVER_QUERY_LIMIT etc.) out of the cache.
+    """
+
+    def __init__(self, memory=None, disk=None, ttls=None, precision=COORD_PRECISION):
+        self.memory = memory if memory is not None else LRUStore()
+        self.disk = disk if disk is not None else NullStore()
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.precision = precision
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._aflight = AsyncSingleFlight()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the cache from environment variables:
+          MAPS_CACHE_DISABLED=1        -> no caching at all
+          MAPS_CACHE_PATH=...          -> SQLite file ("" keeps it in-memory only)
+          MAPS_CACHE_MEMORY_ENTRIES    -> LRU size (default 2048)
+          MAPS_CACHE_DISK_ROWS         -> SQLite row cap (default 50000)
+          MAPS_CACHE_TTL_<ENDPOINT>    -> TTL override in seconds, e.g. MAPS_CACHE_TTL_NEARBY=600
+        """
+        if os.environ.get("MAPS_CACHE_DISABLED") == "1":
+            return cls(memory=NullStore(), disk=NullStore())
+        path = os.environ.get(
+            "MAPS_CACHE_PATH", str(Path(__file__).parent / ".maps_cache.sqlite3")
+        )
+        memory = LRUStore(int(os.environ.get("MAPS_CACHE_MEMORY_ENTRIES", 2048)))
+        disk = (
+            SQLiteStore(path, int(os.environ.get("MAPS_CACHE_DISK_ROWS", 50000)))
+            if path
+            else NullStore()
+        )
+        ttls = {}
+        for endpoint in DEFAULT_TTLS:
+            override = os.environ.get(f"MAPS_CACHE_TTL_{endpoint.upper()}")
+            if override:
+                ttls[endpoint] = int(override)
+        return cls(memory=memory, disk=disk, ttls=ttls)
+
+    def _count(self, endpoint, field):
+        with self._lock:
+            counters = self._counters.setdefault(
+                endpoint, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "coalesced": 0}
+            )
+            counters[field] += 1
+
+    def key(self, endpoint, params):
+        return normalize_key(endpoint, params, self.precision)
+
+    def get(self, endpoint, params):
+        """Return the cached value or None."""
+        key = self.key(endpoint, params)
+        value = self._get_memory(endpoint, key)
+        return value if value is not None else self._get_disk(endpoint, key)
+
+    async def aget(self, endpoint, params):
+        """get for the event loop: memory hits answer inline, SQLite runs on a worker thread."""
+        key = self.key(endpoint, params)
+        value = self._get_memory(endpoint, key)
+        return value if value is not None else await asyncio.to_thread(self._get_disk, endpoint, key)
+
+    def _get_memory(self, endpoint, key):
+        item = self.memory.get(key)
+        if item is None:
+            return None
+        self._count(endpoint, "memory_hits")
+        return item[1]
+
+    def _get_disk(self, endpoint, key):
+        item = self.disk.get(key)
+        if item is not None:
+            expires_at, value = item
+            self.memory.set(key, value, expires_at)
+            self._count(endpoint, "disk_hits")
+            return value
+        self._count(endpoint, "misses")
+        return None
+
+    def set(self, endpoint, params, value):
+        ttl = self.ttls.get(endpoint, DEFAULT_TTL)
+        if ttl <= 0:
+            return
+        key = self.key(endpoint, params)
+        expires_at = time.time() + ttl
+        self.memory.set(key, value, expires_at)
+        self.disk.set(key, value, expires_at)
+        self._count(endpoint, "stores")
+
+    async def aset(self, endpoint, params, value):
+        """set without blocking the event loop on the SQLite write."""
+        await asyncio.to_thread(self.set, endpoint, params, value)
+
+    def get_or_fetch(self, endpoint, params, fetch, cacheable=None):
+        value = self.get(endpoint, params)
+        if value is not None:
+            return value
+
+        def fetch_and_store():
+            value = fetch()
+            if value is not None and (cacheable is None or cacheable(value)):
+                self.set(endpoint, params, value)
+            return value
+
+        # Stored before the flight lands, so later callers hit the cache instead
+        value, shared = self._flight.do(self.key(endpoint, params), fetch_and_store)
+        if shared:
+            self._count(endpoint, "coalesced")
+        return value
+
+    async def aget_or_fetch(self, endpoint, params, afetch, cacheable=None):
+        """get_or_fetch for coroutine fetchers; concurrent misses share one await."""
+        value = await self.aget(endpoint, params)
+        if value is not None:
+            return value
+
+        async def fetch_and_store():
+            value = await afetch()
+            if value is not None and (cacheable is None or cacheable(value)):
+                await self.aset(endpoint, params, value)
+            return value
+
+        value, shared = await self._aflight.do(self.key(endpoint, params), fetch_and_store)
+        if shared:
+            self._count(endpoint, "coalesced")
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self):
+        """Snapshot of hit/miss counters per endpoint plus tier sizes."""
+        with self._lock:
+            endpoints = {k: dict(v) for k, v in self._counters.items()}
+        for counters in endpoints.values():
+            lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+            hits = counters["memory_hits"] + counters["disk_hits"]
+            counters["hit_ratio"] = round(hits / lookups, 3) if lookups else 0.0
+        return {
+            "endpoints": endpoints,
+            "memory_entries": len(self.memory),
+            "memory_evictions": getattr(self.memory, "evictions", 0),
+            "disk_entries": len(self.disk),
+            "disk_evictions": getattr(self.disk, "evictions", 0),
+            "in_flight": self._flight.in_flight() + self._aflight.in_flight(),
+        }
@@ -0,0 +1,286 @@
+# maps_client.py
+"""
+Shared HTTP client for the Google Maps web services.
+
+One MapsClient holds a pooled keep-alive requests.Session, so calls reuse
+TCP+TLS connections to maps.googleapis.com instead of handshaking every time.
+It applies a timeout to every call, retries transient failures
+(OVER_QUERY_LIMIT / UNKNOWN_ERROR, HTTP 429 and 5xx, connection errors) with
+exponential backoff, and keeps per-endpoint latency and error stats.
+Given a QuotaGovernor (quota.py), every attempt first waits for its
+endpoint's rate limit, shared across worker processes. AsyncMapsClient does
+the same on httpx for the ASGI service.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+ENDPOINTS = {
+    "geocode": "https://maps.googleapis.com/maps/api/geocode/json",
+    "directions": "https://maps.googleapis.com/maps/api/directions/json",
+    "distance_matrix": "https://maps.googleapis.com/maps/api/distancematrix/json",
+    "nearby": "https://maps.googleapis.com/maps/api/place/nearbysearch/json",
+    "details": "https://maps.googleapis.com/maps/api/place/details/json",
+    "textsearch": "https://maps.googleapis.com/maps/api/place/textsearch/json",
+}
+
+# Google statuses that mean "try again shortly" rather than "bad request".
+RETRY_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+RETRY_HTTP_CODES = {429, 500, 502, 503, 504}
+
+# Latencies kept per endpoint for percentile estimates.
+_LATENCY_WINDOW = 512
+
+
+class EndpointStats:
+    """Call/error/retry counters and a rolling latency window for one endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.throttle_ms = 0.0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent = []
+
+    def record(self, ms, ok):
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self._recent.append(ms)
+        if len(self._recent) > _LATENCY_WINDOW:
+            del self._recent[0]
+
+    def snapshot(self):
+        recent = sorted(self._recent)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 1) if recent else 0.0
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "throttle_ms": round(self.throttle_ms, 1),
+            "avg_ms": round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class _BaseMapsClient:
+    """Configuration, quota and stats shared by the sync and async clients."""
+
+    def __init__(self, api_key, connect_timeout=3.05, read_timeout=10.0,
+                 max_retries=3, backoff_base=0.25, pool_size=32, governor=None, base_url=None):
+        self.api_key = api_key
+        # base_url swaps the Google host for a stand-in (e.g. fake_maps.py), keeping the paths
+        self.urls = {
+            endpoint: base_url.rstrip("/") + urlsplit(url).path if base_url else url
+            for endpoint, url in ENDPOINTS.items()
+        }
+        self.governor = governor
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.pool_size = pool_size
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, api_key, governor=None):
+        """
+        MAPS_CONNECT_TIMEOUT / MAPS_READ_TIMEOUT (seconds), MAPS_MAX_RETRIES
+        and MAPS_POOL_SIZE override the defaults. MAPS_BASE_URL points the
+        client at another host, such as a local fake_maps.py.
+        """
+        return cls(
+            api_key,
+            connect_timeout=float(os.environ.get("MAPS_CONNECT_TIMEOUT", 3.05)),
+            read_timeout=float(os.environ.get("MAPS_READ_TIMEOUT", 10.0)),
+            max_retries=int(os.environ.get("MAPS_MAX_RETRIES", 3)),
+            pool_size=int(os.environ.get("MAPS_POOL_SIZE", 32)),
+            governor=governor,
+            base_url=os.environ.get("MAPS_BASE_URL") or None,
+        )
+
+    def _endpoint_stats(self, endpoint):
+        with self._lock:
+            return self._stats.setdefault(endpoint, EndpointStats())
+
+    def _cost(self, endpoint, params):
+        if endpoint == "distance_matrix":
+            return len(params["origins"].split("|")) * len(params["destinations"].split("|"))
+        return 1
+
+    def _record(self, endpoint, stats, started, ok):
+        seconds = time.perf_counter() - started
+        with self._lock:
+            stats.record(seconds * 1000, ok=ok)
+        metrics.observe_upstream(endpoint, seconds, ok)
+
+    def _record_throttle(self, stats, waited):
+        if waited > 0:
+            with self._lock:
+                stats.throttled += 1
+                stats.throttle_ms += waited * 1000
+
+    def _record_retry(self, stats):
+        with self._lock:
+            stats.retries += 1
+
+    def _backoff(self, attempt):
+        # Full jitter keeps a burst of workers from retrying in lockstep
+        return random.uniform(0, self.backoff_base * (2 ** attempt))
+
+    def geocode(self, **params):
+        return self.get("geocode", params)
+
+    def directions(self, **params):
+        return self.get("directions", params)
+
+    def distance_matrix(self, **params):
+        return self.get("distance_matrix", params)
+
+    def nearby(self, **params):
+        return self.get("nearby", params)
+
+    def details(self, **params):
+        return self.get("details", params)
+
+    def textsearch(self, **params):
+        return self.get("textsearch", params)
+
+    def stats(self):
+        with self._lock:
+            return {name: s.snapshot() for name, s in self._stats.items()}
+
+
+class MapsClient(_BaseMapsClient):
+    """
+    Usage:
+        maps = MapsClient(api_key)
+        data = maps.get("geocode", {"address": "CN Tower"})
+    The API key is added to every request; get() returns the decoded JSON.
+    """
+
+    def __init__(self, api_key, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(ENDPOINTS), pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, endpoint, params):
+        """
+        GET an endpoint (a key of ENDPOINTS) and return its JSON.
+        Transient failures are retried; if they persist, the last Google
+        status is returned as-is, or the last HTTP/connection error raised.
+        """
+        url = self.urls[endpoint]
+        stats = self._endpoint_stats(endpoint)
+        attempt = 0
+        while True:
+            if self.governor is not None:
+                self._record_throttle(stats, self.governor.acquire(endpoint, self._cost(endpoint, params)))
+            started = time.perf_counter()
+            try:
+                r = self.session.get(url, params={**params, "key": self.api_key}, timeout=self.timeout)
+                retryable = r.status_code in RETRY_HTTP_CODES
+                if not retryable:
+                    r.raise_for_status()
+                    data = r.json()
+                    retryable = data.get("status") in RETRY_STATUSES
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(endpoint, stats, started, ok=False)
+                if attempt >= self.max_retries:
+                    raise
+            except Exception:
+                self._record(endpoint, stats, started, ok=False)
+                raise
+            else:
+                self._record(endpoint, stats, started, ok=not retryable)
+                if not retryable:
+                    return data
+                if attempt >= self.max_retries:
+                    r.raise_for_status()
+                    return data
+            self._record_retry(stats)
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+
+class AsyncMapsClient(_BaseMapsClient):
+    """
+    asyncio twin of MapsClient on a pooled httpx.AsyncClient:
+        data = await maps.get("geocode", {"address": "CN Tower"})
+    Same retries, quota and stats; call aclose() on shutdown.
+    """
+
+    def __init__(self, api_key, **kwargs):
+        import httpx
+
+        super().__init__(api_key, **kwargs)
+        self._httpx = httpx
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def get(self, endpoint, params):
+        """Async MapsClient.get."""
+        httpx = self._httpx
+        url = self.urls[endpoint]
+        stats = self._endpoint_stats(endpoint)
+        attempt = 0
+        while True:
+            if self.governor is not None:
+                # The bucket store may touch SQLite/Redis; keep that off the loop
+                wait = await asyncio.to_thread(self.governor.reserve, endpoint, self._cost(endpoint, params))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._record_throttle(stats, wait)
+            started = time.perf_counter()
+            try:
+                r = await self.client.get(url, params={**params, "key": self.api_key})
+                retryable = r.status_code in RETRY_HTTP_CODES
+                if not retryable:
+                    r.raise_for_status()
+                    data = r.json()
+                    retryable = data.get("status") in RETRY_STATUSES
+            except httpx.TransportError:
+                self._record(endpoint, stats, started, ok=False)
+                if attempt >= self.max_retries:
+                    raise
+            except Exception:
+                self._record(endpoint, stats, started, ok=False)
+                raise
+            else:
+                self._record(endpoint, stats, started, ok=not retryable)
+                if not retryable:
+                    return data
+                if attempt >= self.max_retries:
+                    r.raise_for_status()
+                    return data
+            self._record_retry(stats)
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,306 @@
+# metrics.py
+"""
+Per-stage timings and Prometheus metrics for the backend services.
+
+A request runs inside a Trace; code marks its stages with spans:
+
+    trace = Trace("suggest_stops")
+    with active(trace):
+        with span("directions"):
+            ...
+    trace.finish()
+
+Time in each stage is summed per request (a stage can be entered many
+times, e.g. once per scored candidate). finish() logs the breakdown and
+feeds every stage total into the stage_seconds histogram. Spans outside a
+trace go straight into the histogram. Upstream Google calls (maps_client.py)
+and HTTP requests have histograms of their own.
+
+REGISTRY.render() returns the Prometheus text format served on /metrics by
+app.py, route_service.py and main.py. Metrics live in the process: behind
+several worker processes, each worker reports its own.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; wide enough for a 5 ms cache hit and a 10 minute agent run.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Cap on a profiled request's timeline (see Trace.keep_events)
+MAX_TRACE_EVENTS = 5000
+
+
+def configure_logging():
+    """Root logging for a service entry point; LOG_LEVEL picks the level (default INFO)."""
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_label_str(self.labels, k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Values read at scrape time from fn() -> {label values tuple: value}."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def _samples(self):
+        try:
+            values = self.fn() if self.fn is not None else {}
+        except Exception as e:
+            logger.warning("Gauge %s failed: %s", self.name, e)
+            values = {}
+        return [f"{self.name}{_label_str(self.labels, k)} {v}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_label_str(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._add(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_seconds", "Time per request spent in each pipeline stage", ("pipeline", "stage")
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "Time to response headers per HTTP request", ("method", "route", "status")
+)
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "maps_upstream_seconds", "Google Maps request latency per attempt", ("endpoint", "outcome")
+)
+
+
+class Trace:
+    """
+    Stage timings for one request.
+
+    keep_events() also records a timeline (every span and upstream call with
+    its start offset), which profiling.py saves with a request's profile.
+    on_finish holds callbacks run with the trace once it finishes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.upstream = {}
+        self.events = None
+        self.on_finish = []
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def keep_events(self):
+        with self._lock:
+            if self.events is None:
+                self.events = []
+
+    def _event(self, kind, name, seconds, **extra):
+        # Caller holds the lock
+        if self.events is None or len(self.events) >= MAX_TRACE_EVENTS:
+            return
+        end = time.perf_counter() - self.started
+        self.events.append({
+            "type": kind,
+            "name": name,
+            "start_ms": round((end - seconds) * 1000, 1),
+            "ms": round(seconds * 1000, 1),
+            "thread": threading.current_thread().name,
+            **extra,
+        })
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            self._event("stage", stage, seconds)
+
+    def add_upstream(self, endpoint, seconds, ok=True):
+        with self._lock:
+            calls, total = self.upstream.get(endpoint, (0, 0.0))
+            self.upstream[endpoint] = (calls + 1, total + seconds)
+            self._event("upstream", endpoint, seconds, ok=ok)
+
+    def add_event(self, kind, name, seconds, **extra):
+        with self._lock:
+            self._event(kind, name, seconds, **extra)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                "stages_ms": {k: round(v * 1000, 1) for k, v in self.stages.items()},
+                "upstream": {k: {"calls": c, "ms": round(s * 1000, 1)} for k, (c, s) in self.upstream.items()},
+            }
+
+    def finish(self):
+        """Record the stage totals and log the breakdown (once)."""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            stages = dict(self.stages)
+        for stage, seconds in stages.items():
+            STAGE_SECONDS.observe(seconds, pipeline=self.name, stage=stage)
+        logger.info("%s timings %s", self.name, json.dumps(self.summary()))
+        for callback in self.on_finish:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.exception("Trace %s finish callback failed: %s", self.name, e)
+
+
+_current = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def active(trace):
+    """Make trace the current one for spans in this context (and tasks/threads copied from it)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(stage, pipeline=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, pipeline)
+
+
+def observe_stage(stage, seconds, pipeline=None):
+    """Add seconds to stage in the current trace, or straight to the histogram without one."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+    else:
+        STAGE_SECONDS.observe(seconds, pipeline=pipeline or "background", stage=stage)
+
+
+def observe_upstream(endpoint, seconds, ok):
+    UPSTREAM_SECONDS.observe(seconds, endpoint=endpoint, outcome="ok" if ok else "error")
+    trace = _current.get()
+    if trace is not None:
+        trace.add_upstream(endpoint, seconds, ok)
+
+
+def record_event(kind, name, seconds, **extra):
+    """Add a timeline entry (e.g. one agent turn) to the current trace, if it keeps events."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add_event(kind, name, seconds, **extra)
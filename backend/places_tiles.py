@@ -0,0 +1,221 @@
+# places_tiles.py
+"""
+Geohash tile index for Places Nearby results.
+
+The exact-key response cache in maps_cache.py only helps when a new search
+circle is identical (after rounding) to an old one, but different routes
+through the same neighbourhood sample at slightly different points. Here POIs
+are stored per geohash cell and search query (type + keyword), and each cell
+remembers when it was last *fully* fetched, i.e. it sat entirely inside a
+search circle whose results were not truncated. A new circle that only
+touches fresh, fully fetched cells is answered locally.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from geo import haversine_meters
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Precision 7 cells are ~153 m x 153 m: fine enough that a circle's edge
+# cells are usually covered by earlier circles along the same streets.
+DEFAULT_PRECISION = 7
+
+# Circles touching more cells than this (radius beyond ~4 km at precision 7)
+# always go to Google.
+MAX_LOOKUP_CELLS = 2000
+
+
+def geohash_encode(lat, lng, precision=DEFAULT_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bit, ch, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch = (ch << 1) | 1
+                lng_lo = mid
+            else:
+                ch <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(chars)
+
+
+def cell_size(precision=DEFAULT_PRECISION):
+    """(lat_degrees, lng_degrees) spanned by one cell at this precision."""
+    bits = 5 * precision
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def cells_for_circle(lat, lng, radius_m, precision=DEFAULT_PRECISION):
+    """
+    Return (touching, inside): geohash cells intersecting the circle and the
+    subset lying entirely inside it.
+    """
+    dlat, dlng = cell_size(precision)
+    r_lat = math.degrees(radius_m / 6371000.0)
+    r_lng = r_lat / max(math.cos(math.radians(lat)), 1e-6)
+    lat0 = math.floor((lat - r_lat + 90.0) / dlat) * dlat - 90.0
+    lng0 = math.floor((lng - r_lng + 180.0) / dlng) * dlng - 180.0
+
+    touching, inside = set(), set()
+    cell_lat = lat0
+    while cell_lat < lat + r_lat:
+        cell_lng = lng0
+        while cell_lng < lng + r_lng:
+            corners = [
+                (cell_lat, cell_lng), (cell_lat + dlat, cell_lng),
+                (cell_lat, cell_lng + dlng), (cell_lat + dlat, cell_lng + dlng),
+            ]
+            nearest = (min(max(lat, cell_lat), cell_lat + dlat), min(max(lng, cell_lng), cell_lng + dlng))
+            if haversine_meters((lat, lng), nearest) <= radius_m:
+                cell = geohash_encode(cell_lat + dlat / 2, cell_lng + dlng / 2, precision)
+                touching.add(cell)
+                if all(haversine_meters((lat, lng), c) <= radius_m for c in corners):
+                    inside.add(cell)
+            cell_lng += dlng
+        cell_lat += dlat
+    return touching, inside
+
+
+def query_key(place_type=None, keyword=None):
+    return f"{(place_type or '').strip().lower()}|{' '.join((keyword or '').lower().split())}"
+
+
+class PlaceTileStore:
+    """SQLite-backed tile index; safe to share between threads and processes."""
+
+    def __init__(self, path, ttl=24 * 3600, precision=DEFAULT_PRECISION):
+        self.ttl = ttl
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS place_tiles ("
+            " cell TEXT NOT NULL, query TEXT NOT NULL, fetched_at REAL NOT NULL,"
+            " PRIMARY KEY (cell, query))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS place_pois ("
+            " place_id TEXT NOT NULL, query TEXT NOT NULL, cell TEXT NOT NULL,"
+            " lat REAL NOT NULL, lng REAL NOT NULL, data TEXT NOT NULL, fetched_at REAL NOT NULL,"
+            " PRIMARY KEY (place_id, query))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS place_pois_cell ON place_pois(query, cell)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls, ttl=24 * 3600):
+        """
+        MAPS_TILE_PATH selects the SQLite file ("" disables the tile index,
+        in which case None is returned).
+        """
+        path = os.environ.get(
+            "MAPS_TILE_PATH", str(Path(__file__).parent / ".places_tiles.sqlite3")
+        )
+        if not path or os.environ.get("MAPS_CACHE_DISABLED") == "1":
+            return None
+        return cls(path, ttl=ttl)
+
+    def lookup(self, lat, lng, radius_m, place_type=None, keyword=None):
+        """
+        Return the places within radius_m of (lat, lng) if every cell the
+        circle touches is fresh and fully fetched, else None.
+        """
+        query = query_key(place_type, keyword)
+        touching, _ = cells_for_circle(lat, lng, radius_m, self.precision)
+        if not touching or len(touching) > MAX_LOOKUP_CELLS:
+            return None
+        fresh_after = time.time() - self.ttl
+        cells = sorted(touching)
+        marks = ",".join("?" * len(cells))
+        with self._lock:
+            (fresh,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM place_tiles WHERE query = ? AND fetched_at >= ? AND cell IN ({marks})",
+                (query, fresh_after, *cells),
+            ).fetchone()
+            if fresh < len(cells):
+                self.misses += 1
+                return None
+            rows = self._conn.execute(
+                f"SELECT lat, lng, data FROM place_pois WHERE query = ? AND cell IN ({marks})",
+                (query, *cells),
+            ).fetchall()
+            self.hits += 1
+        places = []
+        for p_lat, p_lng, data in rows:
+            d = haversine_meters((lat, lng), (p_lat, p_lng))
+            if d <= radius_m:
+                places.append((d, json.loads(data)))
+        places.sort(key=lambda item: item[0])
+        return [p for _, p in places]
+
+    def record(self, lat, lng, radius_m, place_type, keyword, results, complete):
+        """
+        Store the POIs from one Nearby search. Cells entirely inside the circle
+        are marked fully fetched only when the results were complete (no
+        further page was left unfetched).
+        """
+        query = query_key(place_type, keyword)
+        now = time.time()
+        rows = []
+        for p in results:
+            loc = p.get("geometry", {}).get("location")
+            pid = p.get("place_id")
+            if not loc or not pid:
+                continue
+            cell = geohash_encode(loc["lat"], loc["lng"], self.precision)
+            rows.append((pid, query, cell, loc["lat"], loc["lng"], json.dumps(p), now))
+        inside = cells_for_circle(lat, lng, radius_m, self.precision)[1] if complete else set()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO place_pois (place_id, query, cell, lat, lng, data, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if inside:
+                # Anything stored earlier in a refreshed cell but missing from this
+                # complete result set has closed or moved; drop it.
+                marks = ",".join("?" * len(inside))
+                self._conn.execute(
+                    f"DELETE FROM place_pois WHERE query = ? AND fetched_at < ? AND cell IN ({marks})",
+                    (query, now, *sorted(inside)),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO place_tiles (cell, query, fetched_at) VALUES (?, ?, ?)",
+                    [(cell, query, now) for cell in inside],
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (tiles,) = self._conn.execute("SELECT COUNT(*) FROM place_tiles").fetchone()
+            (pois,) = self._conn.execute("SELECT COUNT(*) FROM place_pois").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "tiles": tiles, "pois": pois}
@@ -0,0 +1,269 @@
+# profiling.py
+"""
+Opt-in profiling of individual live requests.
+
+Off unless PROFILING_ENABLED=1. Once it is on, a /suggest_stops or
+reservation request that carries the X-Profile header (or ?profile=...) is
+profiled while it runs. Two things are captured:
+- a sampling profile: the Python stack of every thread, every
+  PROFILE_INTERVAL_MS (default 10 ms)
+- the request's timeline: each stage span and upstream call (Maps requests,
+  agent turns), with its start offset and duration
+
+The profile is saved as PROFILE_DIR/<id>.json, keeping the newest
+PROFILE_KEEP. The response says where it went in its X-Profile-Id header.
+Download it from GET /profiles/<id>; ?format=folded gives the stacks in the
+format flamegraph.pl and speedscope read. GET /profiles lists recent ones.
+A reservation is profiled while its job runs, under the job id.
+
+If PROFILING_TOKEN is set, the flag's value must equal the token, and the
+downloads need it too (same header or query parameter). Without a token any
+value except 0/false/no turns profiling on and anyone can download the
+profiles, so the services log a warning at startup; set a token anywhere the
+port is reachable by others. At most PROFILE_MAX_ACTIVE
+requests are profiled at once; any more run without a profile.
+
+Samples cover every thread in the process. Requests running at the same time
+show up in the stacks, but the timeline belongs to this request alone.
+"""
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+HEADER = "X-Profile"
+QUERY_PARAM = "profile"
+ID_HEADER = "X-Profile-Id"
+
+ID_RE = re.compile(r"^[0-9a-f]{8,32}$")
+
+MAX_STACK_DEPTH = 64
+TOP_FUNCTIONS = 25
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Background thread that counts the folded stacks of every other thread."""
+
+    def __init__(self, interval=0.01, max_seconds=900.0):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.counts = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                key = ";".join([names.get(ident, str(ident))] + stack[::-1])
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+
+def top_functions(counts, limit=TOP_FUNCTIONS):
+    """Leaf frames by sample count (where the threads actually were)."""
+    leaves = {}
+    for stack, count in counts.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        leaves[leaf] = leaves.get(leaf, 0) + count
+    return [{"function": f, "samples": n} for f, n in sorted(leaves.items(), key=lambda kv: -kv[1])[:limit]]
+
+
+def folded(profile):
+    """Collapsed-stack text ("thread;outer;...;inner count" per line) of a saved profile."""
+    return "".join(f"{stack} {count}\n" for stack, count in profile["samples"]["stacks"].items())
+
+
+class Profiler:
+    """Starts per-request profiles and keeps the saved ones in a directory."""
+
+    def __init__(self, root, token=None, interval=0.01, keep=50, max_active=2, max_seconds=900.0):
+        self.root = Path(root)
+        self.token = token
+        self.interval = interval
+        self.keep = keep
+        self.max_active = max_active
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self._active = []
+
+    @classmethod
+    def from_env(cls):
+        token = os.environ.get("PROFILING_TOKEN") or None
+        if token is None:
+            logger.warning(
+                "PROFILING_ENABLED=1 without PROFILING_TOKEN: any client can profile requests "
+                "and download the saved profiles"
+            )
+        return cls(
+            os.environ.get("PROFILE_DIR", str(Path(__file__).parent / ".profiles")),
+            token=token,
+            interval=float(os.environ.get("PROFILE_INTERVAL_MS", 10)) / 1000.0,
+            keep=int(os.environ.get("PROFILE_KEEP", 50)),
+            max_active=int(os.environ.get("PROFILE_MAX_ACTIVE", 2)),
+            max_seconds=float(os.environ.get("PROFILE_MAX_SECONDS", 900)),
+        )
+
+    def authorized(self, value):
+        """Whether a flag / download value turns profiling on (or may read profiles)."""
+        if not value:
+            return False
+        if self.token is None:
+            return value.strip().lower() not in ("0", "false", "no")
+        return hmac.compare_digest(value.encode(), self.token.encode())
+
+    def start(self, trace, route, profile_id=None):
+        """
+        Profile the request behind trace until trace.finish(). Returns the
+        profile id, or None when PROFILE_MAX_ACTIVE profiles are already running.
+        """
+        with self._lock:
+            # A sampler whose request never finished stops itself at max_seconds
+            self._active = [s for s in self._active if s.is_alive()]
+            if len(self._active) >= self.max_active:
+                logger.info("Not profiling %s: %d profiles already running", route, len(self._active))
+                return None
+            sampler = StackSampler(self.interval, self.max_seconds).start()
+            self._active.append(sampler)
+        profile_id = profile_id or uuid.uuid4().hex[:16]
+        started_at = time.time()
+        trace.keep_events()
+
+        def save(trace):
+            counts = sampler.stop()
+            self.save(profile_id, {
+                "id": profile_id,
+                "name": trace.name,
+                "route": route,
+                "started_at": started_at,
+                **trace.summary(),
+                "timeline": list(trace.events or []),
+                "samples": {
+                    "interval_ms": round(self.interval * 1000, 3),
+                    "count": sampler.samples,
+                    "top": top_functions(counts),
+                    "stacks": counts,
+                },
+            })
+            logger.info("Saved profile %s for %s", profile_id, route)
+
+        trace.on_finish.append(save)
+        return profile_id
+
+    def save(self, profile_id, profile):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{profile_id}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(profile, f)
+        os.replace(tmp, self.root / f"{profile_id}.json")
+        for old in self._paths()[self.keep:]:
+            old.unlink(missing_ok=True)
+
+    def _paths(self):
+        """Saved profiles, newest first."""
+        paths = []
+        for path in self.root.glob("*.json"):
+            try:
+                paths.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        return [path for _, path in sorted(paths, reverse=True)]
+
+    def get(self, profile_id):
+        if not ID_RE.match(profile_id):
+            return None
+        try:
+            with open(self.root / f"{profile_id}.json", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list(self):
+        items = []
+        for path in self._paths():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    profile = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            items.append({k: profile.get(k) for k in ("id", "name", "route", "started_at", "total_ms")})
+        return items
+
+
+_profiler = None
+
+
+def get_profiler():
+    """The process-wide profiler, built from the environment on first use (None unless PROFILING_ENABLED=1)."""
+    global _profiler
+    if os.environ.get("PROFILING_ENABLED") != "1":
+        return None
+    if _profiler is None:
+        _profiler = Profiler.from_env()
+    return _profiler
+
+
+def requested_flag(headers, query):
+    return headers.get(HEADER) or query.get(QUERY_PARAM)
+
+
+def maybe_start(trace, route, headers, query, profile_id=None):
+    """Start profiling trace if profiling is on and the request asked for it; returns the profile id or None."""
+    profiler = get_profiler()
+    if profiler is None or not profiler.authorized(requested_flag(headers, query)):
+        return None
+    return profiler.start(trace, route, profile_id)
+
+
+def download(profile_id, headers, query):
+    """
+    (status, body, content type) for GET /profiles (profile_id None) and
+    GET /profiles/<id>, shared by the services.
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        return 404, json.dumps({"error": "Profiling is disabled"}), "application/json"
+    if profiler.token is not None and not profiler.authorized(requested_flag(headers, query)):
+        return 403, json.dumps({"error": "Profiling token required"}), "application/json"
+    if profile_id is None:
+        return 200, json.dumps({"profiles": profiler.list()}), "application/json"
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return 404, json.dumps({"error": "Unknown profile"}), "application/json"
+    if query.get("format") == "folded":
+        return 200, folded(profile), "text/plain; charset=utf-8"
+    return 200, json.dumps(profile), "application/json"
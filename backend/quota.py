@@ -0,0 +1,173 @@
+# quota.py
+"""
+Token-bucket quota governor for the Google Maps endpoints.
+
+Each endpoint gets a bucket refilled at 'rate' tokens per second up to
+'burst'. Callers reserve tokens before every upstream request and sleep only
+as long as the bucket says, so we run as fast as the quota allows and never
+faster. Bucket state lives in a store shared by every worker process:
+
+  MemoryBucketStore  one process (threads only)
+  SQLiteBucketStore  all processes on one host (the default)
+  RedisBucketStore   all processes on all hosts, given any Redis-compatible
+                     client exposing eval()
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_RATE = 50.0
+
+# Distance Matrix is metered in elements (origins x destinations), not requests.
+DEFAULT_RATES = {
+    "distance_matrix": 1000.0,
+}
+
+
+class MemoryBucketStore:
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, rate, burst, cost=1):
+        """Take cost tokens (possibly going into debt); return seconds to wait."""
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate) - cost
+            self._buckets[key] = (tokens, now)
+        return max(0.0, -tokens / rate)
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite file; BEGIN IMMEDIATE serializes reservations across processes."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS quota_buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def reserve(self, key, rate, burst, cost=1):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM quota_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (burst, now)
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate) - cost
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO quota_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return max(0.0, -tokens / rate)
+
+
+# Same arithmetic as above, run atomically server-side on the server's clock.
+_REDIS_RESERVE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1])
+local ts = tonumber(b[2])
+if tokens == nil then tokens = burst; ts = now end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate) - cost
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+if tokens >= 0 then return '0' end
+return tostring(-tokens / rate)
+"""
+
+
+class RedisBucketStore:
+    def __init__(self, client, prefix="maps_quota:"):
+        self.client = client
+        self.prefix = prefix
+
+    def reserve(self, key, rate, burst, cost=1):
+        wait = self.client.eval(_REDIS_RESERVE, 1, self.prefix + key, rate, burst, cost)
+        return float(wait.decode() if isinstance(wait, bytes) else wait)
+
+
+class QuotaGovernor:
+    """
+    Usage:
+        governor = QuotaGovernor(SQLiteBucketStore(path), rates={"nearby": 20})
+        governor.acquire("nearby")  # blocks until the request may go out
+    """
+
+    def __init__(self, store, rates=None, default_rate=DEFAULT_RATE, burst_seconds=1.0):
+        self.store = store
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self.default_rate = default_rate
+        self.burst_seconds = burst_seconds
+
+    @classmethod
+    def from_env(cls):
+        """
+        MAPS_QUOTA_DISABLED=1 turns the governor off (None is returned).
+        MAPS_QUOTA_REDIS_URL shares buckets through Redis (needs the redis
+        package); otherwise MAPS_QUOTA_PATH selects the SQLite file ("" keeps
+        buckets in this process only).
+        MAPS_QPS sets the default rate, MAPS_QPS_<ENDPOINT> overrides one
+        endpoint, and MAPS_QUOTA_BURST_SECONDS sizes the buckets.
+        """
+        if os.environ.get("MAPS_QUOTA_DISABLED") == "1":
+            return None
+        redis_url = os.environ.get("MAPS_QUOTA_REDIS_URL")
+        path = os.environ.get("MAPS_QUOTA_PATH", str(Path(__file__).parent / ".maps_quota.sqlite3"))
+        if redis_url:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("MAPS_QUOTA_REDIS_URL is set but the redis package is not installed") from e
+            store = RedisBucketStore(redis.Redis.from_url(redis_url))
+        elif path:
+            store = SQLiteBucketStore(path)
+        else:
+            store = MemoryBucketStore()
+        prefix = "MAPS_QPS_"
+        rates = {
+            k[len(prefix):].lower(): float(v)
+            for k, v in os.environ.items()
+            if k.startswith(prefix)
+        }
+        return cls(
+            store,
+            rates=rates,
+            default_rate=float(os.environ.get("MAPS_QPS", DEFAULT_RATE)),
+            burst_seconds=float(os.environ.get("MAPS_QUOTA_BURST_SECONDS", 1.0)),
+        )
+
+    def rate_for(self, endpoint):
+        return self.rates.get(endpoint, self.default_rate)
+
+    def reserve(self, endpoint, cost=1):
+        """Reserve cost units of endpoint quota without waiting; returns seconds the caller must wait."""
+        rate = self.rate_for(endpoint)
+        if rate <= 0:
+            return 0.0
+        burst = max(float(cost), math.ceil(rate * self.burst_seconds))
+        return self.store.reserve(endpoint, rate, burst, cost)
+
+    def acquire(self, endpoint, cost=1):
+        """Reserve cost units of endpoint quota, sleeping if needed. Returns seconds waited."""
+        wait = self.reserve(endpoint, cost)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
@@ -1,6 +1,11 @@
 from agent import ComputerAgent
 from computer import Computer, VMProviderType
 import asyncio
+import contextlib
+import os
+import re
+import shlex
+import time
 import webbrowser
 import logging
 import json
@@ -8,18 +13,109 @@ from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 import dotenv
 
+import metrics
+from booking_memory import find_booking_url
+
 dotenv.load_dotenv('/Users/ayroescobar/cua/notebooks/.env')
 
+logger = logging.getLogger(__name__)
+
+# Concurrent attempts per batch when the caller doesn't say; each one holds a VM.
+DEFAULT_BATCH_PARALLELISM = 1
+
+PHONE_RE = re.compile(r'(\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4})')
+# Upper-case code with at least one digit, so 'Confirmation number will be emailed' doesn't count;
+# 'Confirmation number: ABC123' and 'Your confirmation number is ABC123' both do
+CONFIRMATION_RE = re.compile(r'(?i:confirmation)\s*(?i:number|code|#)?[^\w]*(?:(?i:is)\b[^\w]*)?((?=[A-Z]*\d)[A-Z0-9]{6,})')
+
+# What the prompt asks the agent to lead its final message with
+OUTCOME_RE = re.compile(r'OUTCOME:\s*(CONFIRMED|NO_AVAILABILITY|PHONE_ONLY)', re.IGNORECASE)
+OUTCOME_MARKERS = {
+    'CONFIRMED': 'confirmed',
+    'NO_AVAILABILITY': 'no_availability',
+    'PHONE_ONLY': 'requires_phone_call',
+}
+
+# Messages that settle the outcome even without the marker. Keywords alone
+# aren't enough: "7:00 is fully booked" is followed by trying 7:30.
+FINAL_PATTERNS = {
+    'confirmed': CONFIRMATION_RE,
+    'no_availability': re.compile(
+        r'no (availability|tables?|reservations?)( available)? (at all|within|for the (next|whole|entire) week)',
+        re.IGNORECASE
+    ),
+    'requires_phone_call': re.compile(
+        r"(does not|doesn't|do not|don't) (accept|take|offer) (online )?(reservations|bookings)", re.IGNORECASE
+    ),
+}
+
+
+class RunBudget:
+    """
+    Limits for one agent run: max_turns agent steps, max_seconds of wall
+    clock, max_tokens model tokens. A run that hits one is stopped and
+    reported with whatever it had found so far.
+    """
+
+    def __init__(self, max_turns=40, max_seconds=600.0, max_tokens=500_000):
+        self.max_turns = max_turns
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """RESERVATION_MAX_TURNS / _MAX_SECONDS / _MAX_TOKENS, with per-request overrides (None = default)."""
+        budget = cls(
+            max_turns=int(os.environ.get("RESERVATION_MAX_TURNS", 40)),
+            max_seconds=float(os.environ.get("RESERVATION_MAX_SECONDS", 600)),
+            max_tokens=int(os.environ.get("RESERVATION_MAX_TOKENS", 500_000)),
+        )
+        for key, value in overrides.items():
+            if value is not None:
+                setattr(budget, key, value)
+        return budget
+
+    def limits(self):
+        return {'max_turns': self.max_turns, 'max_seconds': self.max_seconds, 'max_tokens': self.max_tokens}
+
+    def exceeded(self, turns, tokens, seconds):
+        """Name of the first limit reached, or None"""
+        if turns >= self.max_turns:
+            return 'max_turns'
+        if tokens >= self.max_tokens:
+            return 'max_tokens'
+        if seconds >= self.max_seconds:
+            return 'max_seconds'
+        return None
+
 class ReservationAgent:
     """
     Agent for making restaurant reservations using CUA from Google Maps API place data
+
+    With a ComputerPool (computer_pool.py) every reservation runs on a leased,
+    already booted computer; without one the agent boots its own. With a
+    BookingMemory (booking_memory.py) places booked before start on their
+    known booking page instead of a web search.
     """
     
-    def __init__(self, model="anthropic/claude-sonnet-4-20250514", verbosity=logging.INFO):
+    def __init__(self, model="anthropic/claude-sonnet-4-20250514", verbosity=logging.INFO, pool=None, memory=None,
+                 budget=None):
         self.model = model
         self.verbosity = verbosity
+        self.pool = pool
+        self.memory = memory
+        self.budget = budget or RunBudget.from_env()
         self.computer = None
         self.agent = None
+
+    def new_agent(self, computer):
+        """A ComputerAgent driving the given computer"""
+        return ComputerAgent(
+            model=self.model,
+            tools=[computer],
+            verbosity=self.verbosity,
+            only_n_most_recent_images=2
+        )
     
     async def setup_computer(self):
         """Initialize the computer environment"""
@@ -33,12 +129,7 @@ class ReservationAgent:
         webbrowser.open("http://localhost:8006/", new=0, autoraise=True)
         
         # Initialize agent
-        self.agent = ComputerAgent(
-            model=self.model,
-            tools=[self.computer],
-            verbosity=self.verbosity,
-            only_n_most_recent_images=2
-        )
+        self.agent = self.new_agent(self.computer)
     
     async def cleanup(self):
         """Clean up computer resources"""
@@ -72,7 +163,40 @@ class ReservationAgent:
         ]
         return queries
     
-    def create_reservation_prompt(self, place_info: Dict, reservation_details: Dict) -> str:
+    def find_steps(self, place_name: str, vicinity: str, known_path: Optional[Dict] = None) -> str:
+        """Prompt steps for getting to the booking page, shortened when we've been there before"""
+        if known_path and known_path.get('booking_url'):
+            return f"""
+        1. We have booked {place_name} before through {known_path['platform']}. The booking page
+           {known_path['booking_url']} should already be open in the browser; if it isn't, open that URL directly
+        
+        2. Only if that page no longer works, search for "{place_name} {vicinity} reservations" in a web browser
+           and look for the restaurant's official website or a reservation platform (OpenTable, Resy, Tock)
+        
+        3. Navigate to the reservation booking page if you are not already on it
+        """
+        if known_path and known_path.get('phone'):
+            return f"""
+        1. Last time {place_name} did not take online reservations (phone: {known_path['phone']}).
+           Search for "{place_name} {vicinity} reservations" to check whether that has changed
+        
+        2. If there is still no online booking, stop and report the phone number
+        
+        3. Otherwise navigate to the reservation booking page
+        """
+        return f"""
+        1. First, search for "{place_name} {vicinity} reservations" in a web browser
+        2. Look for the restaurant's official website or reservation platforms like:
+           - OpenTable
+           - Resy
+           - Tock
+           - The restaurant's own booking system
+           - Yelp reservations
+        
+        3. Navigate to the reservation booking page
+        """
+
+    def create_reservation_prompt(self, place_info: Dict, reservation_details: Dict, known_path: Optional[Dict] = None) -> str:
         """Create a detailed prompt for the CUA agent to make a reservation"""
         
         place_name = place_info['name']
@@ -102,18 +226,9 @@ class ReservationAgent:
         {f'- Special requests: {special_requests}' if special_requests else ''}
         
         Please follow these steps:
-        
-        1. First, search for "{place_name} {vicinity} reservations" in a web browser
-        2. Look for the restaurant's official website or reservation platforms like:
-           - OpenTable
-           - Resy
-           - Tock
-           - The restaurant's own booking system
-           - Yelp reservations
-        
-        3. Navigate to the reservation booking page
-        
-        4. Fill out the reservation form with the provided details:
+        {self.find_steps(place_name, vicinity, known_path)}
+        4. Once you are on the booking page, state its address as "Booking page: <url>"
+           and fill out the reservation form with the provided details:
            - Select the date: {date}
            - Select the time: {time}
            - Enter party size: {party_size}
@@ -134,10 +249,70 @@ class ReservationAgent:
            - Report back with the phone number and any relevant information
         
         Please be thorough and patient with form filling. Some reservation sites can be slow to load.
-        Report back with the status of the reservation attempt.
+        Report back with the status of the reservation attempt, starting your final message with
+        "OUTCOME: CONFIRMED", "OUTCOME: NO_AVAILABILITY" or "OUTCOME: PHONE_ONLY" when one of them applies.
         """
         
         return prompt
+
+    def classify_message(self, message: str, reservation_result: Dict) -> bool:
+        """
+        Update reservation_result from one agent message. Returns True once the
+        outcome is final (an OUTCOME: line, a confirmation number, no
+        availability all week, or no online booking at all), so the run can stop.
+        """
+        lowered = message.lower()
+        # Parse agent response for success indicators
+        if any(keyword in lowered for keyword in ['confirmation', 'confirmed', 'reserved', 'booking confirmed']):
+            reservation_result['status'] = 'confirmed'
+            # Find the confirmation number (alphanumeric code)
+            conf_match = CONFIRMATION_RE.search(message)
+            if conf_match:
+                reservation_result['confirmation_number'] = conf_match.group(1)
+        
+        elif any(keyword in lowered for keyword in ['phone', 'call', 'contact']):
+            # Extract phone number for manual booking
+            phone_match = PHONE_RE.search(message)
+            if phone_match:
+                reservation_result['phone_for_manual_booking'] = phone_match.group(1)
+                reservation_result['status'] = 'requires_phone_call'
+        
+        elif any(keyword in lowered for keyword in ['no availability', 'fully booked', 'not available']):
+            reservation_result['status'] = 'no_availability'
+
+        outcome = OUTCOME_RE.search(message)
+        if outcome:
+            reservation_result['status'] = OUTCOME_MARKERS[outcome.group(1).upper()]
+            return True
+        status = reservation_result['status']
+        return status in FINAL_PATTERNS and FINAL_PATTERNS[status].search(message) is not None
+
+    async def open_booking_page(self, computer, known_path: Optional[Dict]):
+        """Best effort: have the browser on the remembered booking page before the agent starts"""
+        if not known_path or not known_path.get('booking_url'):
+            return
+        try:
+            await asyncio.wait_for(
+                computer.interface.run_command(f"xdg-open {shlex.quote(known_path['booking_url'])} >/dev/null 2>&1 &"),
+                timeout=10
+            )
+        except Exception as e:
+            logger.warning("Could not pre-open %s: %s", known_path['booking_url'], e)
+
+    def remember(self, place_info: Dict, reservation_result: Dict):
+        """Store where this run booked (or learned there's no online booking) for next time"""
+        if self.memory is None or not place_info.get('place_id'):
+            return
+        try:
+            self.memory.record(
+                place_info['place_id'],
+                place_info['name'],
+                reservation_result['status'],
+                booking_url=reservation_result.get('booking_url'),
+                phone=reservation_result.get('phone_for_manual_booking'),
+            )
+        except Exception as e:
+            logger.warning("Could not save booking path for %s: %s", place_info['name'], e)
     
     async def make_reservation(self, place_data: Dict, reservation_details: Dict) -> Dict:
         """
@@ -151,14 +326,31 @@ class ReservationAgent:
             Dict with reservation status and details
         """
         
+        known_path = self.memory.get(place_data.get('place_id')) if self.memory is not None else None
+
+        if self.pool is not None:
+            async with self.pool.lease() as computer:
+                await self.open_booking_page(computer, known_path)
+                result = await self.run_reservation(self.new_agent(computer), place_data, reservation_details, known_path)
+                if result['status'] == 'error':
+                    # run_reservation reports agent errors instead of raising; the
+                    # computer may be wedged, so don't hand it to the next run
+                    self.pool.report_failure(computer)
+                return result
+
         if not self.agent:
             await self.setup_computer()
-        
+        await self.open_booking_page(self.computer, known_path)
+        return await self.run_reservation(self.agent, place_data, reservation_details, known_path)
+
+    async def run_reservation(self, agent, place_data: Dict, reservation_details: Dict,
+                              known_path: Optional[Dict] = None) -> Dict:
+        """Drive one reservation attempt with the given ComputerAgent"""
         place_info = self.extract_place_info(place_data)
-        prompt = self.create_reservation_prompt(place_info, reservation_details)
+        prompt = self.create_reservation_prompt(place_info, reservation_details, known_path)
         
-        print(f"Making reservation for {place_info['name']}...")
-        print("User request:", prompt)
+        logger.info("Making reservation for %s", place_info['name'])
+        logger.debug("User request: %s", prompt)
         
         reservation_result = {
             'restaurant_name': place_info['name'],
@@ -166,90 +358,179 @@ class ReservationAgent:
             'status': 'pending',
             'confirmation_number': None,
             'phone_for_manual_booking': None,
+            'booking_url': None,
             'messages': [],
             'timestamp': datetime.now().isoformat()
         }
         
+        started = time.monotonic()
+        usage = {'turns': 0, 'tokens': 0, 'seconds': 0.0, 'stopped_by': None, **self.budget.limits()}
+
+        async def drive():
+            turn_started = time.monotonic()
+            # aclosing: returning early must still shut the agent's generator down
+            async with contextlib.aclosing(agent.run(prompt)) as results:
+                async for result in results:
+                    tokens = (result.get("usage") or {}).get("total_tokens") or 0
+                    usage['turns'] += 1
+                    usage['tokens'] += tokens
+                    # Shows up in the timeline of a profiled job
+                    metrics.record_event("agent_turn", place_info['name'], time.monotonic() - turn_started, tokens=tokens)
+                    turn_started = time.monotonic()
+                    if result["output"] and result["output"][-1]["type"] == "message":
+                        message = result["output"][-1]["content"][0]["text"]
+                        logger.debug("Agent: %s", message)
+                        reservation_result['messages'].append(message)
+                        if self.classify_message(message, reservation_result):
+                            # The outcome is settled; don't pay for the agent to keep clicking
+                            usage['stopped_by'] = reservation_result['status']
+                            return
+                    exceeded = self.budget.exceeded(usage['turns'], usage['tokens'], time.monotonic() - started)
+                    if exceeded:
+                        logger.info("Stopping reservation run for %s: %s reached", place_info['name'], exceeded)
+                        usage['stopped_by'] = exceeded
+                        return
+
         try:
             # Run the CUA agent
-            async for result in self.agent.run(prompt):
-                if result["output"] and result["output"][-1]["type"] == "message":
-                    message = result["output"][-1]["content"][0]["text"]
-                    print("Agent:", message)
-                    reservation_result['messages'].append(message)
-                    
-                    # Parse agent response for success indicators
-                    if any(keyword in message.lower() for keyword in ['confirmation', 'confirmed', 'reserved', 'booking confirmed']):
-                        reservation_result['status'] = 'confirmed'
-                        # Try to extract confirmation number
-                        if 'confirmation' in message.lower():
-                            # Simple regex to find confirmation numbers (alphanumeric patterns)
-                            import re
-                            conf_match = re.search(r'confirmation[^\w]*([A-Z0-9]{6,})', message, re.IGNORECASE)
-                            if conf_match:
-                                reservation_result['confirmation_number'] = conf_match.group(1)
-                    
-                    elif any(keyword in message.lower() for keyword in ['phone', 'call', 'contact']):
-                        # Extract phone number for manual booking
-                        import re
-                        phone_match = re.search(r'(\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4})', message)
-                        if phone_match:
-                            reservation_result['phone_for_manual_booking'] = phone_match.group(1)
-                            reservation_result['status'] = 'requires_phone_call'
-                    
-                    elif any(keyword in message.lower() for keyword in ['no availability', 'fully booked', 'not available']):
-                        reservation_result['status'] = 'no_availability'
-            
-            # If status is still pending, mark as completed but unclear
-            if reservation_result['status'] == 'pending':
-                reservation_result['status'] = 'attempted'
-                
+            with metrics.span("agent_run", pipeline="reservation"):
+                async with asyncio.timeout(self.budget.max_seconds):
+                    await drive()
+        except TimeoutError:
+            logger.info("Stopping reservation run for %s: max_seconds reached", place_info['name'])
+            usage['stopped_by'] = 'max_seconds'
         except Exception as e:
-            print(f"Error making reservation: {str(e)}")
+            logger.warning("Error making reservation: %s", e)
             reservation_result['status'] = 'error'
             reservation_result['error'] = str(e)
+        usage['seconds'] = round(time.monotonic() - started, 1)
+        reservation_result['budget'] = usage
+
+        # If status is still pending, mark as completed but unclear
+        if reservation_result['status'] == 'pending':
+            reservation_result['status'] = 'attempted'
         
+        reservation_result['booking_url'] = find_booking_url(reservation_result['messages'])
+        self.remember(place_info, reservation_result)
         return reservation_result
     
-    async def batch_make_reservations(self, places_data: List[Dict], reservation_details: Dict) -> List[Dict]:
+    def _place_result(self, place_data: Dict, status: str, **extra) -> Dict:
+        return {
+            'restaurant_name': place_data.get('name', 'Unknown'),
+            'location': place_data.get('vicinity', ''),
+            'status': status,
+            'messages': [],
+            'timestamp': datetime.now().isoformat(),
+            **extra
+        }
+
+    async def _reserve_isolated(self, place_data: Dict, reservation_details: Dict) -> Dict:
+        """One reservation on a computer of its own: leased from the pool, or booted just for it"""
+        if self.pool is not None:
+            return await self.make_reservation(place_data, reservation_details)
+        agent = ReservationAgent(model=self.model, verbosity=self.verbosity, memory=self.memory, budget=self.budget)
+        try:
+            return await agent.make_reservation(place_data, reservation_details)
+        finally:
+            await agent.cleanup()
+
+    async def iter_batch_reservations(self, places_data: List[Dict], reservation_details: Dict,
+                                      parallelism: Optional[int] = None, first_confirmed_wins: bool = False):
+        """
+        Attempt reservations at several places concurrently, each on its own
+        computer and agent, yielding (index, result) as each one finishes.
+
+        Args:
+            parallelism: max attempts running at once (default
+                DEFAULT_BATCH_PARALLELISM). More than one needs a pool, and
+                is capped at the pool's size.
+            first_confirmed_wins: once one place is confirmed, stop the other
+                attempts. Places still waiting for a slot are reported as
+                'cancelled'; those whose run had started may have submitted
+                a booking already and are reported as 'cancelled_possibly_booked'.
+
+        Raises ValueError for parallelism > 1 without a pool: every attempt
+        would boot its own Docker computer, and those collide on their ports.
+        """
+        parallelism = max(1, parallelism or DEFAULT_BATCH_PARALLELISM)
+        if parallelism > 1:
+            if self.pool is None:
+                raise ValueError("parallelism > 1 needs a computer pool (CUA_POOL_SIZE)")
+            # More would only queue for a computer, and could time out waiting
+            parallelism = min(parallelism, self.pool.size)
+        limit = asyncio.Semaphore(parallelism)
+        started = set()
+
+        async def attempt(index, place_data):
+            async with limit:
+                started.add(index)
+                try:
+                    return index, await self._reserve_isolated(place_data, reservation_details)
+                except Exception as e:
+                    logger.warning("Failed to process reservation for %s: %s", place_data.get('name', 'Unknown'), e)
+                    return index, self._place_result(place_data, 'error', error=str(e))
+
+        tasks = [asyncio.create_task(attempt(i, place)) for i, place in enumerate(places_data)]
+        reported = set()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                reported.add(index)
+                yield index, result
+                if first_confirmed_wins and result.get('status') == 'confirmed':
+                    logger.info("%s confirmed - cancelling the remaining attempts", result['restaurant_name'])
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Attempts that were still running (or waiting for a slot) when a winner came in
+        for index, task in enumerate(tasks):
+            if index in reported:
+                continue
+            if task.cancelled():
+                status = 'cancelled_possibly_booked' if index in started else 'cancelled'
+                yield index, self._place_result(places_data[index], status)
+            else:
+                yield task.result()
+
+    async def batch_make_reservations(self, places_data: List[Dict], reservation_details: Dict,
+                                      parallelism: Optional[int] = DEFAULT_BATCH_PARALLELISM,
+                                      first_confirmed_wins: bool = False,
+                                      on_result=None) -> List[Dict]:
         """
         Make reservations for multiple restaurants
         
         Args:
             places_data: List of place data from Google Maps API
             reservation_details: Common reservation details for all places
+            parallelism: how many places to attempt at once (1 = one after
+                another; more needs a pool, see iter_batch_reservations)
+            first_confirmed_wins: stop the other attempts once one is confirmed
+            on_result: optional async callback(index, result) called as each place finishes
             
         Returns:
-            List of reservation results
+            List of reservation results, in the order of places_data
         """
         
-        results = []
-        
-        for place_data in places_data:
-            try:
-                result = await self.make_reservation(place_data, reservation_details)
-                results.append(result)
-                
-                # Add delay between reservations to be respectful
-                await asyncio.sleep(5)
-                
-            except Exception as e:
-                print(f"Failed to process reservation for {place_data.get('name', 'Unknown')}: {str(e)}")
-                results.append({
-                    'restaurant_name': place_data.get('name', 'Unknown'),
-                    'status': 'error',
-                    'error': str(e),
-                    'timestamp': datetime.now().isoformat()
-                })
-        
+        results = [None] * len(places_data)
+        async for index, result in self.iter_batch_reservations(
+            places_data, reservation_details, parallelism=parallelism, first_confirmed_wins=first_confirmed_wins
+        ):
+            results[index] = result
+            if on_result is not None:
+                await on_result(index, result)
         return results
 
 
-async def make_single_reservation(place_data: Dict, reservation_details: Dict):
+async def make_single_reservation(place_data: Dict, reservation_details: Dict, pool=None, memory=None, budget=None):
     """
     Convenience function to make a single reservation
+    (on a leased computer when a ComputerPool is given, reusing the
+    BookingMemory's known booking page when there is one)
     """
-    agent = ReservationAgent()
+    agent = ReservationAgent(pool=pool, memory=memory, budget=budget)
     try:
         result = await agent.make_reservation(place_data, reservation_details)
         return result
@@ -0,0 +1,375 @@
+# reservation_jobs.py
+"""
+Background job queue for the reservation endpoints in main.py.
+
+A CUA reservation run takes minutes, far longer than an HTTP request should
+stay open. Submitting a reservation now only records a job and returns its
+id; a small pool of asyncio workers runs the jobs, and clients poll
+GET /reservation/jobs/{id} or subscribe to its event stream. Runners can
+report partial results (one per place of a batch) as they go; those land in
+the job's 'progress' list and are streamed as they arrive.
+
+Job state is kept in SQLite, so a restart doesn't lose work: jobs still
+queued are picked up again. Workers claim a job with one conditional UPDATE,
+so two workers (or two processes sharing the file) never run the same job,
+and hold a lease on it that they renew every LEASE_SECONDS / 3. A running
+job whose lease has expired lost its worker (crash, kill, restart). It is
+marked 'interrupted' rather than retried: the agent may already have
+submitted the booking, so only the user can tell whether to try again.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+FINISHED = (SUCCEEDED, FAILED, INTERRUPTED)
+
+INTERRUPTED_ERROR = (
+    "Interrupted before it finished; a booking may already have been made. "
+    "Check with the venue before submitting it again."
+)
+
+# A running job whose worker hasn't renewed its lease for this long is
+# considered lost.
+LEASE_SECONDS = 60
+
+# Subscribers re-read the job at least this often, to see changes made by
+# another process sharing the job file.
+SUBSCRIBE_POLL_SECONDS = 2.0
+
+logger = logging.getLogger(__name__)
+
+JOB_SECONDS = metrics.REGISTRY.histogram(
+    "reservation_job_seconds", "Run time of reservation jobs from start to finish", ("kind", "status")
+)
+
+
+class JobStore:
+    """Jobs in a SQLite table; payloads and results are stored as JSON."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=5, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reservation_jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " payload TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(reservation_jobs)")}
+        if "progress" not in columns:
+            self._conn.execute("ALTER TABLE reservation_jobs ADD COLUMN progress TEXT")
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE reservation_jobs ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE reservation_jobs ADD COLUMN heartbeat_at REAL")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS reservation_jobs_status ON reservation_jobs(status, created_at)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """RESERVATION_JOBS_PATH selects the SQLite file (":memory:" keeps jobs in-process)."""
+        return cls(os.environ.get(
+            "RESERVATION_JOBS_PATH", str(Path(__file__).parent / ".reservation_jobs.sqlite3")
+        ))
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        job["progress"] = json.loads(job["progress"]) if job["progress"] is not None else []
+        return job
+
+    def create(self, kind, payload):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO reservation_jobs (id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), time.time()),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM reservation_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row)
+
+    def _set_clause(self, fields):
+        for key in ("result", "progress"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        return ", ".join(f"{k} = ?" for k in fields), tuple(fields.values())
+
+    def update(self, job_id, **fields):
+        cols, values = self._set_clause(fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE reservation_jobs SET {cols} WHERE id = ?", (*values, job_id))
+            self._conn.commit()
+
+    def update_running(self, job_id, owner, **fields):
+        """
+        update() a job only while owner still holds it as running; False if it
+        doesn't (its lease expired and the job was marked interrupted).
+        """
+        cols, values = self._set_clause(fields)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE reservation_jobs SET {cols} WHERE id = ? AND owner = ? AND status = ?",
+                (*values, job_id, owner, RUNNING),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def claim(self, job_id, owner):
+        """
+        Move a queued job to running under owner and return it, or None if it
+        is no longer queued (another worker claimed it first).
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE reservation_jobs SET status = ?, owner = ?, started_at = ?, heartbeat_at = ?,"
+                " attempts = attempts + 1, progress = '[]' WHERE id = ? AND status = ?",
+                (RUNNING, owner, now, now, job_id, QUEUED),
+            )
+            self._conn.commit()
+        return self.get(job_id) if cursor.rowcount == 1 else None
+
+    def heartbeat(self, job_id, owner):
+        """Renew owner's lease on a running job; False if it no longer holds it."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE reservation_jobs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time(), job_id, owner, RUNNING),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def interrupt_expired(self, lease_seconds):
+        """Mark running jobs whose lease ran out as interrupted; returns their ids."""
+        now = time.time()
+        expired = "status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+        interrupted = []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id FROM reservation_jobs WHERE {expired}", (RUNNING, now - lease_seconds)
+            ).fetchall()
+            for (job_id,) in rows:
+                # Re-checked per row: the owner may have renewed meanwhile
+                cursor = self._conn.execute(
+                    f"UPDATE reservation_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND {expired}",
+                    (INTERRUPTED, INTERRUPTED_ERROR, now, job_id, RUNNING, now - lease_seconds),
+                )
+                if cursor.rowcount == 1:
+                    interrupted.append(job_id)
+            self._conn.commit()
+        return interrupted
+
+    def unfinished(self):
+        """Queued and running jobs, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM reservation_jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING),
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+
+class JobQueue:
+    """
+    Usage:
+        queue = JobQueue(JobStore.from_env(), {"single": run_single}, workers=2)
+        await queue.start()
+        job = await queue.submit("single", payload)
+    runners map a job kind to an async function(payload, progress) -> JSON-able
+    result, where 'await progress(item)' records a partial result.
+    With a profiler (profiling.Profiler), jobs whose payload has "profile": true
+    are profiled while they run, under their job id.
+    The store is SQLite; every call into it goes through asyncio.to_thread so a
+    busy job file never stalls the event loop.
+    """
+
+    def __init__(self, store, runners, workers=2, profiler=None, lease_seconds=LEASE_SECONDS):
+        self.store = store
+        self.runners = runners
+        self.workers = workers
+        self.profiler = profiler
+        self.lease_seconds = lease_seconds
+        # Names this queue's leases; unique per process and per queue
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = None
+        self._tasks = []
+        self._changed = None
+        # Bumped on every _notify(), so subscribers can tell they missed nothing
+        self._version = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._changed = asyncio.Condition()
+        await self._interrupt_expired()
+        for job in await asyncio.to_thread(self.store.unfinished):
+            if job["status"] == QUEUED:
+                self._queue.put_nowait(job["id"])
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self):
+        # Jobs cut off here are marked interrupted by their worker
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _interrupt_expired(self):
+        interrupted = await asyncio.to_thread(self.store.interrupt_expired, self.lease_seconds)
+        for job_id in interrupted:
+            logger.warning("Reservation job %s lost its worker; marked interrupted", job_id)
+        return interrupted
+
+    async def _reaper(self):
+        """Catch jobs whose worker died while this process keeps running."""
+        while True:
+            await asyncio.sleep(self.lease_seconds)
+            if await self._interrupt_expired():
+                await self._notify()
+
+    async def _heartbeat(self, job_id, run):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.store.heartbeat, job_id, self.owner):
+                # The job has been marked interrupted and the user told to check
+                # and resubmit; carrying on could book it twice.
+                logger.warning("Lost the lease on reservation job %s; cancelling its run", job_id)
+                run.cancel()
+                return
+
+    async def _notify(self):
+        async with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    async def submit(self, kind, payload):
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = await asyncio.to_thread(self.store.create, kind, payload)
+        await self._queue.put(job["id"])
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = await asyncio.to_thread(self.store.claim, job_id, self.owner)
+            if job is None:
+                continue
+            await self._notify()
+            progress = []
+
+            async def report(item, job_id=job_id, progress=progress):
+                progress.append(item)
+                await asyncio.to_thread(self.store.update_running, job_id, self.owner, progress=progress)
+                await self._notify()
+
+            async def finish(**fields):
+                if not await asyncio.to_thread(self.store.update_running, job_id, self.owner,
+                                               finished_at=time.time(), **fields):
+                    logger.warning("Reservation job %s was taken from this worker; not recording its %s",
+                                   job_id, fields["status"])
+
+            trace = metrics.Trace("reservation")
+            if job["payload"].get("profile") and self.profiler is not None:
+                # Saved under the job id, which the submitting request already returned
+                self.profiler.start(trace, f"reservation/{job['kind']}", profile_id=job_id)
+            with metrics.active(trace):
+                # Its own task, so a lost lease can cancel the run without the worker
+                run = asyncio.create_task(self.runners[job["kind"]](job["payload"], report))
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, run))
+            status = FAILED
+            try:
+                result = await run
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    # Shutting down mid-run: the booking may or may not have gone through
+                    await asyncio.shield(finish(status=INTERRUPTED, error=INTERRUPTED_ERROR))
+                    raise
+                # Cancelled by _heartbeat: the job is already marked interrupted
+                status = INTERRUPTED
+            except Exception as e:
+                logger.exception("Reservation job %s failed: %s", job_id, e)
+                await finish(status=FAILED, error=str(e))
+            else:
+                status = SUCCEEDED
+                await finish(status=SUCCEEDED, result=result)
+            finally:
+                heartbeat.cancel()
+            # Saves the job's profile, if it has one
+            await asyncio.to_thread(trace.finish)
+            JOB_SECONDS.observe(time.perf_counter() - trace.started, kind=job["kind"], status=status)
+            await self._notify()
+
+    def queued(self):
+        """Jobs waiting for a worker (None before start())."""
+        return self._queue.qsize() if self._queue is not None else None
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    async def subscribe(self, job_id):
+        """
+        Yield (event, job) each time the job changes, ending once it has
+        finished. event is the new status, or "progress" when a partial result
+        was added.
+
+        Changes made by this process wake subscribers at once. A job run by
+        another process sharing the job file is seen by re-reading it every
+        SUBSCRIBE_POLL_SECONDS.
+        """
+        last = (None, 0)
+        seen = None
+        while True:
+            if seen is not None:
+                async with self._changed:
+                    try:
+                        await asyncio.wait_for(
+                            self._changed.wait_for(lambda: self._version != seen), SUBSCRIBE_POLL_SECONDS
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+            # Noted before the read, so a change landing during it wakes the next wait
+            seen = self._version
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None:
+                return
+            current = (job["status"], len(job["progress"]))
+            if current == last:
+                continue
+            event = "progress" if current[0] == last[0] else job["status"]
+            last = current
+            yield event, job
+            if job["status"] in FINISHED:
+                return
+
+    async def wait(self, job_id):
+        """Block until the job has finished and return it (None for an unknown job)."""
+        job = None
+        async for _, job in self.subscribe(job_id):
+            pass
+        return job
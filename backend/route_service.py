@@ -0,0 +1,512 @@
+# route_service.py
+"""
+Async (ASGI) build of the route-helper endpoints from app.py.
+
+The Flask app holds a worker thread for the whole time a /suggest_stops
+request waits on Google, which is most of its life. Here every upstream call
+is awaited on one event loop through AsyncMapsClient (httpx), so a single
+process can keep hundreds of planning requests in flight.
+
+Request parsing, search planning, ranking, result shaping and the response
+caches come from suggest_core.py, shared with app.py, so both servers speak
+the same JSON contract (/search_place, /suggest_stops incl.
+?stream=ndjson|sse, /cache_stats, /maps_stats) and share quota buckets,
+cache files and the /suggest_stops response cache. This module doesn't
+import app.py, so it runs without Flask installed.
+
+The caches keep their SQLite tiers on disk; every read or write that can
+touch them runs on a worker thread (asyncio.to_thread) so the event loop
+never waits on file I/O.
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+import suggest_core
+from suggest_core import (
+    GOOGLE_API_KEY,
+    MAX_NEARBY_PAGES,
+    PAGE_TOKEN_RETRY_DELAYS,
+    PAGINATION_ENOUGH_FACTOR,
+    PLACES_MAX_WORKERS,
+    STREAM_MIMETYPES,
+    RouteContext,
+    SuggestRequestError,
+    _status_ok,
+    _store_nearby,
+    add_places,
+    candidate_result,
+    format_event,
+    format_search_results,
+    insertion_points,
+    leg_cache,
+    location_literal,
+    maps_cache,
+    parse_suggest_request,
+    place_tiles,
+    plan_search,
+    rank_candidates,
+    route_path,
+    shortlist_event,
+    stream_format,
+    suggest_cache,
+    summarize_route,
+    summary_event,
+)
+from detour import aiter_insertion_scores
+from maps_client import AsyncMapsClient
+import metrics
+import profiling
+from suggest_cache import MISS, STALE, etag_for, etag_matches, replay_events, response_headers, summary_body, with_stops
+
+# run this file by doing
+# uv run fastapi run route_service.py --port 5000
+
+# Same quota buckets as the Flask app, so both can run side by side.
+maps = AsyncMapsClient.from_env(GOOGLE_API_KEY, governor=suggest_core.governor)
+
+# LOG_LEVEL=DEBUG brings back the per-request and per-candidate detail
+metrics.configure_logging()
+logger = logging.getLogger(__name__)
+# Built now so a missing PROFILING_TOKEN is reported at startup
+profiling.get_profiler()
+
+# Follow-up page fetches still running; the loop only keeps weak references
+# to tasks, and these outlive the request that started them.
+_page_tasks = set()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    for task in list(_page_tasks):
+        task.cancel()
+    await asyncio.gather(*_page_tasks, return_exceptions=True)
+    await maps.aclose()
+
+
+async def finish_trace(trace):
+    """trace.finish() in a worker thread: with a profile attached it writes the JSON file."""
+    # Shielded so a client that disconnects mid-stream still gets its trace recorded
+    await asyncio.shield(asyncio.to_thread(trace.finish))
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    profile_id = getattr(request.state, "profile_id", None)
+    if profile_id:
+        response.headers[profiling.ID_HEADER] = profile_id
+    return response
+
+# ---------- Google Maps API helpers (async) -------------------------------
+
+async def geocode_address(address):
+    """Return (lat, lng) for a given address string using Geocoding API."""
+    params = {"address": address}
+    data = await maps_cache.aget_or_fetch(
+        "geocode", params, lambda: maps.get("geocode", params), cacheable=_status_ok
+    )
+    if data.get("status") != "OK" or not data.get("results"):
+        return None
+    loc = data["results"][0]["geometry"]["location"]
+    return (loc["lat"], loc["lng"])
+
+async def directions_json(origin, destination, waypoints=None):
+    params = {"origin": origin, "destination": destination}
+    if waypoints:
+        params["waypoints"] = "|".join(waypoints)
+    return await maps_cache.aget_or_fetch(
+        "directions", params, lambda: maps.get("directions", params), cacheable=_status_ok
+    )
+
+async def distance_matrix_json(origins, destinations):
+    params = {
+        "origins": "|".join(origins),
+        "destinations": "|".join(destinations),
+    }
+    return await maps_cache.aget_or_fetch(
+        "distance_matrix", params, lambda: maps.get("distance_matrix", params), cacheable=_status_ok
+    )
+
+async def text_search(query):
+    params = {"query": query}
+    return await maps_cache.aget_or_fetch(
+        "textsearch", params, lambda: maps.get("textsearch", params),
+        cacheable=lambda d: d.get("status") in ("OK", "ZERO_RESULTS"),
+    )
+
+class AsyncNearbyPages:
+    """app.NearbyPages on the event loop: follow-up pages load in a task."""
+
+    def __init__(self, query, first, next_token=None):
+        self.query = query  # (params, lat, lng, radius, place_type, keyword)
+        self.first = first
+        self._cancelled = asyncio.Event()
+        self._task = None
+        if next_token:
+            self._task = asyncio.create_task(self._fetch_rest(next_token))
+            _page_tasks.add(self._task)
+            self._task.add_done_callback(_page_tasks.discard)
+
+    @classmethod
+    def done(cls, results):
+        return cls(None, results)
+
+    async def _cancelled_within(self, delay):
+        try:
+            await asyncio.wait_for(self._cancelled.wait(), timeout=delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _fetch_rest(self, token):
+        params = self.query[0]
+        extra = []
+        pages = 1
+        try:
+            while token and pages < MAX_NEARBY_PAGES:
+                data = None
+                for delay in PAGE_TOKEN_RETRY_DELAYS:
+                    if await self._cancelled_within(delay):
+                        return extra
+                    data = await maps.get("nearby", {**params, "pagetoken": token})
+                    if data.get("status") != "INVALID_REQUEST":
+                        break
+                if not data or data.get("status") not in ("OK", "ZERO_RESULTS"):
+                    return extra
+                extra.extend(data.get("results", []))
+                token = data.get("next_page_token")
+                pages += 1
+            return extra
+        finally:
+            await asyncio.to_thread(_store_nearby, self.query, self.first + extra, not token)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    async def rest(self):
+        if self._task is None:
+            return []
+        return await self._task
+
+async def places_near_pages(lat, lng, radius=1000, place_type=None, keyword=None):
+    params = {
+        "location": f"{lat},{lng}",
+        "radius": int(radius),
+    }
+    if place_type:
+        params["type"] = place_type
+    if keyword:
+        params["keyword"] = keyword
+    cached = await maps_cache.aget("nearby", params)
+    if cached is not None:
+        return AsyncNearbyPages.done(cached)
+    if place_tiles is not None:
+        tiled = await asyncio.to_thread(place_tiles.lookup, lat, lng, radius, place_type, keyword)
+        if tiled is not None:
+            return AsyncNearbyPages.done(tiled)
+    data = await maps.get("nearby", params)
+    query = (params, lat, lng, radius, place_type, keyword)
+    results = data.get("results", [])
+    next_page = data.get("next_page_token")
+    if data.get("status") not in ("OK", "ZERO_RESULTS"):
+        return AsyncNearbyPages.done(results)
+    if not next_page:
+        await asyncio.to_thread(_store_nearby, query, results, True)
+    return AsyncNearbyPages(query, results, next_page)
+
+# ---------- Suggest-stops pipeline (async) --------------------------------
+
+async def resolve_stops(stops):
+    """Geocode every distinct stop once, concurrently. Returns an unrouted RouteContext."""
+
+    async def normalize(loc):
+        literal = location_literal(loc)
+        if literal:
+            return literal
+        if isinstance(loc, str):
+            coords = await geocode_address(loc)
+            return (coords, f"{coords[0]},{coords[1]}") if coords else (None, loc)
+        return None, str(loc)
+
+    keys = [json.dumps(s, sort_keys=True) for s in stops]
+    unique = dict(zip(keys, stops))
+    resolved = dict(zip(unique, await asyncio.gather(*(normalize(s) for s in unique.values()))))
+    coords, addr_strs = [], []
+    for i, (key, s) in enumerate(zip(keys, stops)):
+        c, addr_str = resolved[key]
+        if c is None:
+            error_msg = f"Unable to geocode stop: {s}"
+            logger.info("%s", error_msg)
+            raise SuggestRequestError(error_msg)
+        coords.append(c)
+        addr_strs.append(addr_str)
+        logger.debug("Normalized stop %d: %s -> %s", i, c, addr_str)
+    return RouteContext(stops, coords, addr_strs)
+
+async def fetch_route(route):
+    addr_strs = route.addr_strs
+    with metrics.span("directions"):
+        directions = await directions_json(addr_strs[0], addr_strs[-1], waypoints=addr_strs[1:-1] or None)
+    return route.use_route(directions, route_path(directions))
+
+async def search_candidates(route, opts, enough_candidates=None):
+    """app.search_candidates with every Nearby search on the event loop."""
+    # plan_search and rank_candidates are NumPy work over the whole route;
+    # off the loop they don't stall the other requests in flight
+    samples, search_plan = await asyncio.to_thread(
+        plan_search,
+        route, opts["sample_every_m"], opts["search_radius"], opts["corridor_m"], opts["coverage_target"],
+    )
+    limit = asyncio.Semaphore(PLACES_MAX_WORKERS)
+
+    async def search(pt):
+        async with limit:
+            return await places_near_pages(
+                pt[0], pt[1], radius=pt[2], place_type=opts["desired_type"], keyword=opts["keyword"]
+            )
+
+    with metrics.span("nearby_search"):
+        firsts = await asyncio.gather(*(search(pt) for pt in samples), return_exceptions=True)
+    place_map = {}
+    searches = []
+    for pt, pages in zip(samples, firsts):
+        if isinstance(pages, Exception):
+            logger.warning("Places API error at sample %s: %s", pt, pages)
+            continue
+        add_places(place_map, pt, pages.first)
+        searches.append((pt, pages))
+
+    if enough_candidates is None:
+        enough_candidates = PAGINATION_ENOUGH_FACTOR * opts["max_candidates"]
+    with metrics.span("pagination_wait"):
+        for pt, pages in searches:
+            if enough_candidates and len(place_map) >= enough_candidates:
+                pages.cancel()
+                continue
+            try:
+                add_places(place_map, pt, await pages.rest())
+            except Exception as e:
+                logger.warning("Places API pagination error at sample %s: %s", pt, e)
+
+    with metrics.span("prefilter"):
+        candidates = await asyncio.to_thread(
+            rank_candidates, route, place_map, opts["max_candidates"], opts["time_constraint_seconds"]
+        )
+    return candidates, search_plan
+
+async def directions_leg(origin, destination):
+    leg = leg_cache.get(origin, destination)
+    if leg:
+        return leg
+    resp = await directions_json(origin, destination)
+    if resp.get("status") != "OK" or not resp.get("routes"):
+        return None
+    raw = resp["routes"][0]["legs"][0]
+    return leg_cache.put(
+        origin, destination,
+        raw.get("duration", {}).get("value", 0),
+        raw.get("distance", {}).get("value", 0),
+    )
+
+async def total_time_with_insertion(addr_strs, insert_point_idx, candidate_loc_str):
+    """Total seconds with the candidate inserted after stop insert_point_idx, or None."""
+    new_stops = addr_strs[:insert_point_idx + 1] + [candidate_loc_str] + addr_strs[insert_point_idx + 1:]
+    legs = await asyncio.gather(*(directions_leg(a, b) for a, b in zip(new_stops, new_stops[1:])))
+    if any(leg is None for leg in legs):
+        return None
+    return sum(leg["duration"] for leg in legs)
+
+async def iter_scored_candidates(candidates, route, time_constraint_seconds=None):
+    placed = insertion_points(candidates)
+    scores = aiter_insertion_scores(
+        route.addr_strs,
+        route.leg_durations,
+        [(loc_str, leg_idx) for _, leg_idx, _, loc_str in placed],
+        distance_matrix_json,
+        leg_cache=leg_cache,
+    )
+    async for i, score in scores:
+        c, best_idx, offset_m, loc_str = placed[i]
+        if score is not None:
+            added = int(score["added_seconds"])
+            total_seconds_with = route.total_seconds + added
+        else:
+            try:
+                total_seconds_with = await total_time_with_insertion(route.addr_strs, best_idx, loc_str)
+            except Exception as e:
+                logger.warning("Directions error pricing %s: %s", c.get("name"), e)
+                continue
+            if total_seconds_with is None:
+                logger.debug("No route for %s - skipping", c.get("name"))
+                continue
+            added = int(total_seconds_with - route.total_seconds)
+        result = candidate_result(c, best_idx, offset_m, total_seconds_with, added, time_constraint_seconds)
+        if result is not None:
+            yield result
+
+async def suggest_stops_events(opts, route):
+    """Async app.suggest_stops_events: route, shortlist, candidate..., summary."""
+    await fetch_route(route)
+    route_summary = summarize_route(route, opts)
+    yield {"event": "route", "route_summary": route_summary}
+
+    candidates, search_plan = await search_candidates(route, opts)
+    route_summary = {**route_summary, "search_plan": search_plan}
+    yield shortlist_event(candidates, search_plan)
+
+    results = []
+    scored = iter_scored_candidates(candidates, route, opts["time_constraint_seconds"])
+    while True:
+        with metrics.span("detour_scoring"):
+            result = await anext(scored, None)
+        if result is None:
+            break
+        results.append(result)
+        yield {"event": "candidate", "candidate": result}
+
+    yield summary_event(route_summary, candidates, results)
+
+async def plan_body(opts, route):
+    """Async app.plan_body: the plain JSON body for an unrouted RouteContext."""
+    summary = None
+    async for event in suggest_stops_events(opts, route):
+        summary = event
+    return summary_body(summary)
+
+# ---------- Routes ---------------------------------------------------------
+
+async def _json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _cache_stats():
+    stats = maps_cache.stats()
+    if place_tiles is not None:
+        stats["place_tiles"] = place_tiles.stats()
+    stats["suggest_stops"] = suggest_cache.stats()
+    return stats
+
+@app.get("/cache_stats")
+async def cache_stats():
+    # The stats count SQLite rows
+    return await asyncio.to_thread(_cache_stats)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/profiles")
+@app.get("/profiles/{profile_id}")
+async def get_profiles(request: Request, profile_id: str | None = None):
+    status, body, content_type = profiling.download(profile_id, request.headers, request.query_params)
+    return Response(body, status_code=status, media_type=content_type)
+
+@app.get("/maps_stats")
+async def maps_stats():
+    return maps.stats()
+
+@app.post("/search_place")
+async def search_place(request: Request):
+    data = await _json_body(request)
+    query = data.get("query")
+    if not query:
+        return JSONResponse({"error": "Query parameter required"}, status_code=400)
+    try:
+        return format_search_results(await text_search(query))
+    except Exception as e:
+        return JSONResponse({"error": f"Places API error: {str(e)}"}, status_code=500)
+
+def plan_response(request, entry, state, stops, fmt=None):
+    """app._plan_response: 304 on a matching If-None-Match, else JSON or replayed events."""
+    body = with_stops(entry["body"], stops)
+    with metrics.span("serialization"):
+        etag = etag_for(body)
+        headers = response_headers(entry, state, etag)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if fmt:
+            content = "".join(format_event(e, fmt) for e in replay_events(body))
+            return Response(content, media_type=STREAM_MIMETYPES[fmt], headers=headers)
+        return JSONResponse(body, headers=headers)
+
+@app.post("/suggest_stops")
+async def suggest_stops(request: Request):
+    """Same body, query flags and responses as app.suggest_stops."""
+    trace = metrics.Trace("suggest_stops")
+    request.state.profile_id = profiling.maybe_start(trace, request.url.path, request.headers, request.query_params)
+    streaming = False
+    try:
+        with metrics.active(trace):
+            opts = parse_suggest_request(await _json_body(request))
+            with metrics.span("geocode"):
+                route = await resolve_stops(opts["stops"])
+            key = suggest_cache.key(opts, route.coords)
+            with metrics.span("response_cache"):
+                entry, state = await suggest_cache.aget(key)
+
+            fmt = stream_format(request.query_params.get("stream"), request.headers.get("accept"))
+            if entry is None and fmt:
+                events = suggest_cache.arecording(key, suggest_stops_events(opts, route))
+
+                async def generate():
+                    try:
+                        with metrics.active(trace):
+                            async for event in events:
+                                with metrics.span("serialization"):
+                                    chunk = format_event(event, fmt)
+                                yield chunk
+                    except Exception as e:
+                        logger.exception("Error in suggest_stops stream: %s", e)
+                        yield format_event({"event": "error", "error": f"Internal server error: {str(e)}"}, fmt)
+                    finally:
+                        await finish_trace(trace)
+
+                streaming = True
+                return StreamingResponse(
+                    generate(),
+                    media_type=STREAM_MIMETYPES[fmt],
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache", "X-Cache": MISS.upper()},
+                )
+
+            if state == STALE:
+                suggest_cache.arefresh(key, lambda: plan_body(opts, route))
+            elif entry is None:
+                entry, state = await suggest_cache.acompute(key, lambda: plan_body(opts, route)), MISS
+            return plan_response(request, entry, state, opts["stops"], fmt)
+
+    except SuggestRequestError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception("Error in suggest_stops: %s", e)
+        return JSONResponse({"error": f"Internal server error: {str(e)}"}, status_code=500)
+    finally:
+        if not streaming:
+            await finish_trace(trace)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,214 @@
+# search_coverage.py
+"""
+Coverage-aware placement of Places Nearby search circles along a route.
+
+Naive sampling (one circle every sample_every_m) ignores the search radius, so
+with the defaults (1500 m spacing, 1200 m radius) neighbouring circles overlap
+heavily and keep returning the same places. Here we instead pick the widest
+even spacing (and then the smallest radii) that covers a buffered corridor
+around the route polyline to a target coverage ratio. When that would take
+more queries than naive sampling, the naive circles are used instead.
+
+All work happens in a local planar frame (equirectangular around the route's
+mean latitude), which is plenty accurate at city/region scale.
+"""
+import math
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M, cumulative_distance, sample_along_polyline
+
+DEFAULT_COVERAGE_TARGET = 0.95
+
+# Radii are rounded up to this granularity (meters).
+RADIUS_STEP_M = 50
+
+# Cross-track test offsets per along-track test station.
+_CROSS_SAMPLES = 7
+
+# Each rung of spacing_ladder() is this much tighter than the one before.
+SPACING_SHRINK = 0.95
+
+# Centers either side (along the route) that a test point is checked against.
+_NEAR_CENTERS = 2
+
+
+def _frame(path):
+    ref = path.mean(axis=0)
+    return ref, math.cos(math.radians(ref[0]))
+
+
+def _to_xy(points, ref, k):
+    x = np.radians(points[:, 1] - ref[1]) * k * EARTH_RADIUS_M
+    y = np.radians(points[:, 0] - ref[0]) * EARTH_RADIUS_M
+    return np.column_stack((x, y))
+
+
+def _to_latlng(xy, ref, k):
+    lat = ref[0] + np.degrees(xy[:, 1] / EARTH_RADIUS_M)
+    lng = ref[1] + np.degrees(xy[:, 0] / (k * EARTH_RADIUS_M))
+    return np.column_stack((lat, lng))
+
+
+def _point_at(xy, cum, along):
+    """Planar points at the given along-route distances."""
+    idx = np.clip(np.searchsorted(cum, along, side="right") - 1, 0, len(xy) - 2)
+    seg = cum[idx + 1] - cum[idx]
+    frac = np.divide(along - cum[idx], seg, out=np.zeros_like(along), where=seg > 0)
+    return xy[idx] + (xy[idx + 1] - xy[idx]) * frac[:, None], idx
+
+
+def corridor_test_points(xy, cum, corridor_m, step):
+    """Grid of planar points across the corridor, one row every step meters."""
+    along = np.append(np.arange(0.0, cum[-1], step), cum[-1])
+    base, idx = _point_at(xy, cum, along)
+    tangent = xy[idx + 1] - xy[idx]
+    norm = np.linalg.norm(tangent, axis=1, keepdims=True)
+    tangent = np.divide(tangent, norm, out=np.zeros_like(tangent), where=norm > 0)
+    normal = np.column_stack((-tangent[:, 1], tangent[:, 0]))
+    offsets = np.linspace(-corridor_m, corridor_m, _CROSS_SAMPLES)
+    pts = base[:, None, :] + offsets[None, :, None] * normal[:, None, :]
+    return pts.reshape(-1, 2), np.repeat(along, len(offsets))
+
+
+def spacing_ladder(radius, corridor_m):
+    """
+    Candidate spacings, widest first: 2 * radius shrinking by SPACING_SHRINK
+    down to 2 * (radius - corridor_m), where every corridor point is within
+    radius of an on-route center however the route bends.
+    """
+    floor = max(2.0 * (radius - corridor_m), 1.0)
+    spacings = [2.0 * radius]
+    while spacings[-1] * SPACING_SHRINK > floor:
+        spacings.append(spacings[-1] * SPACING_SHRINK)
+    spacings.append(floor)
+    return spacings
+
+
+def default_corridor(radius, naive_every_m=None):
+    """
+    Half-width that circles of radius every naive_every_m reach everywhere
+    along a straight route, sqrt(radius^2 - (naive_every_m / 2)^2), so the
+    plan searches at least the strip fixed spacing was sure to search.
+    radius / 2 without a fixed spacing to match, or when it leaves gaps on
+    the route itself.
+    """
+    if naive_every_m and naive_every_m < 2.0 * radius:
+        return math.sqrt(radius * radius - (naive_every_m / 2.0) ** 2)
+    return radius / 2.0
+
+
+def plan_search_centers(path, radius, corridor_m=None, target=DEFAULT_COVERAGE_TARGET, naive_every_m=None):
+    """
+    Choose Places Nearby search circles covering the route corridor.
+
+    path: (N, 2) array of (lat, lng)
+    radius: maximum search radius (m)
+    corridor_m: half-width of the corridor to cover (default
+      default_corridor(radius, naive_every_m), capped just below radius
+      since on-route circles can't reach further)
+    target: fraction of corridor test points that must be inside a circle
+    naive_every_m: if given, the plan reports how many queries naive
+      sampling at that spacing would have needed, and those naive circles
+      are used instead when meeting the target would take more queries
+
+    Evenly spaced centers are tried at each spacing_ladder() step, widest
+    first, until one meets the target on the actual route. The ladder
+    doesn't depend on the target, so a higher target never costs fewer
+    queries than a lower one.
+
+    Returns (centers, report) where centers is a list of (lat, lng, radius_m)
+    and report is {"queries", "naive_queries", "queries_saved", "coverage",
+    "spacing_m", "corridor_m", "strategy"}; strategy is "coverage" or "naive".
+    """
+    path = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+    radius = float(radius)
+    if corridor_m is None:
+        corridor_m = default_corridor(radius, naive_every_m)
+    corridor_m = min(float(corridor_m), 0.95 * radius)
+    naive = sample_along_polyline(path, naive_every_m) if naive_every_m else None
+    naive_count = len(naive) if naive is not None else None
+
+    cum = cumulative_distance(path)
+    if len(path) < 2 or cum[-1] == 0:
+        centers = [(float(path[0][0]), float(path[0][1]), int(radius))] if len(path) else []
+        return centers, _report(centers, naive_count, 1.0 if centers else 0.0, 0.0, corridor_m)
+
+    ref, k = _frame(path)
+    xy = _to_xy(path, ref, k)
+    planar_cum = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(xy, axis=0), axis=1))))
+    # Same test points for every candidate plan, so their coverage compares
+    # fairly. They are one row per RADIUS_STEP_M: the radii are fitted to
+    # them, and fitted to sparser rows a circle stops short between two.
+    tests, tests_along = corridor_test_points(xy, planar_cum, corridor_m, RADIUS_STEP_M)
+    rows = np.arange(len(tests))
+    r2 = radius * radius
+
+    def evaluate(centers_xy, centers_along):
+        """
+        (owner, d2, covered) per test point: its nearest center among the
+        _NEAR_CENTERS either side along the route, the squared distance to it,
+        and whether that is within radius. Circles further along the route
+        that reach a point (where the route doubles back) are ignored, so
+        coverage is never overstated.
+        """
+        nearest = np.searchsorted(centers_along, tests_along)
+        window = np.clip(nearest[:, None] + np.arange(-_NEAR_CENTERS, _NEAR_CENTERS + 1), 0, len(centers_xy) - 1)
+        d2 = ((tests[:, None, :] - centers_xy[window]) ** 2).sum(axis=2)
+        pick = d2.argmin(axis=1)
+        d2 = d2[rows, pick]
+        return window[rows, pick], d2, d2 <= r2
+
+    plan = None
+    for spacing in spacing_ladder(radius, corridor_m):
+        # Evenly spaced along the route, always including both ends
+        n = max(1, math.ceil(planar_cum[-1] / spacing))
+        if naive is not None and n + 1 > len(naive):
+            break
+        along = np.linspace(0.0, planar_cum[-1], n + 1)
+        centers_xy, _ = _point_at(xy, planar_cum, along)
+        plan = (spacing, centers_xy) + evaluate(centers_xy, along)
+        if plan[-1].mean() >= target:
+            break
+
+    if plan is not None and (plan[-1].mean() >= target or naive is None):
+        spacing, centers_xy, owner, d2, covered = plan
+        centers = _shrink(centers_xy, owner, d2, covered, radius, ref, k)
+        return centers, _report(centers, naive_count, float(covered.mean()), spacing, corridor_m)
+
+    # Covering the corridor would take more queries than fixed spacing does
+    # (wide corridors, tight curves): use the fixed-spacing circles instead.
+    _, _, covered = evaluate(_to_xy(naive, ref, k), np.arange(len(naive)) * float(naive_every_m))
+    centers = [(float(lat), float(lng), int(radius)) for lat, lng in naive]
+    report = _report(centers, naive_count, float(covered.mean()), naive_every_m, corridor_m)
+    report["strategy"] = "naive"
+    return centers, report
+
+
+def _shrink(centers_xy, owner, d2, covered, radius, ref, k):
+    """
+    Centers as (lat, lng, radius) with every circle shrunk to what its share
+    of the corridor needs; circles that own no covered test point are dropped.
+    """
+    centers = []
+    latlng = _to_latlng(centers_xy, ref, k)
+    for i in range(len(centers_xy)):
+        mine = covered & (owner == i)
+        if not mine.any():
+            continue
+        need = math.sqrt(float(d2[mine].max()))
+        r = min(radius, math.ceil(need / RADIUS_STEP_M) * RADIUS_STEP_M)
+        centers.append((float(latlng[i][0]), float(latlng[i][1]), int(max(r, RADIUS_STEP_M))))
+    return centers
+
+
+def _report(centers, naive, coverage, spacing, corridor_m):
+    return {
+        "queries": len(centers),
+        "naive_queries": naive,
+        "queries_saved": (naive - len(centers)) if naive is not None else None,
+        "coverage": round(coverage, 3),
+        "spacing_m": int(spacing),
+        "corridor_m": int(corridor_m),
+        "strategy": "coverage",
+    }
@@ -0,0 +1,86 @@
+# singleflight.py
+"""
+Coalesce identical in-flight calls.
+
+When several threads ask for the same key at once (say, the same venue
+geocoded by overlapping /search_place and /suggest_stops requests), only the
+first one runs the call; the others wait for it and get its result, or its
+exception. AsyncSingleFlight does the same for coroutines on one event loop.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run fn() unless a call for key is already in flight, in which case wait
+        for that one instead. Returns (value, shared) where shared tells whether
+        the result came from another caller's call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """
+        Await fn() unless a call for key is in flight; returns (value, shared).
+
+        The call runs in its own task and every caller, the first one
+        included, awaits it through asyncio.shield. A cancelled caller stops
+        waiting without cancelling the call the others are waiting on.
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark retrieved so a failed flight whose callers all left doesn't warn
+            task.exception()
+
+    def in_flight(self):
+        return len(self._calls)
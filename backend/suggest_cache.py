@@ -0,0 +1,292 @@
+# suggest_cache.py
+"""
+Whole-response cache for /suggest_stops.
+
+People reload and re-submit the same plan all the time. Without this cache,
+every re-submit re-runs Directions, the Nearby searches and the pricing of
+every candidate insertion. Responses are keyed by the normalized request:
+- the resolved stop coordinates, rounded like maps_cache keys
+- type and keyword
+- spacing, radius, corridor and coverage target
+- candidate cap and time constraint
+
+So "CN Tower" and "43.6426,-79.3871" hit the same entry.
+
+An entry is fresh for SUGGEST_CACHE_TTL seconds (default 600). For
+SUGGEST_CACHE_STALE seconds after that (default 3600), it is still served,
+and one background refresh per key replaces it (stale-while-revalidate).
+Identical misses that arrive together share one pipeline run.
+
+Responses carry an ETag. A request whose If-None-Match matches gets a 304
+without a body. X-Cache (hit / stale / miss) and Age say where the answer
+came from.
+
+Entries live in the same two tiers as maps_cache.py: an in-process LRU in
+front of a SQLite file.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from maps_cache import COORD_PRECISION, LRUStore, NullStore, SQLiteStore, normalize_key
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 600
+DEFAULT_STALE = 3600
+
+# Request options that change the answer (stops are keyed by their coordinates)
+KEY_OPTIONS = (
+    "desired_type", "keyword", "sample_every_m", "search_radius", "corridor_m",
+    "coverage_target", "max_candidates", "time_constraint_seconds",
+)
+
+HIT, STALE, MISS = "hit", "stale", "miss"
+
+
+def etag_for(body):
+    digest = hashlib.sha1(json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+    return f'"{digest[:24]}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value covers etag (weak comparison, like RFC 9110 asks for)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def summary_body(summary):
+    """The plain JSON /suggest_stops body carried by a pipeline's summary event."""
+    return {k: v for k, v in summary.items() if k != "event"}
+
+
+def with_stops(body, stops):
+    """body with route_summary.stops echoing this request's stops, not the ones it was cached for."""
+    return {**body, "route_summary": {**body["route_summary"], "stops": stops}}
+
+
+def replay_events(body):
+    """Stream events for a cached body: route, one candidate per result, summary (no shortlist)."""
+    yield {"event": "route", "route_summary": body["route_summary"]}
+    for candidate in body["candidates"]:
+        yield {"event": "candidate", "candidate": candidate}
+    yield {"event": "summary", **body}
+
+
+class SuggestCache:
+    """
+    Usage:
+        key = cache.key(opts, route.coords)
+        entry, state = cache.get(key)            # state: "hit" / "stale" / None
+        if state == "stale":
+            cache.refresh(key, compute)
+        elif entry is None:
+            entry = cache.compute(key, compute)
+    where compute() returns the plain JSON /suggest_stops body. Entries are
+    {"body", "stored_at", "fresh_until"}.
+    """
+
+    def __init__(self, memory=None, disk=None, ttl=DEFAULT_TTL, stale=DEFAULT_STALE):
+        self.memory = memory if memory is not None else LRUStore(256)
+        self.disk = disk if disk is not None else NullStore()
+        self.ttl = ttl
+        self.stale = stale
+        self._counters = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "refresh_errors": 0}
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._aflight = AsyncSingleFlight()
+
+    @classmethod
+    def from_env(cls):
+        """
+        SUGGEST_CACHE_DISABLED=1      -> no caching
+        SUGGEST_CACHE_PATH=...        -> SQLite file ("" keeps it in-memory only)
+        SUGGEST_CACHE_MEMORY_ENTRIES  -> LRU size (default 256)
+        SUGGEST_CACHE_TTL / _STALE    -> fresh / serve-stale windows in seconds
+        """
+        if os.environ.get("SUGGEST_CACHE_DISABLED") == "1":
+            return cls(memory=NullStore(), disk=NullStore(), ttl=0, stale=0)
+        path = os.environ.get("SUGGEST_CACHE_PATH", str(Path(__file__).parent / ".suggest_cache.sqlite3"))
+        return cls(
+            memory=LRUStore(int(os.environ.get("SUGGEST_CACHE_MEMORY_ENTRIES", 256))),
+            disk=SQLiteStore(path, max_rows=5000) if path else NullStore(),
+            ttl=int(os.environ.get("SUGGEST_CACHE_TTL", DEFAULT_TTL)),
+            stale=int(os.environ.get("SUGGEST_CACHE_STALE", DEFAULT_STALE)),
+        )
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _count(self, field):
+        with self._lock:
+            self._counters[field] += 1
+
+    def key(self, opts, coords):
+        params = {name: opts.get(name) for name in KEY_OPTIONS}
+        params["stops"] = "|".join(f"{lat},{lng}" for lat, lng in coords)
+        return normalize_key("suggest_stops", params, COORD_PRECISION)
+
+    def get(self, key):
+        """(entry, "hit" | "stale"), or (None, None) on a miss."""
+        if not self.enabled:
+            return None, None
+        item = self.memory.get(key)
+        if item is None:
+            item = self.disk.get(key)
+            if item is not None:
+                self.memory.set(key, item[1], item[0])
+        if item is None:
+            self._count("misses")
+            return None, None
+        entry = item[1]
+        if time.time() < entry["fresh_until"]:
+            self._count("hits")
+            return entry, HIT
+        self._count("stale_hits")
+        return entry, STALE
+
+    async def aget(self, key):
+        """get without blocking the event loop on the SQLite tier."""
+        return await asyncio.to_thread(self.get, key)
+
+    def set(self, key, body):
+        if not self.enabled:
+            return None
+        now = time.time()
+        entry = {"body": body, "stored_at": now, "fresh_until": now + self.ttl}
+        expires_at = entry["fresh_until"] + self.stale
+        self.memory.set(key, entry, expires_at)
+        self.disk.set(key, entry, expires_at)
+        return entry
+
+    async def aset(self, key, body):
+        return await asyncio.to_thread(self.set, key, body)
+
+    def compute(self, key, compute):
+        """Entry for a missed key from compute(), run once for concurrent misses."""
+
+        def compute_and_store():
+            body = compute()
+            return self.set(key, body) or {"body": body, "stored_at": time.time()}
+
+        entry, shared = self._flight.do(key, compute_and_store)
+        if shared:
+            self._count("coalesced")
+        return entry
+
+    async def acompute(self, key, acompute):
+        """compute for a coroutine function; concurrent misses share one await."""
+
+        async def compute_and_store():
+            body = await acompute()
+            return await self.aset(key, body) or {"body": body, "stored_at": time.time()}
+
+        entry, shared = await self._aflight.do(key, compute_and_store)
+        if shared:
+            self._count("coalesced")
+        return entry
+
+    def recording(self, key, events):
+        """Pass stream events through, caching the body once the summary goes by."""
+        for event in events:
+            if event["event"] == "summary":
+                self.set(key, summary_body(event))
+            yield event
+
+    async def arecording(self, key, events):
+        async for event in events:
+            if event["event"] == "summary":
+                await self.aset(key, summary_body(event))
+            yield event
+
+    def _claim_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self._counters["refreshes"] += 1
+            return True
+
+    def _refreshed(self, key, body=None, error=None):
+        if error is not None:
+            logger.warning("Background refresh of %s failed: %s", key, error)
+            self._count("refresh_errors")
+        else:
+            self.set(key, body)
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def refresh(self, key, compute):
+        """Recompute a stale entry on a background thread (once per key at a time)."""
+        if not self._claim_refresh(key):
+            return
+
+        def run():
+            try:
+                body = compute()
+            except Exception as e:
+                self._refreshed(key, error=e)
+            else:
+                self._refreshed(key, body)
+
+        threading.Thread(target=run, daemon=True, name="suggest-refresh").start()
+
+    def arefresh(self, key, acompute):
+        """refresh for a coroutine function, as a task on the running loop."""
+        if not self._claim_refresh(key):
+            return
+
+        async def run():
+            try:
+                body = await acompute()
+            except Exception as e:
+                self._refreshed(key, error=e)
+            else:
+                await asyncio.to_thread(self._refreshed, key, body)
+
+        # Fresh context: the refresh isn't part of the request that noticed the entry was stale
+        task = asyncio.get_running_loop().create_task(run(), context=contextvars.Context())
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["refreshing"] = len(self._refreshing)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 3) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        stats["disk_entries"] = len(self.disk)
+        stats["ttl"] = self.ttl
+        stats["stale"] = self.stale
+        return stats
+
+
+def response_headers(entry, state, etag):
+    """ETag / X-Cache / Age for a /suggest_stops answer."""
+    return {
+        "ETag": etag,
+        "X-Cache": state.upper(),
+        "Age": str(max(0, int(time.time() - entry["stored_at"]))),
+        # The body can change on the next request; clients revalidate with If-None-Match
+        "Cache-Control": "no-cache",
+    }
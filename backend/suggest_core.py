@@ -0,0 +1,361 @@
+# suggest_core.py
+"""
+The /suggest_stops pipeline pieces both servers share: configuration, the
+quota governor and caches, and everything that makes no Maps call (request
+parsing, search planning, ranking, result and event shaping).
+
+app.py (Flask, blocking Maps client) and route_service.py (ASGI,
+AsyncMapsClient) each add their own Maps calls on top. Nothing here imports
+Flask or builds a Maps client, so either server loads without the other.
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+from search_coverage import DEFAULT_COVERAGE_TARGET, plan_search_centers
+from detour import LegCache, estimate_detours
+from geo import decode_polyline, sample_along_polyline
+from maps_cache import MapsCache
+import metrics
+from quota import QuotaGovernor
+from places_tiles import PlaceTileStore
+from suggest_cache import SuggestCache
+
+# ---------- Config & env loader --------------------------------------------
+from dotenv import load_dotenv
+load_dotenv(dotenv_path=Path(__file__).parent / ".env")
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
+if not GOOGLE_API_KEY:
+    raise RuntimeError("GOOGLE_API_KEY not found in environment")
+
+# ---------- Shared caches ------------------------------------------------
+
+# Per-endpoint rate limits across all worker processes (see quota.py); each
+# server builds its own Maps client on top of it.
+governor = QuotaGovernor.from_env()
+
+# Shared response cache for every Google Maps call (see maps_cache.py).
+maps_cache = MapsCache.from_env()
+
+# Geohash tile index so overlapping Nearby circles can be answered locally.
+place_tiles = PlaceTileStore.from_env(ttl=maps_cache.ttls["nearby"])
+
+# Single-leg (A->B) travel times, fed by Directions and Distance Matrix results.
+leg_cache = LegCache()
+
+# Whole /suggest_stops answers keyed by the resolved request (see suggest_cache.py).
+suggest_cache = SuggestCache.from_env()
+
+# ---------- Google Maps API helpers ---------------------------------------
+
+# Candidates whose geometric detour estimate exceeds the time constraint by
+# more than this factor are dropped before exact scoring. The estimate is
+# rough, so leave generous headroom.
+PREFILTER_SLACK = 1.5
+
+# Nearby pagination stops once this many times max_candidates unique places
+# are known; the pre-filter only needs some headroom to rank from.
+PAGINATION_ENOUGH_FACTOR = 2
+
+# Upper bound on concurrent Places Nearby requests per route search.
+PLACES_MAX_WORKERS = int(os.environ.get("PLACES_MAX_WORKERS", 8))
+
+def _status_ok(data):
+    """Only successful responses are worth caching."""
+    return data.get("status") == "OK"
+
+# Google needs a moment before a next_page_token becomes valid and answers
+# INVALID_REQUEST until then. Wait this long before each try (seconds).
+PAGE_TOKEN_RETRY_DELAYS = (1.0, 0.5, 1.0, 2.0)
+
+# Pages per Nearby search, including the first (Google serves up to 3).
+MAX_NEARBY_PAGES = 2
+
+def _store_nearby(query, results, complete):
+    """
+    Cache merged Nearby pages (page tokens expire, so raw pages are useless later).
+    Only a complete result set goes into maps_cache: a cancelled or capped fetch
+    would otherwise be served as the full answer until the entry expires. The
+    POIs still go into place_tiles, which marks no cell fetched for a partial set.
+    """
+    params, lat, lng, radius, place_type, keyword = query
+    if complete:
+        maps_cache.set("nearby", params, results)
+    if place_tiles is not None:
+        place_tiles.record(lat, lng, radius, place_type, keyword, results, complete=complete)
+
+def format_search_results(data):
+    """Text Search JSON as the frontend expects it: every result has a 'name'."""
+    # Copy so the fallback names below don't leak into the cached entry
+    google_data = dict(data)
+    if "results" in google_data:
+        google_data["results"] = [dict(r) for r in google_data["results"]]
+
+    # **This is the key fix**: Ensure every result has a 'name' field.
+    # If 'name' doesn't exist, use 'formatted_address' as a fallback.
+    if google_data.get("results"):
+        for result in google_data["results"]:
+            if "name" not in result:
+                result["name"] = result.get("formatted_address", "Unknown Place")
+    return google_data
+
+# ---------- Route and candidates -------------------------------------------
+
+def location_literal(loc):
+    """
+    (coords, "lat,lng") for inputs that need no geocoding: a dict with 'lat'
+    and 'lng', or a "lat,lng" string. None for anything else.
+    """
+    if isinstance(loc, dict) and "lat" in loc and "lng" in loc:
+        return (float(loc["lat"]), float(loc["lng"])), f"{loc['lat']},{loc['lng']}"
+    if isinstance(loc, str):
+        m = re.match(r"^\s*([-+]?\d+(\.\d+)?),\s*([-+]?\d+(\.\d+)?)\s*$", loc)
+        if m:
+            lat, lng = float(m.group(1)), float(m.group(3))
+            return (lat, lng), f"{lat},{lng}"
+    return None
+
+def route_path(directions):
+    """Check a Directions response and decode its overview polyline to an (N, 2) array."""
+    if directions.get("status") != "OK" or not directions.get("routes"):
+        raise RuntimeError(f"Directions API failed: {directions.get('status')}")
+
+    # Collect polylines from each leg/step to build full path
+    route = directions["routes"][0]
+    overview_polyline = route.get("overview_polyline", {}).get("points")
+    if not overview_polyline:
+        raise RuntimeError("No polyline in directions response")
+    return decode_polyline(overview_polyline)
+
+def route_totals(directions):
+    """(total seconds, total meters) over every leg of a Directions response."""
+    total_seconds = 0
+    total_meters = 0
+    for leg in directions["routes"][0].get("legs", []):
+        total_seconds += int(leg.get("duration", {}).get("value", 0))
+        total_meters += int(leg.get("distance", {}).get("value", 0))
+    return total_seconds, total_meters
+
+class RouteContext:
+    """
+    Everything one request knows about its route, derived once and handed to
+    every stage instead of being re-derived from the raw stops.
+
+    stops: the stops as the client sent them
+    coords: [(lat, lng)] per stop; addr_strs: "lat,lng" strings for the APIs
+    After use_route(): directions (raw JSON), path ((N, 2) overview
+    polyline), legs, leg_durations, total_seconds, total_meters, speed_mps.
+
+    Resolving the stops and fetching the route take Maps calls, so they live
+    with each server: app.RouteContext adds blocking resolve() and
+    fetch_route(); route_service.py resolves and routes on its event loop.
+    """
+
+    def __init__(self, stops, coords, addr_strs):
+        self.stops = stops
+        self.coords = coords
+        self.addr_strs = addr_strs
+        self.directions = None
+        self.path = None
+        self.legs = []
+        self.leg_durations = []
+        self.total_seconds = 0
+        self.total_meters = 0
+        self.speed_mps = None
+
+    def use_route(self, directions, path):
+        """Adopt an already fetched Directions response and its decoded path."""
+        self.directions, self.path = directions, path
+        self.legs = self.directions["routes"][0].get("legs", [])
+        self.leg_durations = [int(leg.get("duration", {}).get("value", 0)) for leg in self.legs]
+        self.total_seconds, self.total_meters = route_totals(self.directions)
+        self.speed_mps = self.total_meters / self.total_seconds if self.total_seconds else None
+        # Every stop->stop leg is now known; insertion scoring reuses them
+        leg_cache.seed_from_directions(self.addr_strs, self.directions)
+        return self
+
+def plan_search(route, sample_every_m=1500, search_radius=1200, corridor_m=None, coverage_target=DEFAULT_COVERAGE_TARGET):
+    """
+    Choose Nearby search circles along the route: coverage-planned by
+    default, or the old fixed spacing when coverage_target is 0.
+    Returns (samples [(lat, lng, radius)], search_plan).
+    """
+    with metrics.span("search_plan"):
+        if coverage_target and coverage_target > 0:
+            samples, search_plan = plan_search_centers(
+                route.path, search_radius, corridor_m=corridor_m,
+                target=coverage_target, naive_every_m=sample_every_m,
+            )
+        else:
+            samples = [(lat, lng, search_radius) for lat, lng in sample_along_polyline(route.path, every_m=sample_every_m).tolist()]
+            search_plan = {"queries": len(samples), "naive_queries": len(samples), "queries_saved": 0}
+    logger.debug("Search plan: %s", search_plan)
+    return samples, search_plan
+
+def add_places(place_map, pt, results):
+    """Merge one sample's Nearby results into place_map (place_id -> place); first sighting wins."""
+    lat, lng = pt[0], pt[1]
+    for p in results:
+        pid = p.get("place_id")
+        if not pid:
+            continue
+        # keep the closest geometry info, rating, user_ratings_total etc.
+        if pid not in place_map:
+            place_map[pid] = {
+                "place_id": pid,
+                "name": p.get("name"),
+                "vicinity": p.get("vicinity"),
+                "location": p.get("geometry", {}).get("location"),
+                "types": p.get("types", []),
+                "rating": p.get("rating"),
+                "user_ratings_total": p.get("user_ratings_total"),
+                "source_sample_point": {"lat": lat, "lng": lng},
+            }
+
+def rank_candidates(route, place_map, max_candidates=25, time_constraint_seconds=None):
+    """
+    Rank by a local detour estimate (no network calls) and keep only the
+    most plausible max_candidates for exact scoring.
+    """
+    places = [p for p in place_map.values() if p.get("location")]
+    estimates = estimate_detours(
+        route.path, route.coords, [(p["location"]["lat"], p["location"]["lng"]) for p in places], route.speed_mps
+    )
+    ranked = []
+    for p, est in zip(places, estimates):
+        if (time_constraint_seconds is not None
+                and est["est_added_seconds"] > PREFILTER_SLACK * float(time_constraint_seconds)):
+            continue
+        ranked.append({**p, "route_projection": est})
+    ranked.sort(key=lambda p: (p["route_projection"]["est_added_seconds"], p["route_projection"]["along_m"]))
+    return ranked[:max_candidates]
+
+
+# ---------- Suggest-stops request and results -----------------------------
+
+class SuggestRequestError(ValueError):
+    """Bad /suggest_stops input; reported to the client as a 400."""
+
+def parse_suggest_request(data):
+    """Validate the /suggest_stops JSON body and return the search options."""
+    stops = data.get("stops")
+    if not stops or not isinstance(stops, list) or len(stops) < 2:
+        logger.info("Invalid stops data: %s", stops)
+        raise SuggestRequestError("Provide at least 2 stops in 'stops' list")
+    corridor_m = data.get("corridor_m")  # optional, default search_coverage.default_corridor()
+    return {
+        "stops": stops,
+        "desired_type": data.get("desired_type"),
+        "keyword": data.get("keyword"),
+        "sample_every_m": int(data.get("sample_every_m", 1500)),
+        "search_radius": int(data.get("search_radius", 1200)),
+        "corridor_m": float(corridor_m) if corridor_m is not None else None,
+        "coverage_target": float(data.get("coverage_target", DEFAULT_COVERAGE_TARGET)),
+        "max_candidates": int(data.get("max_candidates", 20)),
+        "time_constraint_seconds": data.get("time_constraint_seconds"),  # optional
+    }
+
+def insertion_points(candidates):
+    """
+    Where each candidate goes in the route, read from the route_projection
+    the geometric pre-filter attached to it (no API calls).
+    Returns [(candidate, leg index, offset_m, "lat,lng")], one per candidate
+    in order; iter_scored_candidates prices them.
+    """
+    placed = []
+    for c in candidates:
+        c_loc = c["location"]
+        proj = c["route_projection"]
+        placed.append((c, proj["leg"], proj["offset_m"], f"{c_loc['lat']},{c_loc['lng']}"))
+    return placed
+
+def candidate_result(c, best_idx, offset_m, total_seconds_with, added, time_constraint_seconds=None):
+    """The /suggest_stops entry for a priced candidate, or None if over the time constraint."""
+    logger.debug("%s: leg %s, added time %ss", c.get("name"), best_idx, added)
+
+    # Apply time constraint filter if requested
+    if time_constraint_seconds is not None and added > int(time_constraint_seconds):
+        logger.debug("Filtered out - exceeds time constraint (%s > %s)", added, time_constraint_seconds)
+        return None
+
+    return {
+        "place_id": c.get("place_id"),
+        "name": c.get("name"),
+        "vicinity": c.get("vicinity"),
+        "location": c.get("location"),
+        "types": c.get("types"),
+        "rating": c.get("rating"),
+        "user_ratings_total": c.get("user_ratings_total"),
+        "insert_between": [best_idx, best_idx + 1],
+        # Straight-line distance to the midpoint of the insertion leg, as before
+        # the route projection picked the leg; distance_off_route_m is the
+        # distance to the route polyline itself
+        "insert_leg_distance_to_sample_m": int(c["route_projection"]["leg_midpoint_m"]),
+        "distance_off_route_m": int(offset_m),
+        "total_travel_time_seconds": int(total_seconds_with),
+        "added_time_seconds": int(added),
+    }
+
+def summarize_route(route, opts):
+    """route_summary for a routed RouteContext (search_plan is added once known)."""
+    logger.debug("Original route: %ss, %sm", route.total_seconds, route.total_meters)
+    return {
+        "original_total_travel_time_seconds": int(route.total_seconds),
+        "original_total_distance_meters": int(route.total_meters),
+        "stops": opts["stops"],
+    }
+
+def shortlist_event(candidates, search_plan):
+    logger.debug("Found %d initial candidates", len(candidates))
+    return {
+        "event": "shortlist",
+        "search_plan": search_plan,
+        "candidates": [
+            {
+                "place_id": c["place_id"],
+                "name": c.get("name"),
+                "location": c["location"],
+                "insert_between": [c["route_projection"]["leg"], c["route_projection"]["leg"] + 1],
+                "estimated_added_time_seconds": int(c["route_projection"]["est_added_seconds"]),
+            }
+            for c in candidates
+        ],
+    }
+
+def summary_event(route_summary, candidates, results):
+    # Sort by added travel time ascending (ties keep the pre-filter ranking)
+    rank = {c["place_id"]: i for i, c in enumerate(candidates)}
+    results = sorted(results, key=lambda x: (x["added_time_seconds"], rank.get(x["place_id"], 0)))
+    logger.debug("Returning %d final results", len(results))
+
+    return {
+        "event": "summary",
+        "route_summary": route_summary,
+        "candidates": results,
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+    }
+
+STREAM_MIMETYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+def format_event(event, fmt):
+    """One pipeline event as an SSE message or an NDJSON line."""
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    return json.dumps(event) + "\n"
+
+def stream_format(stream_arg, accept):
+    """'ndjson', 'sse' or None (plain JSON), from ?stream= or the Accept header."""
+    if stream_arg in ("ndjson", "sse"):
+        return stream_arg
+    accept = accept or ""
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    if "text/event-stream" in accept:
+        return "sse"
+    return None
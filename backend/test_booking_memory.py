@@ -0,0 +1,50 @@
+# test_booking_memory.py
+from booking_memory import MAX_FAILURES, BookingMemory, find_booking_url
+
+OLD = "https://www.opentable.com/r/cafe"
+NEW = "https://resy.com/cities/to/cafe"
+
+
+def test_working_run_is_remembered():
+    memory = BookingMemory(":memory:")
+    memory.record("p1", "Cafe", "confirmed", booking_url=OLD)
+    entry = memory.get("p1")
+    assert entry["booking_url"] == OLD and entry["platform"] == "OpenTable"
+
+
+def test_failed_run_keeps_the_remembered_page():
+    memory = BookingMemory(":memory:")
+    memory.record("p1", "Cafe", "confirmed", booking_url=OLD)
+    memory.record("p1", "Cafe", "error", booking_url=NEW)
+    entry = memory.get("p1")
+    assert entry["booking_url"] == OLD and entry["failures"] == 1
+
+
+def test_page_is_dropped_after_max_failures():
+    memory = BookingMemory(":memory:")
+    memory.record("p1", "Cafe", "confirmed", booking_url=OLD)
+    for _ in range(MAX_FAILURES):
+        memory.record("p1", "Cafe", "attempted", booking_url=NEW)
+    assert memory.get("p1") is None
+
+
+def test_working_run_replaces_the_page():
+    memory = BookingMemory(":memory:")
+    memory.record("p1", "Cafe", "attempted", booking_url=OLD)
+    memory.record("p1", "Cafe", "no_availability", booking_url=NEW)
+    entry = memory.get("p1")
+    assert entry["booking_url"] == NEW and entry["failures"] == 0
+
+
+def test_first_page_restarts_the_failure_count():
+    memory = BookingMemory(":memory:")
+    memory.record("p1", "Cafe", "error")
+    memory.record("p1", "Cafe", "attempted", booking_url=OLD)
+    entry = memory.get("p1")
+    assert entry["booking_url"] == OLD and entry["failures"] == 1
+
+
+def test_find_booking_url():
+    assert find_booking_url(["Booking page: https://cafe.example/book."]) == "https://cafe.example/book"
+    assert find_booking_url([f"Tried {OLD} and https://cafe.example"]) == OLD
+    assert find_booking_url(["no links here"]) is None
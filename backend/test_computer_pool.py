@@ -0,0 +1,93 @@
+# test_computer_pool.py
+import asyncio
+
+import computer_pool
+from computer_pool import ComputerPool
+
+
+class FakeInterface:
+    async def get_screen_size(self):
+        return (1024, 768)
+
+    async def run_command(self, command):
+        return ""
+
+
+class FakeComputer:
+    booted = []
+    stopped = []
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.interface = FakeInterface()
+
+    async def run(self):
+        FakeComputer.booted.append(self)
+
+    async def stop(self):
+        FakeComputer.stopped.append(self)
+
+
+def _run(coro):
+    FakeComputer.booted, FakeComputer.stopped = [], []
+    return asyncio.run(coro)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_clean_run_is_reset_and_reused():
+    async def main():
+        pool = ComputerPool(size=1, factory=FakeComputer)
+        async with pool.lease() as first:
+            pass
+        await _settle()
+        async with pool.lease() as second:
+            pass
+        await pool.stop()
+        return first, second, pool.stats()
+
+    first, second, stats = _run(main())
+    assert first is second
+    assert stats["recycled"] == 0
+
+
+def test_reported_failure_recycles_the_computer():
+    async def main():
+        pool = ComputerPool(size=1, factory=FakeComputer)
+        async with pool.lease() as first:
+            pool.report_failure(first)
+        await _settle()
+        async with pool.lease() as second:
+            pass
+        await pool.stop()
+        return first, second, pool.stats()
+
+    first, second, stats = _run(main())
+    assert first is not second
+    assert first in FakeComputer.stopped
+    assert stats["recycled"] == 1
+
+
+def test_factory_error_is_retried(monkeypatch):
+    monkeypatch.setattr(computer_pool, "BOOT_RETRY_DELAYS", (0,))
+    calls = []
+
+    def flaky(slot):
+        calls.append(slot)
+        if len(calls) == 1:
+            raise RuntimeError("no docker")
+        return FakeComputer(slot)
+
+    async def main():
+        pool = ComputerPool(size=1, factory=flaky)
+        async with pool.lease() as computer:
+            pass
+        await pool.stop()
+        return computer, pool.stats()
+
+    computer, stats = _run(main())
+    assert isinstance(computer, FakeComputer)
+    assert stats["boot_failures"] == 1
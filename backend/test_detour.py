@@ -0,0 +1,109 @@
+# test_detour.py
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from detour import (
+    MATRIX_MAX_ELEMENTS, MATRIX_MAX_SIDE, LegCache, aiter_insertion_scores, estimate_detours,
+    plan_matrix_requests, score_insertions,
+)
+from geo import haversine_meters
+
+# Stops along the equator: a short first leg, then a long one
+STOPS = [(0.0, 0.0), (0.0, 0.02), (0.0, 0.2)]
+PATH = np.array([(0.0, lng) for lng in np.linspace(0.0, 0.2, 201)])
+
+
+def test_leg_follows_the_route_not_the_nearest_midpoint():
+    # Closer to leg 0's midpoint, but past stop 1 along the route
+    (est,) = estimate_detours(PATH, STOPS, [(0.001, 0.03)], speed_mps=10.0)
+    assert est["leg"] == 1
+    assert est["offset_m"] == pytest.approx(111.2, abs=1.0)
+    assert est["est_added_seconds"] == pytest.approx(2 * est["offset_m"] / 10.0)
+
+
+def test_leg_midpoint_distance_keeps_its_old_meaning():
+    candidates = [(0.001, 0.01), (0.001, 0.03)]
+    first, second = estimate_detours(PATH, STOPS, candidates)
+    assert first["leg_midpoint_m"] == pytest.approx(haversine_meters(candidates[0], (0.0, 0.01)), rel=1e-6)
+    assert second["leg_midpoint_m"] == pytest.approx(haversine_meters(candidates[1], (0.0, 0.11)), rel=1e-6)
+
+
+def test_no_candidates():
+    assert estimate_detours(PATH, STOPS, []) == []
+
+
+def _matrix(seconds):
+    """A matrix_fn answering every origin -> destination pair with seconds(origin, destination)."""
+    calls = []
+    lock = threading.Lock()
+
+    def matrix_fn(origins, destinations):
+        with lock:
+            calls.append((list(origins), list(destinations)))
+        return {"status": "OK", "rows": [
+            {"elements": [{"status": "OK", "duration": {"value": seconds(o, d)}, "distance": {"value": 1}}
+                          for d in destinations]}
+            for o in origins
+        ]}
+
+    return matrix_fn, calls
+
+
+def test_requests_respect_matrix_limits():
+    insertions = [(f"c{i}", i % 2) for i in range(60)]
+    planned = plan_matrix_requests(["A", "B", "C"], insertions)
+    # Per leg: 30 candidates -> 2 chunks, each a row and a column
+    assert len(planned) == 8
+    for req in planned:
+        assert len(req["origins"]) <= MATRIX_MAX_SIDE and len(req["destinations"]) <= MATRIX_MAX_SIDE
+        assert len(req["origins"]) * len(req["destinations"]) <= MATRIX_MAX_ELEMENTS
+    covered = sorted(i for req in planned if req["direction"] == "to" for i in req["indices"])
+    assert covered == list(range(60))
+
+
+def test_scores_are_the_added_leg_time():
+    matrix_fn, calls = _matrix(lambda o, d: 100 if o == "A" or d == "B" else 50)
+    insertions = [("c0", 0), ("c1", 0), ("c2", 1)]
+    scores = score_insertions(["A", "B", "C"], [120, 300], insertions, matrix_fn)
+    assert scores[0] == {"to_seconds": 100, "from_seconds": 100, "added_seconds": 80}
+    assert scores[2] == {"to_seconds": 50, "from_seconds": 50, "added_seconds": -200}
+    # One row and one column per leg, not one Directions call per candidate
+    assert len(calls) == 4
+
+
+def test_leg_cache_skips_known_legs():
+    matrix_fn, calls = _matrix(lambda o, d: 60)
+    cache = LegCache()
+    insertions = [("c0", 0), ("c1", 0)]
+    first = score_insertions(["A", "B"], [100], insertions, matrix_fn, leg_cache=cache)
+    assert len(calls) == 2
+    again = score_insertions(["A", "B"], [100], insertions, matrix_fn, leg_cache=cache)
+    assert again == first and len(calls) == 2
+
+
+def test_missing_route_scores_none():
+    def matrix_fn(origins, destinations):
+        return {"status": "OK", "rows": [{"elements": [{"status": "ZERO_RESULTS"} for _ in destinations]}
+                                         for _ in origins]}
+
+    assert score_insertions(["A", "B"], [100], [("c0", 0)], matrix_fn) == [None]
+
+
+def test_async_scores_match_the_threaded_ones():
+    matrix_fn, _ = _matrix(lambda o, d: len(o) * 10 + len(d))
+    insertions = [(f"cand{i}", i % 3) for i in range(40)]
+    stops = ["A", "BB", "CCC", "DDDD"]
+
+    async def amatrix_fn(origins, destinations):
+        return matrix_fn(origins, destinations)
+
+    async def collect():
+        scores = [None] * len(insertions)
+        async for i, score in aiter_insertion_scores(stops, [10, 20, 30], insertions, amatrix_fn):
+            scores[i] = score
+        return scores
+
+    assert asyncio.run(collect()) == score_insertions(stops, [10, 20, 30], insertions, matrix_fn)
@@ -0,0 +1,94 @@
+# test_geo.py
+import math
+
+import numpy as np
+import pytest
+
+import geo
+from geo import (
+    cumulative_distance, decode_polyline, encode_polyline, haversine_matrix, haversine_meters,
+    haversine_pairs, project_onto_path, sample_along_polyline,
+)
+
+# Google's documented example polyline
+EXAMPLE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+EXAMPLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def _scalar_decode(polyline_str):
+    """The per-character decoder geo.decode_polyline replaced."""
+    index, lat, lng, points = 0, 0, 0, []
+    while index < len(polyline_str):
+        for axis in range(2):
+            shift = result = 0
+            while True:
+                b = ord(polyline_str[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lng += delta
+        points.append((lat / 1e5, lng / 1e5))
+    return points
+
+
+def test_decode_example():
+    np.testing.assert_allclose(decode_polyline(EXAMPLE), EXAMPLE_POINTS)
+    assert decode_polyline("").shape == (0, 2)
+
+
+def test_decode_matches_scalar_decoder_and_round_trips():
+    rng = np.random.default_rng(0)
+    points = np.round(np.cumsum(rng.normal(0, 0.01, (500, 2)), axis=0) + (43.65, -79.38), 5)
+    encoded = encode_polyline(points)
+    decoded = decode_polyline(encoded)
+    np.testing.assert_allclose(decoded, _scalar_decode(encoded))
+    np.testing.assert_allclose(decoded, points, atol=1e-9)
+
+
+def test_haversine_forms_agree():
+    a, b = (43.65, -79.38), (45.50, -73.57)
+    assert haversine_meters(a, b) == pytest.approx(504_000, rel=0.01)
+    assert haversine_pairs(a, b) == pytest.approx(haversine_meters(a, b))
+    matrix = haversine_matrix([a, b], [a, b])
+    assert matrix.shape == (2, 2)
+    assert matrix[0, 0] == 0 and matrix[0, 1] == pytest.approx(haversine_meters(a, b))
+
+
+def test_samples_are_evenly_spaced():
+    path = np.array([(0.0, 0.0), (0.0, 0.05), (0.05, 0.05)])
+    total = cumulative_distance(path)[-1]
+    samples = sample_along_polyline(path, every_m=1000)
+    assert len(samples) == math.floor(total / 1000) + 1
+    np.testing.assert_allclose(samples[0], path[0])
+    _, along = project_onto_path(path, samples)
+    np.testing.assert_allclose(np.diff(along), 1000, rtol=1e-3)
+
+
+def test_degenerate_paths():
+    assert sample_along_polyline(np.empty((0, 2))).shape == (0, 2)
+    np.testing.assert_allclose(sample_along_polyline([(1.0, 2.0), (1.0, 2.0)]), [(1.0, 2.0)])
+    offsets, alongs = project_onto_path([(0.0, 0.0)], [(0.0, 0.01)])
+    assert offsets[0] == pytest.approx(1112, rel=0.01) and alongs[0] == 0
+
+
+def test_projection_offset_and_along():
+    path = np.array([(0.0, 0.0), (0.0, 0.1)])
+    offsets, alongs = project_onto_path(path, [(0.01, 0.05), (0.0, -0.01), (0.0, 0.2)])
+    np.testing.assert_allclose(offsets, [1112, 1112, 11120], rtol=0.01)
+    np.testing.assert_allclose(alongs, [5560, 0, 11120], rtol=0.01)
+
+
+def test_projection_chunks_give_the_same_answer(monkeypatch):
+    rng = np.random.default_rng(1)
+    path = np.cumsum(rng.normal(0, 0.001, (200, 2)), axis=0)
+    points = rng.normal(0, 0.01, (300, 2))
+    whole = project_onto_path(path, points)
+    monkeypatch.setattr(geo, "PROJECT_CHUNK_ELEMENTS", 1000)
+    chunked = project_onto_path(path, points)
+    np.testing.assert_allclose(whole, chunked)
@@ -0,0 +1,48 @@
+# test_maps_cache.py
+from maps_cache import LRUStore, MapsCache, SQLiteStore, normalize_key
+
+
+def test_key_ignores_api_key_and_rounds_coordinates():
+    assert normalize_key("nearby", {"location": "43.642612,-79.387111", "key": "a"}) == normalize_key(
+        "nearby", {"location": "43.6426121,-79.3871109", "key": "b"}
+    )
+    assert normalize_key("nearby", {"location": "43.6426,-79.3871"}) != normalize_key(
+        "nearby", {"location": "43.6427,-79.3871"}
+    )
+
+
+def test_key_folds_free_text_only():
+    assert normalize_key("nearby", {"keyword": " Coffee  Shop"}) == normalize_key("nearby", {"keyword": "coffee shop"})
+    assert normalize_key("nearby", {"type": "Cafe"}) != normalize_key("nearby", {"type": "cafe"})
+
+
+def test_lru_evicts_least_recently_used():
+    store = LRUStore(2)
+    store.set("a", 1, float("inf"))
+    store.set("b", 2, float("inf"))
+    store.get("a")
+    store.set("c", 3, float("inf"))
+    assert store.get("b") is None
+    assert store.get("a") == (float("inf"), 1)
+    assert store.evictions == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    MapsCache(disk=SQLiteStore(path)).set("geocode", {"address": "CN Tower"}, {"status": "OK"})
+    cache = MapsCache(disk=SQLiteStore(path))
+    assert cache.get("geocode", {"address": "cn tower"}) == {"status": "OK"}
+    assert cache.stats()["endpoints"]["geocode"]["disk_hits"] == 1
+
+
+def test_uncacheable_responses_are_refetched():
+    cache = MapsCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {"status": "OVER_QUERY_LIMIT"}
+
+    for _ in range(2):
+        cache.get_or_fetch("nearby", {"keyword": "x"}, fetch, cacheable=lambda r: r["status"] == "OK")
+    assert len(calls) == 2
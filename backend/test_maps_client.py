@@ -0,0 +1,108 @@
+# test_maps_client.py
+import asyncio
+
+import httpx
+import pytest
+import requests
+
+from maps_client import AsyncMapsClient, MapsClient
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self._data = data if data is not None else {"status": "OK"}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+def _client(monkeypatch, answers, **kwargs):
+    """A MapsClient whose session replays answers (responses or exceptions) in order."""
+    client = MapsClient("key", backoff_base=0, **kwargs)
+    calls = []
+
+    def get(url, params, timeout):
+        calls.append(params)
+        answer = answers[len(calls) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(client.session, "get", get)
+    return client, calls
+
+
+def test_transient_status_is_retried(monkeypatch):
+    client, calls = _client(monkeypatch, [
+        FakeResponse(data={"status": "OVER_QUERY_LIMIT"}),
+        FakeResponse(503),
+        FakeResponse(data={"status": "OK", "results": [1]}),
+    ])
+    assert client.get("geocode", {"address": "x"}) == {"status": "OK", "results": [1]}
+    assert len(calls) == 3 and calls[0]["key"] == "key"
+    stats = client.stats()["geocode"]
+    assert stats["retries"] == 2 and stats["errors"] == 2 and stats["calls"] == 3
+
+
+def test_persistent_google_status_is_returned(monkeypatch):
+    client, calls = _client(monkeypatch, [FakeResponse(data={"status": "UNKNOWN_ERROR"})] * 3, max_retries=2)
+    assert client.get("nearby", {})["status"] == "UNKNOWN_ERROR"
+    assert len(calls) == 3
+
+
+def test_connection_errors_raise_once_retries_run_out(monkeypatch):
+    client, calls = _client(monkeypatch, [requests.ConnectionError("down")] * 2, max_retries=1)
+    with pytest.raises(requests.ConnectionError):
+        client.get("geocode", {})
+    assert len(calls) == 2
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    client, calls = _client(monkeypatch, [FakeResponse(400)])
+    with pytest.raises(requests.HTTPError):
+        client.get("geocode", {})
+    assert len(calls) == 1
+
+
+def test_backoff_is_jittered_and_grows():
+    client = MapsClient("key", backoff_base=0.25)
+    for attempt in range(4):
+        waits = [client._backoff(attempt) for _ in range(50)]
+        assert all(0 <= w <= 0.25 * 2 ** attempt for w in waits)
+        assert len(set(waits)) > 1
+
+
+def test_base_url_keeps_the_paths():
+    client = MapsClient("key", base_url="http://127.0.0.1:9999/")
+    assert client.urls["nearby"] == "http://127.0.0.1:9999/maps/api/place/nearbysearch/json"
+
+
+def test_async_client_retries():
+    answers = [httpx.Response(429), httpx.ConnectError("down"), httpx.Response(200, json={"status": "OK"})]
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        answer = answers[len(seen) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def main():
+        client = AsyncMapsClient("key", backoff_base=0)
+        await client.client.aclose()
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.get("directions", {"origin": "a", "destination": "b"}), client.stats()
+        finally:
+            await client.aclose()
+
+    data, stats = asyncio.run(main())
+    assert data == {"status": "OK"}
+    assert len(seen) == 3 and seen[0].url.params["key"] == "key"
+    assert stats["directions"]["retries"] == 2
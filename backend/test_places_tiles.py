@@ -0,0 +1,46 @@
+# test_places_tiles.py
+from places_tiles import PlaceTileStore, cells_for_circle, geohash_encode
+
+CENTER = (43.6426, -79.3871)
+
+
+def _place(place_id, lat, lng):
+    return {"place_id": place_id, "geometry": {"location": {"lat": lat, "lng": lng}}}
+
+
+def test_geohash_encode():
+    # Reference value from the geohash.org test vectors
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash_encode(*CENTER, 7) == geohash_encode(*CENTER, 9)[:7]
+
+
+def test_cells_inside_circle_are_a_subset():
+    touching, inside = cells_for_circle(*CENTER, 500)
+    assert inside and inside <= touching
+    assert geohash_encode(*CENTER) in inside
+
+
+def test_lookup_after_complete_record(tmp_path):
+    store = PlaceTileStore(tmp_path / "tiles.sqlite3")
+    near = _place("near", CENTER[0] + 0.001, CENTER[1])
+    far = _place("far", CENTER[0] + 0.02, CENTER[1])
+    store.record(*CENTER, 1500, "cafe", None, [far, near], complete=True)
+
+    # A smaller circle inside the fetched one is answered locally, nearest first
+    assert [p["place_id"] for p in store.lookup(*CENTER, 500, "cafe")] == ["near"]
+    # Other queries and circles reaching past the fetched area still go to Google
+    assert store.lookup(*CENTER, 500, "bar") is None
+    assert store.lookup(*CENTER, 3000, "cafe") is None
+    assert store.stats()["hits"] == 1
+
+
+def test_incomplete_record_is_not_served(tmp_path):
+    store = PlaceTileStore(tmp_path / "tiles.sqlite3")
+    store.record(*CENTER, 1500, "cafe", None, [_place("near", CENTER[0] + 0.001, CENTER[1])], complete=False)
+    assert store.lookup(*CENTER, 500, "cafe") is None
+
+
+def test_stale_tiles_are_not_served(tmp_path):
+    store = PlaceTileStore(tmp_path / "tiles.sqlite3", ttl=-1)
+    store.record(*CENTER, 1500, "cafe", None, [], complete=True)
+    assert store.lookup(*CENTER, 500, "cafe") is None
@@ -0,0 +1,74 @@
+# test_profiling.py
+import json
+import logging
+import time
+
+import metrics
+import profiling
+from profiling import Profiler, folded
+
+
+def _profile(profiler, name="suggest_stops"):
+    trace = metrics.Trace(name)
+    profile_id = profiler.start(trace, "/suggest_stops")
+    with metrics.active(trace):
+        with metrics.span("geocode"):
+            time.sleep(0.02)
+    trace.finish()
+    return profile_id
+
+
+def test_profile_is_saved_with_timeline_and_stacks(tmp_path):
+    profiler = Profiler(tmp_path, interval=0.001)
+    profile_id = _profile(profiler)
+    profile = profiler.get(profile_id)
+    assert profile["route"] == "/suggest_stops"
+    assert profile["samples"]["count"] > 0
+    assert folded(profile).endswith("\n")
+    assert [p["id"] for p in profiler.list()] == [profile_id]
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    profiler = Profiler(tmp_path, keep=2)
+    ids = []
+    for _ in range(3):
+        ids.append(_profile(profiler))
+        time.sleep(0.01)
+    assert {p["id"] for p in profiler.list()} == set(ids[1:])
+
+
+def test_max_active(tmp_path):
+    profiler = Profiler(tmp_path, max_active=1)
+    first, second = metrics.Trace("a"), metrics.Trace("b")
+    assert profiler.start(first, "/a") is not None
+    assert profiler.start(second, "/b") is None
+    first.finish()
+
+
+def test_token(tmp_path):
+    open_profiler = Profiler(tmp_path)
+    assert open_profiler.authorized("1") and not open_profiler.authorized("false")
+    locked = Profiler(tmp_path, token="s3cret")
+    assert locked.authorized("s3cret") and not locked.authorized("1")
+
+
+def test_download_needs_the_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "_profiler", Profiler(tmp_path, token="s3cret"))
+    monkeypatch.setenv("PROFILING_ENABLED", "1")
+    status, body, _ = profiling.download(None, {}, {})
+    assert status == 403
+    status, body, _ = profiling.download(None, {"X-Profile": "s3cret"}, {})
+    assert status == 200 and json.loads(body) == {"profiles": []}
+
+
+def test_missing_token_is_warned_about(tmp_path, monkeypatch, caplog):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.delenv("PROFILING_TOKEN", raising=False)
+    with caplog.at_level(logging.WARNING, logger="profiling"):
+        Profiler.from_env()
+    assert "PROFILING_TOKEN" in caplog.text
+    caplog.clear()
+    monkeypatch.setenv("PROFILING_TOKEN", "s3cret")
+    with caplog.at_level(logging.WARNING, logger="profiling"):
+        Profiler.from_env()
+    assert caplog.text == ""
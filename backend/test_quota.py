@@ -0,0 +1,43 @@
+# test_quota.py
+import pytest
+
+from quota import MemoryBucketStore, QuotaGovernor, SQLiteBucketStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBucketStore()
+    return SQLiteBucketStore(tmp_path / "quota.sqlite3")
+
+
+def test_burst_is_free_then_callers_wait(store):
+    waits = [store.reserve("nearby", rate=10.0, burst=3) for _ in range(5)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    # Each call past the burst goes one more token into debt
+    assert waits[3] == pytest.approx(0.1, abs=0.02)
+    assert waits[4] == pytest.approx(0.2, abs=0.02)
+
+
+def test_buckets_are_per_key(store):
+    store.reserve("nearby", rate=1.0, burst=1)
+    assert store.reserve("nearby", rate=1.0, burst=1) > 0
+    assert store.reserve("directions", rate=1.0, burst=1) == 0.0
+
+
+def test_sqlite_buckets_are_shared_between_connections(tmp_path):
+    path = tmp_path / "quota.sqlite3"
+    SQLiteBucketStore(path).reserve("nearby", rate=1.0, burst=1)
+    assert SQLiteBucketStore(path).reserve("nearby", rate=1.0, burst=1) > 0
+
+
+def test_governor_rates_and_costs():
+    governor = QuotaGovernor(MemoryBucketStore(), rates={"nearby": 2.0, "geocode": 0}, default_rate=5.0)
+    assert governor.rate_for("nearby") == 2.0
+    assert governor.rate_for("directions") == 5.0
+    assert governor.rate_for("distance_matrix") == 1000.0
+    # A zero rate means unlimited
+    assert all(governor.reserve("geocode") == 0.0 for _ in range(100))
+    # A request costing more than the burst still fits in an empty bucket
+    assert governor.reserve("distance_matrix", cost=5000) == 0.0
+    assert governor.reserve("distance_matrix", cost=1000) == pytest.approx(1.0, abs=0.05)
@@ -0,0 +1,132 @@
+# test_reservation_agent.py
+import asyncio
+
+import pytest
+
+pytest.importorskip("agent")
+pytest.importorskip("computer")
+
+from reservation_agent import ReservationAgent, RunBudget  # noqa: E402
+
+
+def _classify(message, status="pending"):
+    # classify_message only reads the message; skip __init__ (it reads the environment)
+    result = {"status": status}
+    final = ReservationAgent.__new__(ReservationAgent).classify_message(message, result)
+    return final, result
+
+
+def test_confirmation_number_is_final():
+    final, result = _classify("Your table is booked. Confirmation number: AB12CD.")
+    assert final
+    assert result["status"] == "confirmed"
+    assert result["confirmation_number"] == "AB12CD"
+
+
+def test_confirmation_without_code_is_not_final():
+    final, result = _classify("A confirmation number will be emailed to you shortly.")
+    assert not final
+    assert result["status"] == "confirmed"
+    assert "confirmation_number" not in result
+
+
+def test_one_slot_fully_booked_is_not_final():
+    final, result = _classify("7:00 PM is fully booked, trying 7:30 PM next.")
+    assert not final
+    assert result["status"] == "no_availability"
+
+
+def test_no_availability_all_week_is_final():
+    final, result = _classify("There is no availability for the whole week.")
+    assert final
+    assert result["status"] == "no_availability"
+
+
+def test_phone_only():
+    final, result = _classify("They don't take online reservations; call (416) 555-0123 to book.")
+    assert final
+    assert result["status"] == "requires_phone_call"
+    assert result["phone_for_manual_booking"] == "(416) 555-0123"
+
+
+def test_outcome_line_wins():
+    final, result = _classify("Tried every slot.\nOUTCOME: NO_AVAILABILITY")
+    assert final
+    assert result["status"] == "no_availability"
+
+
+def test_budget_reports_first_limit_reached():
+    budget = RunBudget(max_turns=10, max_seconds=60, max_tokens=1000)
+    assert budget.exceeded(9, 999, 59) is None
+    assert budget.exceeded(10, 5000, 100) == "max_turns"
+    assert budget.exceeded(1, 1000, 100) == "max_tokens"
+    assert budget.exceeded(1, 1, 60) == "max_seconds"
+
+
+def test_budget_overrides(monkeypatch):
+    monkeypatch.setenv("RESERVATION_MAX_TURNS", "7")
+    budget = RunBudget.from_env(max_tokens=123, max_seconds=None)
+    assert budget.limits() == {"max_turns": 7, "max_seconds": 600.0, "max_tokens": 123}
+
+
+def test_confirmation_number_is_phrasing():
+    final, result = _classify("Done! Your confirmation number is ABC123")
+    assert final
+    assert result["confirmation_number"] == "ABC123"
+
+
+def test_settled_run_closes_the_agent_stream():
+    closed = []
+
+    class FakeAgent:
+        async def run(self, prompt):
+            try:
+                yield {"output": [{"type": "message", "content": [{"text": "Confirmation: XY12ZW"}]}]}
+                yield {"output": [{"type": "message", "content": [{"text": "still clicking"}]}]}
+            finally:
+                closed.append(True)
+
+    reservations = ReservationAgent.__new__(ReservationAgent)
+    reservations.budget = RunBudget(max_turns=10, max_seconds=60, max_tokens=None)
+    reservations.memory = None
+    place = {"name": "Cafe", "vicinity": "1 Main St", "place_id": "p1"}
+    details = {"party_size": 2, "date": "2026-10-20", "time": "19:00", "name": "A", "phone": "", "email": ""}
+
+    async def main():
+        result = await reservations.run_reservation(FakeAgent(), place, details)
+        # Checked before asyncio.run's own cleanup would close the generator anyway
+        assert closed == [True]
+        return result
+
+    result = asyncio.run(main())
+    assert result["status"] == "confirmed"
+    assert result["budget"]["turns"] == 1
+
+
+def test_errored_run_is_reported_to_the_pool():
+    from contextlib import asynccontextmanager
+
+    class FakePool:
+        failed = []
+
+        @asynccontextmanager
+        async def lease(self):
+            yield "computer"
+
+        def report_failure(self, computer):
+            self.failed.append(computer)
+
+    async def no_page(computer, known_path):
+        pass
+
+    async def errored(agent, place_data, details, known_path=None):
+        return {"status": "error"}
+
+    reservations = ReservationAgent.__new__(ReservationAgent)
+    reservations.pool, reservations.memory = FakePool(), None
+    reservations.open_booking_page = no_page
+    reservations.new_agent = lambda computer: None
+    reservations.run_reservation = errored
+    result = asyncio.run(reservations.make_reservation({"place_id": "p1"}, {}))
+    assert result["status"] == "error"
+    assert FakePool.failed == ["computer"]
@@ -0,0 +1,195 @@
+# test_reservation_jobs.py
+import asyncio
+import sqlite3
+import time
+
+from reservation_jobs import (
+    FAILED, INTERRUPTED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobStore,
+)
+
+
+def _store(tmp_path):
+    return JobStore(tmp_path / "jobs.sqlite3")
+
+
+def test_claim_is_atomic(tmp_path):
+    store = _store(tmp_path)
+    job = store.create("single", {"name": "x"})
+    claimed = store.claim(job["id"], "a")
+    assert claimed["status"] == RUNNING and claimed["owner"] == "a" and claimed["attempts"] == 1
+    assert store.claim(job["id"], "b") is None
+    # A second connection to the same file sees the job as taken too
+    assert JobStore(tmp_path / "jobs.sqlite3").claim(job["id"], "c") is None
+
+
+def test_heartbeat_only_renews_own_lease(tmp_path):
+    store = _store(tmp_path)
+    job = store.create("single", {})
+    store.claim(job["id"], "a")
+    assert store.heartbeat(job["id"], "a")
+    assert not store.heartbeat(job["id"], "b")
+    store.update(job["id"], status=SUCCEEDED)
+    assert not store.heartbeat(job["id"], "a")
+
+
+def test_interrupt_expired_only_touches_stale_running_jobs(tmp_path):
+    store = _store(tmp_path)
+    stale, live, queued = (store.create("single", {}) for _ in range(3))
+    store.claim(stale["id"], "a")
+    store.claim(live["id"], "a")
+    store.update(stale["id"], heartbeat_at=time.time() - 120)
+
+    assert store.interrupt_expired(60) == [stale["id"]]
+    assert store.get(stale["id"])["status"] == INTERRUPTED
+    assert store.get(stale["id"])["error"]
+    assert store.get(live["id"])["status"] == RUNNING
+    assert store.get(queued["id"])["status"] == QUEUED
+
+
+def test_old_schema_is_migrated(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE reservation_jobs ("
+        " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+        " payload TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+        " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+    )
+    conn.commit()
+    conn.close()
+    store = JobStore(path)
+    job = store.create("single", {})
+    assert store.claim(job["id"], "a")["owner"] == "a"
+
+
+def test_restart_interrupts_lost_runs_and_resumes_queued_jobs(tmp_path):
+    store = _store(tmp_path)
+    lost = store.create("single", {"n": 1})
+    store.claim(lost["id"], "dead-worker")
+    store.update(lost["id"], heartbeat_at=time.time() - 120)
+    waiting = store.create("single", {"n": 2})
+    calls = []
+
+    async def run(payload, progress):
+        calls.append(payload["n"])
+        await progress({"step": 1})
+        return {"ok": True}
+
+    async def main():
+        queue = JobQueue(store, {"single": run}, workers=1, lease_seconds=60)
+        await queue.start()
+        try:
+            done = await asyncio.wait_for(queue.wait(waiting["id"]), 5)
+        finally:
+            await queue.stop()
+        return done
+
+    done = asyncio.run(main())
+    assert calls == [2]
+    assert done["status"] == SUCCEEDED
+    assert done["result"] == {"ok": True}
+    assert done["progress"] == [{"step": 1}]
+    assert store.get(lost["id"])["status"] == INTERRUPTED
+
+
+def test_failed_run_is_not_retried(tmp_path):
+    store = _store(tmp_path)
+    calls = []
+
+    async def run(payload, progress):
+        calls.append(1)
+        raise RuntimeError("boom")
+
+    async def main():
+        queue = JobQueue(store, {"single": run}, workers=2)
+        await queue.start()
+        try:
+            job = await queue.submit("single", {})
+            return await asyncio.wait_for(queue.wait(job["id"]), 5)
+        finally:
+            await queue.stop()
+
+    done = asyncio.run(main())
+    assert done["status"] == FAILED and done["error"] == "boom"
+    assert calls == [1]
+
+
+def test_stop_marks_running_job_interrupted(tmp_path):
+    store = _store(tmp_path)
+
+    async def main():
+        started = asyncio.Event()
+
+        async def run(payload, progress):
+            started.set()
+            await asyncio.sleep(60)
+
+        queue = JobQueue(store, {"single": run}, workers=1)
+        await queue.start()
+        job = await queue.submit("single", {})
+        await asyncio.wait_for(started.wait(), 5)
+        await queue.stop()
+        return job["id"]
+
+    job_id = asyncio.run(main())
+    assert store.get(job_id)["status"] == INTERRUPTED
+
+
+def test_wait_on_unknown_job_returns_none(tmp_path):
+    async def main():
+        queue = JobQueue(_store(tmp_path), {}, workers=0)
+        await queue.start()
+        try:
+            return await queue.wait("missing")
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main()) is None
+
+
+def test_update_running_needs_the_lease(tmp_path):
+    store = _store(tmp_path)
+    job = store.create("single", {})
+    assert not store.update_running(job["id"], "a", status=SUCCEEDED)
+    store.claim(job["id"], "a")
+    assert not store.update_running(job["id"], "b", status=SUCCEEDED)
+    assert store.update_running(job["id"], "a", progress=[{"step": 1}])
+    store.interrupt_expired(-1)
+    assert not store.update_running(job["id"], "a", status=SUCCEEDED, result={"ok": True})
+    assert store.get(job["id"])["status"] == INTERRUPTED
+
+
+def test_lost_lease_cancels_the_run(tmp_path):
+    store = _store(tmp_path)
+
+    async def main():
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def run(payload, progress):
+            if payload.get("quick"):
+                return {"ok": True}
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        queue = JobQueue(store, {"single": run}, workers=1, lease_seconds=0.3)
+        await queue.start()
+        try:
+            job = await queue.submit("single", {})
+            await asyncio.wait_for(started.wait(), 5)
+            # Another process decided the run was lost
+            store.interrupt_expired(-1)
+            await asyncio.wait_for(cancelled.wait(), 5)
+            # The worker survives and picks up the next job
+            quick = await queue.submit("single", {"quick": True})
+            done = await asyncio.wait_for(queue.wait(quick["id"]), 5)
+        finally:
+            await queue.stop()
+        return job["id"], done
+
+    job_id, done = asyncio.run(main())
+    assert store.get(job_id)["status"] == INTERRUPTED
+    assert done["status"] == SUCCEEDED
@@ -0,0 +1,137 @@
+# test_route_service.py
+import asyncio
+import importlib
+import json
+import sys
+import threading
+
+import httpx
+import pytest
+
+import fake_maps
+import profiling
+
+REQUEST = {
+    "stops": ["43.6400,-79.3800", "43.6600,-79.4000", "43.7000,-79.4200"],
+    "desired_type": "cafe",
+    "max_candidates": 5,
+}
+
+
+@pytest.fixture(scope="module")
+def service():
+    server = fake_maps.serve(fake_maps.FakeMaps())
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("MAPS_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+        mp.setenv("GOOGLE_API_KEY", "fake")
+        mp.setenv("MAPS_CACHE_DISABLED", "1")
+        mp.setenv("MAPS_QUOTA_DISABLED", "1")
+        mp.setenv("SUGGEST_CACHE_DISABLED", "1")
+        mp.setenv("PROFILING_ENABLED", "0")
+        mp.setenv("LOG_LEVEL", "WARNING")
+        for name in ("route_service", "suggest_core"):
+            sys.modules.pop(name, None)
+        yield importlib.import_module("route_service")
+    server.shutdown()
+
+
+@pytest.fixture
+def rs(service, monkeypatch):
+    # Pooled connections belong to the loop that opened them; every test runs its own.
+    monkeypatch.setattr(service.maps, "client", httpx.AsyncClient(timeout=10))
+    return service
+
+
+def call(rs, fn):
+    async def main():
+        transport = httpx.ASGITransport(app=rs.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t", timeout=30) as client:
+            return await fn(client)
+
+    return asyncio.run(main())
+
+
+def test_suggest_stops(rs):
+    async def go(client):
+        return await client.post("/suggest_stops", json=REQUEST)
+
+    r = call(rs, go)
+    assert r.status_code == 200
+    body = r.json()
+    assert 0 < len(body["candidates"]) <= REQUEST["max_candidates"]
+    assert body["route_summary"]["search_plan"]["queries"] > 0
+
+
+def test_stream_ends_with_summary(rs):
+    async def go(client):
+        async with client.stream("POST", "/suggest_stops?stream=ndjson", json=REQUEST) as r:
+            assert r.status_code == 200
+            return [json.loads(line)["event"] async for line in r.aiter_lines() if line]
+
+    events = call(rs, go)
+    assert events[-1] == "summary"
+
+
+def test_bad_stops_are_rejected(rs):
+    async def go(client):
+        return await client.post("/suggest_stops", json={"stops": [1]})
+
+    assert call(rs, go).status_code == 400
+
+
+def test_numpy_work_runs_off_the_loop(rs, monkeypatch):
+    threads = {}
+
+    def spy(name, fn):
+        def wrapper(*args, **kwargs):
+            threads[name] = threading.current_thread()
+            return fn(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(rs, "plan_search", spy("plan_search", rs.plan_search))
+    monkeypatch.setattr(rs, "rank_candidates", spy("rank_candidates", rs.rank_candidates))
+
+    async def go(client):
+        loop_thread = threading.current_thread()
+        r = await client.post("/suggest_stops", json=REQUEST)
+        return loop_thread, r
+
+    loop_thread, r = call(rs, go)
+    assert r.status_code == 200
+    assert set(threads) == {"plan_search", "rank_candidates"}
+    assert all(t is not loop_thread for t in threads.values())
+
+
+def test_shutdown_cancels_page_fetches(rs):
+    async def main():
+        async with rs.lifespan(rs.app):
+            query = ({"location": "43.64,-79.38", "radius": 1000}, 43.64, -79.38, 1000, None, None)
+            pages = rs.AsyncNearbyPages(query, [], "token")
+            assert pages._task in rs._page_tasks
+        return pages._task
+
+    task = asyncio.run(main())
+    assert task.cancelled()
+    assert not rs._page_tasks
+
+
+def test_profile_is_written_off_the_loop(rs, monkeypatch, tmp_path):
+    profiler = profiling.Profiler(tmp_path)
+    saved_on = []
+    save = profiler.save
+
+    def spy(profile_id, profile):
+        saved_on.append(threading.current_thread())
+        save(profile_id, profile)
+
+    monkeypatch.setattr(profiler, "save", spy)
+    monkeypatch.setattr(profiling, "get_profiler", lambda: profiler)
+
+    async def go(client):
+        r = await client.post("/suggest_stops", json=REQUEST, headers={"X-Profile": "1"})
+        return threading.current_thread(), r
+
+    loop_thread, r = call(rs, go)
+    assert r.status_code == 200
+    assert profiler.get(r.headers["X-Profile-Id"]) is not None
+    assert saved_on and saved_on[0] is not loop_thread
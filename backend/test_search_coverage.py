@@ -0,0 +1,94 @@
+# test_search_coverage.py
+import math
+
+import numpy as np
+import pytest
+
+from geo import EARTH_RADIUS_M, haversine_matrix, sample_along_polyline
+from search_coverage import default_corridor, plan_search_centers
+
+LAT = 43.65
+M_PER_DEG_LAT = math.pi * EARTH_RADIUS_M / 180.0
+M_PER_DEG_LNG = M_PER_DEG_LAT * math.cos(math.radians(LAT))
+
+
+def _route(xy_m):
+    """(lat, lng) path from planar (east, north) meters around (LAT, -79.38)."""
+    xy = np.asarray(xy_m, dtype=np.float64)
+    return np.column_stack((LAT + xy[:, 1] / M_PER_DEG_LAT, -79.38 + xy[:, 0] / M_PER_DEG_LNG))
+
+
+STRAIGHT = _route([(0, 0), (20_000, 0)])
+# Switchbacks: the corridor folds back on itself every 3 km
+ZIGZAG = _route([(0, 0), (3000, 0), (3000, 800), (0, 800), (0, 1600), (3000, 1600), (3000, 2400)])
+
+
+def _corridor_coverage(path, corridor_m, centers, step=40.0):
+    """Fraction of a dense corridor grid inside some circle, measured with haversine."""
+    cols = (path[:, 1] - path[0, 1]) * M_PER_DEG_LNG
+    rows = (path[:, 0] - path[0, 0]) * M_PER_DEG_LAT
+    xy = np.column_stack((cols, rows))
+    points = []
+    for a, b in zip(xy[:-1], xy[1:]):
+        length = np.linalg.norm(b - a)
+        tangent = (b - a) / length
+        normal = np.array([-tangent[1], tangent[0]])
+        for t in np.arange(0.0, length, step):
+            for off in np.arange(-corridor_m, corridor_m + 1e-9, step):
+                points.append(a + t * tangent + off * normal)
+    points = np.asarray(points)
+    latlng = np.column_stack((path[0, 0] + points[:, 1] / M_PER_DEG_LAT, path[0, 1] + points[:, 0] / M_PER_DEG_LNG))
+    circles = np.asarray(centers, dtype=np.float64)
+    inside = haversine_matrix(latlng, circles[:, :2]) <= circles[None, :, 2]
+    return inside.any(axis=1).mean()
+
+
+@pytest.mark.parametrize("path", [STRAIGHT, ZIGZAG], ids=["straight", "zigzag"])
+@pytest.mark.parametrize("target", [0.8, 0.95, 1.0])
+def test_plan_meets_coverage_target(path, target):
+    centers, report = plan_search_centers(path, 1200, corridor_m=600, target=target)
+    assert report["strategy"] == "coverage"
+    assert report["coverage"] >= target
+    assert all(50 <= r <= 1200 for _, _, r in centers)
+    # Checked on a denser grid than the planner's own test points
+    assert _corridor_coverage(path, 600, centers) >= target - 0.02
+
+
+@pytest.mark.parametrize("path", [STRAIGHT, ZIGZAG], ids=["straight", "zigzag"])
+def test_more_coverage_never_costs_fewer_queries(path):
+    queries = [
+        plan_search_centers(path, 1200, corridor_m=600, target=t)[1]["queries"]
+        for t in (0.5, 0.8, 0.9, 0.95, 0.99, 1.0)
+    ]
+    assert queries == sorted(queries)
+
+
+@pytest.mark.parametrize("path", [STRAIGHT, ZIGZAG], ids=["straight", "zigzag"])
+def test_never_more_queries_than_naive(path):
+    for corridor in (200, 600, 1100):
+        centers, report = plan_search_centers(path, 1200, corridor_m=corridor, target=1.0, naive_every_m=1500)
+        assert report["queries"] == len(centers)
+        assert report["queries"] <= report["naive_queries"] == len(sample_along_polyline(path, 1500))
+
+
+def test_wide_corridor_falls_back_to_naive():
+    centers, report = plan_search_centers(STRAIGHT, 1200, corridor_m=1100, target=1.0, naive_every_m=1500)
+    assert report["strategy"] == "naive"
+    assert report["queries_saved"] == 0
+    assert all(r == 1200 for _, _, r in centers)
+
+
+def test_default_corridor_matches_fixed_spacing():
+    # 1200 m circles every 1500 m reach sqrt(1200^2 - 750^2) m off a straight route everywhere
+    assert default_corridor(1200, 1500) == pytest.approx(936.75, abs=0.01)
+    assert default_corridor(1200) == 600
+    assert default_corridor(1200, 3000) == 600
+    centers, report = plan_search_centers(STRAIGHT, 1200, naive_every_m=1500)
+    assert report["corridor_m"] == 936
+    assert report["queries"] <= report["naive_queries"]
+    assert _corridor_coverage(STRAIGHT, 936, centers) >= 0.95 - 0.02
+
+
+def test_single_point_route():
+    centers, report = plan_search_centers(STRAIGHT[:1], 1200)
+    assert len(centers) == 1 and report["coverage"] == 1.0
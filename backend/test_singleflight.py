@@ -0,0 +1,103 @@
+# test_singleflight.py
+import asyncio
+import threading
+import time
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", fn))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    # Give the followers time to join the leader's call
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(value == "value" for value, _ in results)
+    assert flight.in_flight() == 0
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = {}
+
+    def fn():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    def call(name, fn):
+        try:
+            flight.do("k", fn)
+        except ValueError as e:
+            errors[name] = e
+
+    leader = threading.Thread(target=call, args=("leader", fn))
+    leader.start()
+    started.wait(5)
+    # The follower's own fn would return normally; it must get the leader's error instead
+    follower = threading.Thread(target=call, args=("follower", lambda: "value"))
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors["follower"] is errors["leader"]
+    assert flight.in_flight() == 0
+
+
+def test_async_calls_share_one_run():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*(flight.do("k", fn) for _ in range(3)))
+        return calls, results, flight.in_flight()
+
+    calls, results, in_flight = asyncio.run(main())
+    assert calls == [1]
+    assert [shared for _, shared in results] == [False, True, True]
+    assert in_flight == 0
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "value"
+
+        leader = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leader, await follower
+
+    leader, (value, shared) = asyncio.run(main())
+    assert leader.cancelled()
+    assert value == "value" and shared
@@ -0,0 +1,56 @@
+# test_suggest_cache.py
+import threading
+import time
+
+from suggest_cache import HIT, STALE, SuggestCache, etag_for, etag_matches
+
+
+def test_etag_matches():
+    etag = etag_for({"a": 1})
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_etag_ignores_key_order():
+    assert etag_for({"a": 1, "b": 2}) == etag_for({"b": 2, "a": 1})
+
+
+def test_hit_then_stale_then_miss():
+    cache = SuggestCache(ttl=0.05, stale=0.1)
+    cache.set("k", {"candidates": []})
+    assert cache.get("k")[1] == HIT
+    time.sleep(0.06)
+    entry, state = cache.get("k")
+    assert state == STALE and entry["body"] == {"candidates": []}
+    time.sleep(0.1)
+    assert cache.get("k") == (None, None)
+
+
+def test_disabled_cache_never_hits():
+    cache = SuggestCache(ttl=0, stale=0)
+    cache.set("k", {})
+    assert cache.get("k") == (None, None)
+
+
+def test_refresh_runs_once_per_key():
+    cache = SuggestCache(ttl=60, stale=60)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"fresh": True}
+
+    cache.refresh("k", compute)
+    cache.refresh("k", compute)
+    release.set()
+    deadline = time.time() + 5
+    while cache.stats()["refreshing"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert calls == [1]
+    assert cache.get("k")[0]["body"] == {"fresh": True}
+
@@ -0,0 +1,43 @@
+# test_suggest_core.py
+import importlib
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def core():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("GOOGLE_API_KEY", "fake")
+        mp.setenv("MAPS_CACHE_DISABLED", "1")
+        mp.setenv("MAPS_QUOTA_DISABLED", "1")
+        mp.setenv("SUGGEST_CACHE_DISABLED", "1")
+        sys.modules.pop("suggest_core", None)
+        yield importlib.import_module("suggest_core")
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def set(self, *args):
+        self.calls.append(args)
+
+    def record(self, *args, complete):
+        self.calls.append((*args, complete))
+
+
+def test_partial_nearby_results_stay_out_of_maps_cache(core, monkeypatch):
+    cache, tiles = Recorder(), Recorder()
+    monkeypatch.setattr(core, "maps_cache", cache)
+    monkeypatch.setattr(core, "place_tiles", tiles)
+    params = {"location": "43.64,-79.38", "radius": 1000}
+    query = (params, 43.64, -79.38, 1000, "cafe", None)
+
+    core._store_nearby(query, [{"place_id": "a"}], False)
+    assert cache.calls == []
+    assert tiles.calls[-1][-1] is False
+
+    core._store_nearby(query, [{"place_id": "a"}, {"place_id": "b"}], True)
+    assert cache.calls == [("nearby", params, [{"place_id": "a"}, {"place_id": "b"}])]
+    assert tiles.calls[-1][-1] is True
@@ -109,14 +109,56 @@ const HomePage: React.FC = () => {
     };
 
     try {
-      const res = await fetch("http://127.0.0.1:5000/suggest_stops", {
+      const res = await fetch("http://127.0.0.1:5000/suggest_stops?stream=ndjson", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(payload),
       });
 
-      const data = await res.json();
-      setResponse(data);
+      // Error responses (e.g. 400) are plain JSON, not a stream
+      if (!res.ok || !res.body) {
+        setResponse(await res.json());
+        return;
+      }
+
+      // Render the route and each priced candidate as soon as it arrives;
+      // the final "summary" event carries the sorted result list.
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = "";
+      let partial: any = { candidates: [] };
+      const handleLine = (line: string) => {
+        if (!line.trim()) return;
+        const event = JSON.parse(line);
+        if (event.event === "route") {
+          partial = { ...partial, route_summary: event.route_summary };
+        } else if (event.event === "candidate") {
+          const candidates = [...partial.candidates, event.candidate].sort(
+            (a: any, b: any) => a.added_time_seconds - b.added_time_seconds
+          );
+          partial = { ...partial, candidates };
+        } else if (event.event === "summary") {
+          partial = { ...event };
+          delete partial.event;
+        } else if (event.event === "error") {
+          partial = { error: event.error };
+        } else {
+          return;
+        }
+        setResponse(partial);
+      };
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split("\n");
+        buffered = lines.pop() ?? "";
+        lines.forEach(handleLine);
+      }
+      // Flush the decoder (a multi-byte character may still be pending) and
+      // parse the last event even if the stream didn't end with a newline
+      buffered += decoder.decode();
+      handleLine(buffered);
     } catch (err) {
       console.error("Error:", err);
       alert("Error reaching backend API");